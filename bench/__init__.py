@@ -0,0 +1,35 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks. These aren't run as part of the test suite; run each one
+as a module (e.g. python -m bench.output_schema) from the repo root."""
+from time import perf_counter
+
+
+def time_calls(func, args_list):
+    """Call func(*args) for each args in *args_list*, and return
+    the average time per call, in seconds."""
+    args_list = list(args_list)
+
+    start = perf_counter()
+    for args in args_list:
+        func(*args)
+    return (perf_counter() - start) / len(args_list)
+
+
+def fake_company(i):
+    return 'Company {:d}'.format(i)
+
+
+def fake_brand(i, j):
+    return 'Brand {:d}-{:d}'.format(i, j)
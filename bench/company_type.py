@@ -0,0 +1,85 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare matching company types (Inc., GmbH, etc.) with
+COMPANY_TYPE_RE and with match_company_type(), for names of
+various lengths, with and without a company type."""
+import random
+from argparse import ArgumentParser
+
+from msd.company_data import COMPANY_TYPES
+from msd.company_data import COMPANY_TYPE_RE
+from msd.key import match_company_type
+
+from . import fake_company
+from . import time_calls
+
+
+def main(args=None):
+    opts = parse_args(args)
+
+    random.seed(opts.seed)
+
+    print('{:>8} {:>8} {:>12} {:>12}'.format(
+        'length', 'type?', 'regex (us)', 'index (us)'))
+
+    for num_words in (1, 4, 16, 64):
+        for with_type in (False, True):
+            names = [fake_name(i, num_words, with_type)
+                     for i in range(opts.num_names)]
+            args_list = [(name,) for name in names]
+
+            regex_time = time_calls(regex_match_company_type, args_list)
+            index_time = time_calls(match_company_type, args_list)
+
+            print('{:>8.0f} {:>8} {:>12.2f} {:>12.2f}'.format(
+                sum(len(name) for name in names) / len(names),
+                'yes' if with_type else 'no',
+                regex_time * 1e6, index_time * 1e6))
+
+
+def regex_match_company_type(s):
+    """Match COMPANY_TYPE_RE, and get the groups callers need."""
+    m = COMPANY_TYPE_RE.match(s)
+    return m and m.group('company', 'intl1', 'type', 'intl2')
+
+
+def fake_name(i, num_words, with_type):
+    """Make a company name with *num_words* extra words, optionally
+    ending with a company type."""
+    words = [fake_company(i)] + [
+        random.choice(['Foods', 'and', 'Sons', 'Trading', '&'])
+        for _ in range(num_words - 1)]
+
+    if with_type:
+        words[-1] += ','
+        words.append(random.choice(COMPANY_TYPES))
+
+    return ' '.join(words)
+
+
+def parse_args(args=None):
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n', '--num-names', dest='num_names', type=int, default=20000,
+        help='Number of names to match for each length'
+        ' (default: %(default)s)')
+    parser.add_argument(
+        '-s', '--seed', dest='seed', type=int, default=0,
+        help='Random seed (default: %(default)s)')
+
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare size and lookup latency of the name index (see
+msd.name_index) with looking up the same names in msd.sqlite with
+msd.query (which also fetches whole rating and claim rows)."""
+import random
+from argparse import ArgumentParser
+from os.path import getsize
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from msd.db import open_db
+from msd.name_index import NameIndex
+from msd.name_index import write_name_index
+from msd.output import save_output_db
+from msd.query import Query
+
+from . import time_calls
+from .output_schema import fill_fake_output_db
+from .query import fake_name_stream
+from .query import fill_fake_names
+
+
+def main(args=None):
+    opts = parse_args(args)
+
+    random.seed(opts.seed)
+
+    tmp_dir = mkdtemp()
+    try:
+        output_db = open_db(':memory:')
+        with output_db:
+            fill_fake_output_db(output_db, opts.num_companies)
+            fill_fake_names(output_db, opts.num_companies)
+
+        db_path = join(tmp_dir, 'msd.sqlite')
+        save_output_db(output_db, db_path, without_rowid=True)
+
+        index_path = join(tmp_dir, 'msd-names.bin')
+        write_name_index(output_db, index_path)
+        output_db.close()
+
+        names = [(name,) for name in fake_name_stream(
+            opts.num_companies, opts.num_lookups)]
+
+        query = Query(db_path, cache_size=0)
+        try:
+            sqlite_time = time_calls(query.lookup, names)
+        finally:
+            query.close()
+
+        with NameIndex(index_path) as name_index:
+            index_time = time_calls(name_index.lookup, names)
+
+        print('{:>12} {:>12} {:>12}'.format(
+            'format', 'size (KB)', 'lookup (us)'))
+        print('{:>12} {:>12.0f} {:>12.1f}'.format(
+            'msd.sqlite', getsize(db_path) / 1024, sqlite_time * 1e6))
+        print('{:>12} {:>12.0f} {:>12.1f}'.format(
+            'name index', getsize(index_path) / 1024, index_time * 1e6))
+    finally:
+        rmtree(tmp_dir)
+
+
+def parse_args(args=None):
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n', '--num-companies', dest='num_companies', type=int,
+        default=1000,
+        help='Number of fake companies (default: %(default)s)')
+    parser.add_argument(
+        '-l', '--num-lookups', dest='num_lookups', type=int, default=20000,
+        help='Number of lookups to time (default: %(default)s)')
+    parser.add_argument(
+        '-s', '--seed', dest='seed', type=int, default=0,
+        help='Random seed (default: %(default)s)')
+
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compare size and lookup latency of the output DB with ordinary
+rowid tables and with WITHOUT ROWID tables (see save_output_db())."""
+import random
+from argparse import ArgumentParser
+from os.path import getsize
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from msd.db import open_db
+from msd.merge import create_output_table
+from msd.merge import output_row
+from msd.output import save_output_db
+
+from . import fake_brand
+from . import fake_company
+from . import time_calls
+
+
+def main(args=None):
+    opts = parse_args(args)
+
+    random.seed(opts.seed)
+
+    tmp_dir = mkdtemp()
+    try:
+        output_db = open_db(':memory:')
+        with output_db:
+            fill_fake_output_db(output_db, opts.num_companies)
+
+        print('{:>14} {:>12} {:>12} {:>12}'.format(
+            'schema', 'size (KB)', 'claim (us)', 'rating (us)'))
+
+        for without_rowid in (False, True):
+            path = join(tmp_dir, 'msd-{}.sqlite'.format(without_rowid))
+            save_output_db(output_db, path, without_rowid=without_rowid)
+
+            claim_us, rating_us = time_lookups(
+                path, opts.num_companies, opts.num_lookups)
+
+            print('{:>14} {:>12.0f} {:>12.1f} {:>12.1f}'.format(
+                'WITHOUT ROWID' if without_rowid else 'rowid',
+                getsize(path) / 1024, claim_us, rating_us))
+    finally:
+        rmtree(tmp_dir)
+
+
+def fill_fake_output_db(output_db, num_companies):
+    """Fill claim and rating tables, in random order."""
+    create_output_table(output_db, 'claim')
+    create_output_table(output_db, 'rating')
+
+    targets = [(fake_company(i), fake_brand(i, j))
+               for i in range(num_companies) for j in range(10)]
+    random.shuffle(targets)
+
+    for company, brand in targets:
+        for c in range(5):
+            campaign_id = 'campaign_{:d}'.format(c)
+
+            output_row(output_db, 'rating', dict(
+                campaign_id=campaign_id,
+                company=company,
+                brand=brand,
+                judgment=random.randint(-1, 1),
+                description='Rated by ' + campaign_id))
+
+            for k in range(3):
+                output_row(output_db, 'claim', dict(
+                    campaign_id=campaign_id,
+                    company=company,
+                    brand=brand,
+                    claim='Claim number {:d} about {}'.format(k, brand),
+                    judgment=random.randint(-1, 1)))
+
+
+def time_lookups(path, num_companies, num_lookups):
+    """Return average time to look up claims and ratings for a target,
+    in microseconds."""
+    db = open_db(path, readonly=True)
+
+    claim_sql = ('SELECT * FROM claim WHERE campaign_id = ?'
+                 ' AND company = ? AND brand = ?')
+    rating_sql = ('SELECT * FROM rating WHERE campaign_id = ?'
+                  ' AND company = ? AND brand = ?')
+
+    def lookup(sql, *args):
+        return list(db.execute(sql, args))
+
+    keys = []
+    for _ in range(num_lookups):
+        i = random.randrange(num_companies)
+        keys.append(('campaign_{:d}'.format(random.randrange(5)),
+                     fake_company(i), fake_brand(i, random.randrange(10))))
+
+    claim_time = time_calls(lookup, ((claim_sql,) + k for k in keys))
+    rating_time = time_calls(lookup, ((rating_sql,) + k for k in keys))
+
+    return claim_time * 1e6, rating_time * 1e6
+
+
+def parse_args(args=None):
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n', '--num-companies', dest='num_companies', type=int,
+        default=1000,
+        help='Number of fake companies (default: %(default)s)')
+    parser.add_argument(
+        '-l', '--num-lookups', dest='num_lookups', type=int, default=20000,
+        help='Number of lookups to time (default: %(default)s)')
+    parser.add_argument(
+        '-s', '--seed', dest='seed', type=int, default=0,
+        help='Random seed (default: %(default)s)')
+
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    main()
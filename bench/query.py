@@ -0,0 +1,139 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measure lookups/sec with msd.query.Query on a stream of names like
+what you'd see on web pages: popular names come up over and over,
+spelled various ways, and some names aren't in the DB at all."""
+import random
+from argparse import ArgumentParser
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from msd.db import open_db
+from msd.merge import create_output_table
+from msd.merge import output_row
+from msd.output import save_output_db
+from msd.query import Query
+
+from . import fake_brand
+from . import fake_company
+from . import time_calls
+from .output_schema import fill_fake_output_db
+
+BRANDS_PER_COMPANY = 10
+
+
+def main(args=None):
+    opts = parse_args(args)
+
+    random.seed(opts.seed)
+
+    tmp_dir = mkdtemp()
+    try:
+        output_db = open_db(':memory:')
+        with output_db:
+            fill_fake_output_db(output_db, opts.num_companies)
+            fill_fake_names(output_db, opts.num_companies)
+
+        path = join(tmp_dir, 'msd.sqlite')
+        save_output_db(output_db, path, without_rowid=True)
+        output_db.close()
+
+        names = [(name,) for name in fake_name_stream(
+            opts.num_companies, opts.num_lookups)]
+
+        print('{:>12} {:>14} {:>10}'.format(
+            'cache size', 'lookups/sec', 'hit rate'))
+
+        for cache_size in (0, 256, 4096):
+            query = Query(path, cache_size=cache_size)
+            try:
+                secs = time_calls(query.lookup, names)
+                info = query.lookup.cache_info()
+                hit_rate = info.hits / ((info.hits + info.misses) or 1)
+
+                print('{:>12d} {:>14.0f} {:>10.2f}'.format(
+                    cache_size, 1 / secs, hit_rate))
+            finally:
+                query.close()
+    finally:
+        rmtree(tmp_dir)
+
+
+def fill_fake_names(output_db, num_companies):
+    """Fill company_name, brand, and category tables to match the
+    targets from fill_fake_output_db()."""
+    create_output_table(output_db, 'company_name')
+    create_output_table(output_db, 'brand')
+    create_output_table(output_db, 'category')
+
+    for i in range(num_companies):
+        company = fake_company(i)
+
+        output_row(output_db, 'company_name', dict(
+            company=company, company_name=company))
+        output_row(output_db, 'company_name', dict(
+            company=company, company_name=company + ', Inc.', is_full=1))
+
+        for j in range(BRANDS_PER_COMPANY):
+            brand = fake_brand(i, j)
+            output_row(output_db, 'brand', dict(
+                company=company, brand=brand))
+            output_row(output_db, 'category', dict(
+                company=company, brand=brand, category='Food'))
+
+
+def fake_name_stream(num_companies, num_names):
+    """Yield names of companies and brands, with a long-tailed
+    distribution of popularity, in various spellings."""
+    for _ in range(num_names):
+        # Pareto-distributed rank, so a few names dominate
+        i = int(random.paretovariate(1.2)) - 1
+        if i >= num_companies:
+            # not in the DB
+            yield 'Unknown Company {:d}'.format(i)
+            continue
+
+        r = random.random()
+        if r < 0.5:
+            name = fake_brand(i, random.randrange(BRANDS_PER_COMPANY))
+        else:
+            name = fake_company(i)
+            if r < 0.6:
+                name += ', Inc.'
+
+        if random.random() < 0.2:
+            name = name.upper()
+
+        yield name
+
+
+def parse_args(args=None):
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-n', '--num-companies', dest='num_companies', type=int,
+        default=1000,
+        help='Number of fake companies (default: %(default)s)')
+    parser.add_argument(
+        '-l', '--num-lookups', dest='num_lookups', type=int, default=20000,
+        help='Number of lookups to time (default: %(default)s)')
+    parser.add_argument(
+        '-s', '--seed', dest='seed', type=int, default=0,
+        help='Random seed (default: %(default)s)')
+
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    main()
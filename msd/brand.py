@@ -12,24 +12,24 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import re
 from logging import getLogger
 
 from .db import select_groups
+from .key import get_brand_key
+from .key import split_brand_and_tm
 from .merge import create_output_table
 from .merge import group_by_keys
 from .merge import merge_dicts
+from .merge import merge_rows
 from .merge import output_row
 from .norm import smunch
 from .scratch import scratch_tables_with_cols
+from .scratch import select_brand_keys
 from .url import match_urls
 
 log = getLogger(__name__)
 
 
-TM_RE = re.compile('(®|\u2120|™)', re.U)
-
-
 def build_brand_table(output_db, scratch_db):
     log.info('  building brand table')
     create_output_table(output_db, 'brand')
@@ -56,10 +56,10 @@ def build_brand_table(output_db, scratch_db):
                 tms.add(split_brand_and_tm(brand_row['tm'])[1])
 
         # build final brand row
-        brand_row = merge_dicts(
+        brand_row = merge_rows(
             [dict(company=company, brand=brand)] +
-             match_urls(brand_rows, scratch_db) +
-             brand_rows)
+            match_urls(brand_rows, scratch_db) +
+            brand_rows, 'brand')
 
         # make sure we get a valid value for tm
         brand_row['tm'] = sorted(tms, reverse=True)[0]
@@ -72,6 +72,9 @@ def build_scraper_brand_map_table(output_db, scratch_db):
     log.info('  building scraper_brand_map table')
     create_output_table(output_db, 'scraper_brand_map')
 
+    # keys were computed when we built the scratch DB
+    brand_keys = select_brand_keys(scratch_db)
+
     # TODO: will need to redo this by company family tree
     for (company,), company_map_rows in select_groups(
             output_db, 'scraper_company_map', ['company']):
@@ -81,13 +84,21 @@ def build_scraper_brand_map_table(output_db, scratch_db):
             for row in company_map_rows)
 
         fill_brands_for_company(
-            output_db, scratch_db, company, scraper_companies)
+            output_db, scratch_db, company, scraper_companies,
+            brand_keys=brand_keys)
+
 
+def fill_brands_for_company(output_db, scratch_db, company, scraper_companies,
+                            *, brand_keys=None):
+    """Fill scraper_brand_map for the given company. *brand_keys* maps
+    scraper brand to key (see select_brand_keys()); if a brand isn't
+    in it, we compute its key on the fly."""
+    brand_keys = brand_keys or {}
 
-def fill_brands_for_company(output_db, scratch_db, company, scraper_companies):
     # "brand dicts": dicts containing:
     # scraper_brands: set of (scraper_id, scraper_company, scraper_brand)
     # brands: candidates for canonical name of brand
+    # keys: keys for merging
     bds = []
 
     # get all brand info
@@ -103,8 +114,11 @@ def fill_brands_for_company(output_db, scratch_db, company, scraper_companies):
             for row in rows:
                 brand, _ = split_brand_and_tm(row['brand'])
                 if brand:
-                    bds.append(dict(brands={brand}, scraper_brands={
-                        (scraper_id, scraper_company, row['brand'])}))
+                    key = (brand_keys.get(row['brand']) or
+                           get_brand_key(row['brand']))
+                    bds.append(dict(
+                        brands={brand}, keys={key}, scraper_brands={
+                            (scraper_id, scraper_company, row['brand'])}))
 
     # grab company names, to fix capitalization of brand (see #7)
     company_name_sql = (
@@ -112,11 +126,12 @@ def fill_brands_for_company(output_db, scratch_db, company, scraper_companies):
     company_names = set(row[0] for row in
                         output_db.execute(company_name_sql, [company]))
     for name in company_names:
-        bds.append(dict(brands={name}, scraper_brands=set()))
+        bds.append(dict(brands={name}, keys={smunch(name)},
+                        scraper_brands=set()))
 
     # merge brands
     def keyfunc(bd):
-        return {smunch(brand) for brand in bd['brands']}
+        return bd['keys']
 
     for bd_group in group_by_keys(bds, keyfunc):
         bd = merge_dicts(bd_group)
@@ -185,18 +200,6 @@ def pick_brand_name(names, company_names=()):
     return sorted(names, key=keyfunc, reverse=True)[0]
 
 
-def split_brand_and_tm(scraper_brand):
-    """Split apart brand and TM/SM/(R) symbol, discarding anything
-    after the symbol."""
-    scraper_brand = scraper_brand or ''
-
-    m = TM_RE.search(scraper_brand)
-    if m:
-        return scraper_brand[:m.start()].strip(), m.group()
-    else:
-        return scraper_brand.strip(), ''
-
-
 def map_brand(output_db, scraper_id, scraper_company, scraper_brand):
     """Get the canonical company corresponding to the
     given brand in the scraper data."""
@@ -11,12 +11,14 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import json
 from logging import getLogger
 
-from .db import select_groups
 from .merge import create_output_table
-from .merge import merge_dicts
+from .merge import merge_cols_sql
+from .merge import merge_rows
 from .merge import output_row
+from .schema import get_table_schema
 from .url import match_urls
 
 log = getLogger(__name__)
@@ -26,11 +28,22 @@ def build_campaign_table(output_db, scratch_db):
     log.info('  building campaign table')
     create_output_table(output_db, 'campaign')
 
-    for (campaign_id,), rows in select_groups(
-            scratch_db, 'campaign', ['campaign_id']):
+    # merge campaign rows in SQL, keeping a list of their URLs so
+    # we can add in data from the url table (see match_urls())
+    select_sql = (
+        'SELECT {}, json_group_array(`url`) AS `urls` FROM campaign'
+        ' GROUP BY `campaign_id` ORDER BY `campaign_id`'.format(
+            merge_cols_sql(get_table_schema('campaign').scratch_cols)))
 
-        if not campaign_id:
+    for row in scratch_db.execute(select_sql):
+        campaign_row = dict(row)
+        urls = json.loads(campaign_row.pop('urls'))
+
+        if not campaign_row['campaign_id']:
             continue
 
-        campaign_row = merge_dicts(rows + match_urls(rows, scratch_db))
+        url_rows = [dict(url=url) for url in urls]
+
+        campaign_row = merge_rows(
+            [campaign_row] + match_urls(url_rows, scratch_db), 'campaign')
         output_row(output_db, 'campaign', campaign_row)
@@ -24,7 +24,7 @@ from .merge import create_output_table
 from .merge import output_row
 from .norm import simplify_whitespace
 from .norm import to_title_case
-from .scratch import get_distinct_values
+from .scratch import select_catalog
 from .target import select_groups_by_target
 
 
@@ -42,6 +42,7 @@ def build_category_table(output_db, scratch_db):
 
         # don't group by category. instead, get all categories for target,
         # and find implied categories
+        category_rows = list(category_rows)
         company = category_rows[0]['company']
         brand = category_rows[0]['brand']
 
@@ -69,9 +70,7 @@ def build_scraper_category_map_table(output_db, scratch_db):
     create_output_table(output_db, 'scraper_category_map')
 
     # a category exists if it's named as a category or a subcategory
-    scraper_cats = (
-        get_distinct_values(scratch_db, ['scraper_id', 'category']) |
-        get_distinct_values(scratch_db, ['scraper_id', 'subcategory']))
+    scraper_cats = select_catalog(scratch_db, 'category')
 
     for scraper_id, scraper_category in scraper_cats:
         # derive canonical category from scraper category
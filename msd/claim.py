@@ -14,7 +14,7 @@
 from logging import getLogger
 
 from .merge import create_output_table
-from .merge import merge_dicts
+from .merge import merge_rows
 from .merge import output_row
 from .rating import fix_judgment
 from .target import select_groups_by_target
@@ -22,24 +22,38 @@ from .target import select_groups_by_target
 log = getLogger(__name__)
 
 
+# columns to group claims by, within each target
+CLAIM_KEY_COLS = ['campaign_id', 'claim']
+
+
 def build_claim_table(output_db, scratch_db):
     log.info('  building claim table')
     create_output_table(output_db, 'claim')
 
     # slice by target
-    for (company, brand), (campaign_id, claim), claim_rows in \
-        select_groups_by_target(
-            output_db, scratch_db, 'claim', ['campaign_id', 'claim']):
+    for target, key, claim_rows in select_groups_by_target(
+            output_db, scratch_db, 'claim', CLAIM_KEY_COLS):
+
+        claim_row = merge_claim_group(target, key, claim_rows)
+        if claim_row is not None:
+            output_row(output_db, 'claim', claim_row)
+
+
+def merge_claim_group(target, key, claim_rows):
+    """Merge a group of claim rows from select_groups_by_target() into
+    a row for the claim table, or return None if we can't use it."""
+    company, brand = target
+    campaign_id, claim = key
 
-        if not (campaign_id and claim):
-            continue
+    if not (campaign_id and claim):
+        return None
 
-        claim_row = merge_dicts(claim_rows)
-        claim_row['company'] = company
-        claim_row['brand'] = brand
-        claim_row['judgment'] = fix_judgment(claim_row['judgment'])
+    claim_row = merge_rows(claim_rows, 'claim')
+    claim_row['company'] = company
+    claim_row['brand'] = brand
+    claim_row['judgment'] = fix_judgment(claim_row['judgment'])
 
-        if claim_row['judgment'] is None:
-            continue
+    if claim_row['judgment'] is None:
+        return None
 
-        output_row(output_db, 'claim', claim_row)
+    return claim_row
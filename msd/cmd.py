@@ -14,8 +14,12 @@
 import logging
 from argparse import ArgumentParser
 
+from msd.key import clear_company_expansions
+from msd.output import DEFAULT_MAX_IN_MEMORY_SIZE
 from msd.output import build_output_db
 from msd.scratch import build_scratch_db
+from msd.scratch import build_scratch_db_in_memory
+from msd.subset import parse_output_spec
 
 DEFAULT_SCRATCH_DB = 'msd-scratch.sqlite'
 DEFAULT_OUTPUT_DB = 'msd.sqlite'
@@ -29,19 +33,98 @@ def main(args=None):
     set_up_logging(verbose=opts.verbose, quiet=opts.quiet)
 
     run(input_db_paths=opts.input_dbs, scratch_db_path=opts.scratch_db,
-        output_db_path=opts.output_db, force_rebuild_scratch=opts.force)
+        company_cache_path=opts.company_cache,
+        delta_path=opts.delta,
+        output_db_path=opts.output_db, force_rebuild_scratch=opts.force,
+        max_in_memory_size=opts.max_in_memory_mb * 1024 * 1024,
+        name_index_path=opts.name_index,
+        near_duplicates=opts.near_duplicates,
+        scratch_in_memory=opts.scratch_in_memory,
+        page_size=opts.page_size,
+        save_scratch=opts.save_scratch,
+        search=opts.search,
+        subsets=opts.subsets,
+        target_summary=opts.target_summary,
+        vacuum=opts.vacuum,
+        without_rowid=opts.without_rowid)
 
 
 def run(*,
+        company_cache_path=None,
+        delta_path=None,
         force_rebuild_scratch=False,
         input_db_paths=(),
+        max_in_memory_size=DEFAULT_MAX_IN_MEMORY_SIZE,
+        name_index_path=None,
+        near_duplicates=False,
         output_db_path=DEFAULT_OUTPUT_DB,
-        scratch_db_path=DEFAULT_SCRATCH_DB):
-
-    build_scratch_db(scratch_db_path, input_db_paths,
-                     force=force_rebuild_scratch)
-
-    build_output_db(scratch_db_path, output_db_path)
+        page_size=None,
+        save_scratch=False,
+        scratch_db_path=DEFAULT_SCRATCH_DB,
+        scratch_in_memory=False,
+        search=False,
+        subsets=(),
+        target_summary=False,
+        vacuum=False,
+        without_rowid=False):
+    """Build the scratch DB, and then the output DB.
+
+    If *scratch_in_memory* is true, keep the scratch DB in memory
+    rather than at *scratch_db_path* (it's always rebuilt). Set
+    *save_scratch* to also save it to *scratch_db_path* for debugging.
+
+    If *without_rowid* is true, output tables are WITHOUT ROWID tables,
+    clustered on their primary key. If *vacuum* is true, VACUUM the output
+    DB before publishing it (optionally setting *page_size*). If *search*
+    is true, add a full-text search table (see msd.search). If
+    *name_index_path* is set, also write a compact index of company and
+    brand names there (see msd.name_index). If *target_summary* is true,
+    add a table summarizing each target's ratings and claims (see
+    msd.target_summary). If *near_duplicates* is true, add a report of
+    suspiciously similar names (see msd.near_duplicate). If *delta_path*
+    is set, also write a delta from the previous output DB (if any)
+    there (see msd.delta). *subsets* is a list of OutputSpec for
+    filtered copies of the output DB to publish as well (see
+    msd.subset).
+
+    If *company_cache_path* is set, reuse company clusters from the
+    previous run that haven't changed (see load_company_clusters()), and
+    save this run's clusters there for the next one.
+
+    Returns a dictionary of stats about the run.
+    """
+    # don't let company expansions from one run leak into the next
+    clear_company_expansions()
+    scratch_db = None
+    try:
+        if scratch_in_memory:
+            scratch_db = build_scratch_db_in_memory(
+                input_db_paths,
+                save_path=(scratch_db_path if save_scratch else None))
+        else:
+            build_scratch_db(scratch_db_path, input_db_paths,
+                             force=force_rebuild_scratch)
+            scratch_db = scratch_db_path
+
+        return build_output_db(
+            scratch_db, output_db_path,
+            company_cache_path=company_cache_path,
+            delta_path=delta_path,
+            max_in_memory_size=max_in_memory_size,
+            name_index_path=name_index_path,
+            near_duplicates=near_duplicates,
+            page_size=page_size,
+            search=search,
+            subsets=subsets,
+            target_summary=target_summary,
+            vacuum=vacuum,
+            without_rowid=without_rowid)
+    finally:
+        # build_output_db() leaves closing an open scratch DB to us
+        if scratch_in_memory and scratch_db is not None:
+            scratch_db.close()
+
+        clear_company_expansions()
 
 
 def set_up_logging(*, verbose=False, quiet=False):
@@ -71,9 +154,69 @@ def parse_args(args=None):
         '-i', '--scratch', dest='scratch_db',
         default=DEFAULT_SCRATCH_DB,
         help='Path to scratch DB (default: %(default)s)')
+    parser.add_argument(
+        '--scratch-in-memory', dest='scratch_in_memory', default=False,
+        action='store_true',
+        help=('Build the scratch DB in memory rather than on disk'
+              ' (for small builds)'))
+    parser.add_argument(
+        '--save-scratch', dest='save_scratch', default=False,
+        action='store_true',
+        help=('With --scratch-in-memory, also save the scratch DB to disk'
+              ' (for debugging)'))
+    parser.add_argument(
+        '--company-cache', dest='company_cache', default=None,
+        help=('Reuse company name variants from the previous run, and'
+              ' save them for the next one, in this file'))
     parser.add_argument(
         '-o', '--output', dest='output_db', default=DEFAULT_OUTPUT_DB,
         help='Path to output DB (default: %(default)s)')
+    parser.add_argument(
+        '--max-in-memory', dest='max_in_memory_mb', type=int,
+        default=DEFAULT_MAX_IN_MEMORY_SIZE // (1024 * 1024),
+        help=('Build output DB in memory if the scratch DB is no bigger'
+              ' than this many megabytes; 0 to always build on disk'
+              ' (default: %(default)s)'))
+    parser.add_argument(
+        '--delta', dest='delta', default=None,
+        help=('Also write the changes from the previous output DB to this'
+              ' file, for bin/msd-apply-delta'))
+    parser.add_argument(
+        '--name-index', dest='name_index', default=None,
+        help=('Also write a compact index of company and brand names,'
+              ' for clients that only need judgments, to this file'))
+    parser.add_argument(
+        '--search', dest='search', default=False, action='store_true',
+        help=('Add a full-text search table over company names, brands,'
+              ' and categories (requires FTS5)'))
+    parser.add_argument(
+        '--subset', dest='subsets', default=[], action='append',
+        type=parse_output_spec,
+        help=('Also publish a filtered copy of the output DB, described'
+              ' like PATH?campaign_id=ID,...&hq_country=CC,...'
+              '&table=NAME,... (all filters are optional). May be'
+              ' used more than once'))
+    parser.add_argument(
+        '--near-duplicates', dest='near_duplicates', default=False,
+        action='store_true',
+        help=('Add a report of company and brand names that are'
+              ' suspiciously similar'))
+    parser.add_argument(
+        '--target-summary', dest='target_summary', default=False,
+        action='store_true',
+        help=('Add a table summarizing the ratings and claims for each'
+              ' company and brand'))
+    parser.add_argument(
+        '--vacuum', dest='vacuum', default=False, action='store_true',
+        help='VACUUM the output DB before publishing it')
+    parser.add_argument(
+        '--page-size', dest='page_size', type=int, default=None,
+        help='With --vacuum, change the output DB to use this page size')
+    parser.add_argument(
+        '--without-rowid', dest='without_rowid', default=False,
+        action='store_true',
+        help=('Make output tables WITHOUT ROWID tables, clustered on their'
+              ' primary key (smaller and faster to query)'))
 
     return parser.parse_args(args)
 
@@ -11,38 +11,52 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import re
+import json
+from collections import namedtuple
 from functools import lru_cache
+from hashlib import sha1
 from logging import getLogger
+from os import remove
+from os import rename
+from os.path import exists
 
+from . import brand as brand_module
 from .brand import select_brands
-from .company_data import BAD_COMPANY_ALIASES
 from .company_data import BAD_COMPANY_NAMES
 from .company_data import COMPANY_ALIASES
-from .company_data import COMPANY_ALIAS_REGEXES
-from .company_data import COMPANY_CORRECTIONS
 from .company_data import COMPANY_NAMES
-from .company_data import COMPANY_NAME_REGEXES
-from .company_data import COMPANY_TYPE_CORRECTIONS
-from .company_data import COMPANY_TYPE_RE
-from .company_data import UNSTRIPPABLE_COMPANIES
-from .company_data import UNSTRIPPABLE_COMPANY_TYPES
+from .db import open_db
 from .db import select_groups
+from .db import sqlite_sort_key
+from .key import expand_companies
+from .key import company_expansion_version
+from .key import expand_company
+from .key import get_company_keys
 from .merge import create_output_table
 from .merge import group_by_keys
 from .merge import merge_dicts
+from .merge import merge_rows
 from .merge import output_row
 from .norm import norm
-from .norm import simplify_whitespace
-from .scratch import get_distinct_values
+from .scratch import select_catalog
+from .scratch import select_company_keys
 from .url import match_urls
 
 log = getLogger(__name__)
 
-
-# use this to turn e.g. "babyGap" into "baby Gap"
-# this can also turn "G.I. Joe" into "G. I. Joe"
-CAMEL_CASE_RE = re.compile('(?<=[a-z\.])(?=[A-Z])')
+# a group of inputs that resolved to the same company (or to nothing)
+# in build_company_name_and_scraper_company_map_tables():
+#
+# keys: keys of everything in the group
+# scraper_companies: set of (scraper_id, scraper_company)
+# company_names: map from (company, company_name, is_alias) rows in
+#   the scratch company_name table to their keys
+# brands: normed brands of *scraper_companies*, which we use to pick
+#   the company's names
+# rows: list of (table_name, row) we output for the group
+CompanyCluster = namedtuple(
+    'CompanyCluster',
+    ['keys', 'scraper_companies', 'company_names', 'brands', 'rows'])
 
 
 def build_company_table(output_db, scratch_db):
@@ -75,112 +89,368 @@ def build_company_table(output_db, scratch_db):
             company_full_sql, [company]))[0][0]
 
         # build final company row
-        company_row = merge_dicts(
+        company_row = merge_rows(
             [dict(company=company, company_full=company_full)] +
             match_urls(company_rows, scratch_db) +
-            company_rows)
+            company_rows, 'company')
 
         # output it
         output_row(output_db, 'company', company_row)
 
 
-def build_company_name_and_scraper_company_map_tables(output_db, scratch_db):
+def build_company_name_and_scraper_company_map_tables(
+        output_db, scratch_db, *, company_clusters=None):
+    """Resolve scraper companies into companies, and write the
+    scraper_company_map and company_name tables.
+
+    *company_clusters* is an optional list of CompanyCluster from a
+    previous run (see load_company_clusters()). Clusters that would come
+    out the same (see _select_reusable_clusters()) are written out as-is
+    rather than resolved again; the output is the same as if we'd
+    resolved everything.
+
+    Returns a list of CompanyCluster for this run.
+    """
     log.info('  building scraper_company_map and company_name tables')
     create_output_table(output_db, 'scraper_company_map')
     create_output_table(output_db, 'company_name')
 
-    # company dicts ("cds") containing the following sets:
+    # keys were computed when we built the scratch DB
+    company_keys = select_company_keys(scratch_db)
+
+    # populate with 'company' and 'company_full' fields
+    scraper_companies = [
+        (scraper_id, scraper_company)
+        for scraper_id, scraper_company in sorted(
+            select_catalog(scratch_db, 'company'))
+        if scraper_id and scraper_company]
+
+    company_name_rows = list(dict.fromkeys(
+        tuple(row) for row in scratch_db.execute(
+            'SELECT company, company_name, is_alias FROM company_name')
+        if row[0] and row[1]))
+
+    clusters = _select_reusable_clusters(
+        scratch_db, company_clusters or (), company_keys,
+        scraper_companies, company_name_rows)
+
+    if company_clusters:
+        log.info('  reusing {:d} of {:d} company clusters'.format(
+            len(clusters), len(company_clusters)))
+
+    reused_keys = set()
+    reused_scraper_companies = set()
+    reused_company_names = set()
+    for cluster in clusters:
+        reused_keys.update(cluster.keys)
+        reused_scraper_companies.update(cluster.scraper_companies)
+        reused_company_names.update(cluster.company_names)
+
+    scraper_companies = [sc for sc in scraper_companies
+                         if sc not in reused_scraper_companies]
+    company_name_rows = [row for row in company_name_rows
+                         if row not in reused_company_names]
+
+    # company dicts ("cds") containing the following:
     #
     # names: possible company names
     # aliases: name variants usable for matching (may include *names*)
+    # keys: normalized variants of *aliases* and *names*, for merging
     # scraper_companies: tuples of (scraper_id, scraper_company)
+    # company_names: map from company_name rows to their keys
 
     cds = []
 
-    # populate with hard-coded company names
+    # populate with hard-coded company aliases
     for aliases in COMPANY_ALIASES:
-        cds.append(dict(aliases=aliases, names=set(), scraper_companies=set()))
+        cds.append(dict(aliases=aliases, names=set(),
+                        keys=_get_keys(aliases), scraper_companies=set(),
+                        company_names={}))
 
     # populate with hard-coded company names
     for names in COMPANY_NAMES:
-        cds.append(dict(aliases=names, names=names, scraper_companies=set()))
+        cds.append(dict(aliases=names, names=names,
+                        keys=_get_keys(names), scraper_companies=set(),
+                        company_names={}))
 
-    # populate with 'company' and 'company_full' fields
-    scraper_companies = (
-        get_distinct_values(scratch_db, ['scraper_id', 'company']) |
-        get_distinct_values(scratch_db, ['scraper_id', 'company_full']))
+    # hard-coded names in clusters we're reusing are already taken care of
+    cds = [cd for cd in cds if not (cd['keys'] & reused_keys)]
+
+    # expand all company strings up front (in parallel, if there are
+    # enough of them)
+    expand_companies(
+        [c for _, c in scraper_companies] +
+        [c for row in company_name_rows for c in row[:2]])
 
     for (scraper_id, scraper_company) in scraper_companies:
-        if not (scraper_id and scraper_company):
-            continue
+        expansion = expand_company(scraper_company)
+        aliases = expansion.aliases
+        names = expansion.names
+        keys = company_keys.get(scraper_company) or expansion.keys
 
         cds.append(dict(
-            aliases=get_company_aliases(scraper_company),
-            names=get_company_names(scraper_company),
-            scraper_companies={(scraper_id, scraper_company)}))
+            aliases=aliases, names=names, keys=keys,
+            scraper_companies={(scraper_id, scraper_company)},
+            company_names={}))
 
     # populate from company_name table
-    select_sql = 'SELECT company, company_name, is_alias FROM company_name'
-    for scraper_company, scraper_company_name, is_alias in (
-            scratch_db.execute(select_sql)):
-        if not (scraper_company and scraper_company_name):
-            continue
-
-        aliases = (get_company_aliases(scraper_company) |
-                   get_company_aliases(scraper_company_name))
-        names = set()
-        if not is_alias:
-            # already did this for scraper_company, above
-            names = get_company_names(scraper_company_name)
-
-        cds.append(dict(aliases=aliases, names=names, scraper_companies=set()))
+    for row in company_name_rows:
+        cds.append(_get_company_name_row_cd(row))
 
     # group together by normed variants of aliases
     def keyfunc(cd):
-        keys = set()
-        for alias in cd['aliases'] | cd['names']:
-            keys.update(get_company_keys(alias))
-        return keys
+        return cd['keys']
 
     # there are lots of these, so show progress
     for cd_group in group_by_keys(cds, keyfunc):
         cd = merge_dicts(cd_group)
 
-        if not cd['scraper_companies']:
-            # this can happen if hard-coded variants don't match anything
+        rows = []
+        normed_brands = set()
+
+        if cd['scraper_companies']:
+            # promote aliases to display names if they match a brand
+            brands = select_brands(scratch_db, cd['scraper_companies'])
+            normed_brands = {norm(b) for b in brands}
+            names = cd['names'] | {
+                a for a in cd['aliases'] if norm(a) in normed_brands}
+
+            if names:
+                rows = _get_company_rows(cd, names)
+
+        # hard-coded names that didn't match anything aren't worth caching
+        if cd['scraper_companies'] or cd['company_names']:
+            clusters.append(CompanyCluster(
+                keys=frozenset(cd['keys']),
+                scraper_companies=frozenset(cd['scraper_companies']),
+                company_names=cd['company_names'],
+                brands=frozenset(normed_brands),
+                rows=rows))
+
+    for cluster in clusters:
+        for table_name, row in cluster.rows:
+            output_row(output_db, table_name, row)
+
+    return clusters
+
+
+def _get_company_rows(cd, names):
+    """Get a list of (table_name, row) for the scraper_company_map and
+    company_name tables for the given merged company dict, given the
+    names it can go by."""
+    rows = []
+
+    # pick company name and full name
+    company = pick_company_name(names)
+    company_full = pick_company_full(names)
+
+    # write to scraper_company_map
+    for scraper_id, scraper_company in sorted(cd['scraper_companies']):
+        rows.append(('scraper_company_map', dict(
+            company=company,
+            scraper_id=scraper_id,
+            scraper_company=scraper_company)))
+
+    # write to company_name
+    for company_name in sorted(names | cd['aliases']):
+        row = dict(company=company, company_name=company_name)
+        if (company_name not in names or
+            (company_name in BAD_COMPANY_NAMES and
+             company_name != company)):
+            row['is_alias'] = 1
+        if company_name == company_full:
+            row['is_full'] = 1
+        rows.append(('company_name', row))
+
+    return rows
+
+
+def _select_reusable_clusters(
+        scratch_db, company_clusters, company_keys,
+        scraper_companies, company_name_rows):
+    """Get the clusters from a previous run that would come out exactly
+    the same in this one. That is, every input in the cluster is still
+    there, no other input shares a key with it, and its scraper companies
+    have the same brands (which we use to pick names).
+
+    Clusters never share keys (otherwise they'd be one cluster), so
+    this doesn't depend on which other clusters we reuse.
+    """
+    cluster_by_key = {}
+    cached_company_name_keys = {}
+    for i, cluster in enumerate(company_clusters):
+        for key in cluster.keys:
+            cluster_by_key[key] = i
+        cached_company_name_keys.update(cluster.company_names)
+
+    stale = set()
+
+    for i, cluster in enumerate(company_clusters):
+        if not (cluster.scraper_companies <= set(scraper_companies) and
+                set(cluster.company_names) <= set(company_name_rows)):
+            stale.add(i)
+
+    # inputs that would join another cluster
+    scraper_company_cluster = {
+        sc: i for i, cluster in enumerate(company_clusters)
+        for sc in cluster.scraper_companies}
+    company_name_cluster = {
+        row: i for i, cluster in enumerate(company_clusters)
+        for row in cluster.company_names}
+
+    def check_keys(keys, home):
+        for key in keys:
+            i = cluster_by_key.get(key)
+            if i is not None and i != home:
+                stale.add(i)
+
+    for scraper_company in scraper_companies:
+        keys = (company_keys.get(scraper_company[1]) or
+                expand_company(scraper_company[1]).keys)
+        check_keys(keys, scraper_company_cluster.get(scraper_company))
+
+    for row in company_name_rows:
+        keys = cached_company_name_keys.get(row)
+        if keys is None:
+            keys = _get_company_name_row_cd(row)['keys']
+        check_keys(keys, company_name_cluster.get(row))
+
+    reusable = []
+
+    for i, cluster in enumerate(company_clusters):
+        if i in stale:
             continue
 
-        # promote aliases to display names if they match a brand
-        brands = select_brands(scratch_db, cd['scraper_companies'])
-        normed_brands = {norm(b) for b in brands}
-        names = cd['names'] | {
-            a for a in cd['aliases'] if norm(a) in normed_brands}
+        if cluster.scraper_companies:
+            brands = select_brands(scratch_db, cluster.scraper_companies)
+            if {norm(b) for b in brands} != cluster.brands:
+                continue
+
+        reusable.append(cluster)
+
+    return reusable
 
-        if not names:
-            continue
 
-        # pick company name and full name
-        company = pick_company_name(names)
-        company_full = pick_company_full(names)
+def _get_company_name_row_cd(row):
+    """Get a company dict (see above) for a row from the scratch
+    company_name table."""
+    scraper_company, scraper_company_name, is_alias = row
 
-        # write to scraper_company_map
-        for scraper_id, scraper_company in sorted(cd['scraper_companies']):
-            output_row(output_db, 'scraper_company_map', dict(
-                company=company,
-                scraper_id=scraper_id,
-                scraper_company=scraper_company))
+    aliases = (expand_company(scraper_company).aliases |
+               expand_company(scraper_company_name).aliases)
+    names = set()
+    if not is_alias:
+        # already did this for scraper_company
+        names = expand_company(scraper_company_name).names
 
-        # write to company_name
-        for company_name in sorted(names | cd['aliases']):
-            row = dict(company=company, company_name=company_name)
-            if (company_name not in names or
-                (company_name in BAD_COMPANY_NAMES and
-                 company_name != company)):
-                row['is_alias'] = 1
-            if company_name == company_full:
-                row['is_full'] = 1
-            output_row(output_db, 'company_name', row)
+    keys = _get_keys(aliases | names)
 
+    return dict(aliases=aliases, names=names, keys=keys,
+                scraper_companies=set(),
+                company_names={row: frozenset(keys)})
+
+
+def load_company_clusters(path):
+    """Load company clusters saved by save_company_clusters() in a
+    previous run. Returns None if *path* doesn't exist or was saved with
+    different company data or code (see company_cluster_version())."""
+    if not exists(path):
+        return None
+
+    db = open_db(path, readonly=True)
+    try:
+        version = db.execute(
+            "SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if not (version and version[0] == company_cluster_version()):
+            log.info('ignoring out-of-date company clusters in {}'.format(
+                path))
+            return None
+
+        clusters = [_json_to_cluster(json.loads(data)) for (data,) in
+                    db.execute('SELECT data FROM company_cluster'
+                               ' ORDER BY cluster_id')]
+    finally:
+        db.close()
+
+    log.info('loaded {:d} company clusters from {}'.format(
+        len(clusters), path))
+
+    return clusters
+
+
+def save_company_clusters(path, clusters):
+    """Save company clusters returned by
+    build_company_name_and_scraper_company_map_tables() to *path*, for
+    load_company_clusters() to use in the next run."""
+    log.info('saving {:d} company clusters to {}'.format(
+        len(clusters), path))
+
+    tmp_path = path + '.tmp'
+    if exists(tmp_path):
+        remove(tmp_path)
+
+    db = open_db(tmp_path)
+    try:
+        with db:
+            db.execute(
+                'CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+            db.execute("INSERT INTO meta VALUES ('version', ?)",
+                       [company_cluster_version()])
+
+            db.execute('CREATE TABLE company_cluster'
+                       ' (cluster_id INTEGER PRIMARY KEY, data TEXT)')
+            db.executemany(
+                'INSERT INTO company_cluster (data) VALUES (?)',
+                ([json.dumps(_cluster_to_json(cluster), sort_keys=True)]
+                 for cluster in clusters))
+    finally:
+        db.close()
+
+    rename(tmp_path, path)
+
+
+@lru_cache()
+def company_cluster_version():
+    """Hash of the code and data that company clusters depend on."""
+    h = sha1(company_expansion_version().encode('utf8'))
+    for path in (brand_module.__file__, __file__):
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def _cluster_to_json(cluster):
+    return dict(
+        brands=sorted(cluster.brands),
+        company_names=[list(row) + [sorted(keys)] for row, keys in
+                       sorted(cluster.company_names.items(), key=lambda
+                              item: sqlite_sort_key(item[0]))],
+        keys=sorted(cluster.keys),
+        rows=cluster.rows,
+        scraper_companies=sorted(cluster.scraper_companies),
+    )
+
+
+def _json_to_cluster(data):
+    return CompanyCluster(
+        brands=frozenset(data['brands']),
+        company_names={
+            (company, company_name, is_alias): frozenset(keys)
+            for company, company_name, is_alias, keys
+            in data['company_names']},
+        keys=frozenset(data['keys']),
+        rows=[(table_name, row) for table_name, row in data['rows']],
+        scraper_companies=frozenset(
+            tuple(sc) for sc in data['scraper_companies']),
+    )
+
+
+def _get_keys(names):
+    """Get keys for matching for each of the given names."""
+    keys = set()
+    for name in names:
+        keys.update(get_company_keys(name))
+    return keys
 
 
 def pick_company_name(names):
@@ -204,90 +474,6 @@ def pick_company_full(names):
 
 
 
-def get_company_keys(s):
-    variants = set()
-
-    variants.add(norm(CAMEL_CASE_RE.sub(' ', s)))
-
-    norm_s = norm(s)
-    variants.add(norm_s)
-    variants.add(norm_s.replace('-', ''))
-    variants.add(norm_s.replace('-', ' '))
-    variants.add(norm_s.replace(' and ', ' & '))
-    variants.add(norm_s.replace(' and ', '&'))
-    variants.add(norm_s.replace('&', ' & '))
-    variants.add(norm_s.replace('&', ' and '))
-    variants.add(norm_s.replace('.', ''))
-    variants.add(norm_s.replace('.', '. '))
-    variants.add(norm_s.replace("'", ''))
-
-    return set(simplify_whitespace(v) for v in variants)
-
-
-@lru_cache()
-def get_company_names(company):
-    """Get a set of possible ways to display company name."""
-    return set(v for v in _yield_company_names(company)
-               if len(v) > 1)
-
-
-def _yield_company_names(company):
-    company = COMPANY_CORRECTIONS.get(company) or company
-
-    # if it's a name like Foo, Inc., allow "Foo" as a display variant
-    m = COMPANY_TYPE_RE.match(company)
-    if m and m.group('company') not in BAD_COMPANY_ALIASES:
-        # process and re-build
-        company = m.group('company')
-        intl1 = m.group('intl1') or ''
-        c_type = m.group('type')
-        intl2 = m.group('intl2') or ''
-        c_type = COMPANY_TYPE_CORRECTIONS.get(c_type) or c_type
-        c_full = company + intl1 + ' ' + c_type + intl2
-
-        yield c_full
-
-        # if the "Inc." etc. is part of the name, stop here
-        if (c_type in UNSTRIPPABLE_COMPANY_TYPES or
-            c_full in UNSTRIPPABLE_COMPANIES):
-            return
-
-    yield company
-
-    # handle # "The X Co.", "X [&] Co."
-    for regex in COMPANY_NAME_REGEXES:
-        m = regex.match(company)
-        if m:
-            name = m.group('company')
-            if name not in BAD_COMPANY_ALIASES:
-                yield name
-                break
-
-
-@lru_cache()
-def get_company_aliases(company):
-    """Get a set of all ways to match against this company. Some of
-    these may be too abbreviated to use as the company's display name."""
-    aliases = get_company_names(company)
-
-    # Match "The X Company", "X Company", "Groupe X"
-    for regex in COMPANY_ALIAS_REGEXES:
-        m = regex.match(company)
-        if m:
-            alias = m.group('company')
-            if alias not in BAD_COMPANY_ALIASES:
-                aliases.add(alias)
-                break
-
-    # split on slashes
-    for a in list(aliases):
-        if '/' in a and not COMPANY_TYPE_RE.match(a):  # don't split A/S
-            aliases.update((part.strip() for part in a.split('/')))
-
-    # remove short/empty matches
-    return set(a for a in aliases if len(a) > 1)
-
-
 def map_company(output_db, scraper_id, scraper_company):
     """Get the canonical company corresponding to the
     given company in the scraper data."""
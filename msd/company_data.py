@@ -159,61 +159,89 @@ COMPANY_ALIAS_REGEXES = [
 ]
 
 # Inc. etc. -- stuff to strip before even doing the above
+#
+# These are literal strings. Where more than one matches, earlier ones
+# win (see msd.key.match_company_type()), so list variants with
+# optional trailing periods, etc. longest first.
+COMPANY_TYPES = [
+    'A.& S. Klein GmbH & Co. KG',
+    'A& S. Klein GmbH & Co. KG',
+    'A/S',
+    'AB',
+    'AG',
+    'AS',
+    'ASA',
+    'Ab',
+    'BV',
+    'B.V.',
+    'B.V. Nederland',
+    'C.V.',
+    'Corp.',
+    'GmbH & Co. oHG',
+    'GmbH & Co. OHG',
+    'GmbH & CO. oHG',
+    'GmbH & CO. OHG',
+    'GmbH & Co. KG.',
+    'GmbH & Co. KG',
+    'GmbH & Co.KG.',  # handle typo: Lukas Meindl GmbH & Co.KG
+    'GmbH & Co.KG',
+    'GmbH & Co. KGaA',
+    'GmbH',
+    'Inc.',
+    'Inc',
+    'Incorporated',
+    'International',
+    'KG.',
+    'KG',
+    'Llc',
+    'LLC',
+    'LLP',
+    'LP',
+    'Limited',
+    'Llp',
+    'Ltd.',
+    'Ltd',
+    'Ltda.',
+    'Ltda',
+    'nv',
+    'NV',
+    'N.V.',
+    'PBC',  # "Public Benefit Corporation"? Only on B Corp site
+    'PLC',
+    'P.C.',
+    'Pty. Ltd.',
+    'Pty. Ltd',
+    'Pty Ltd.',
+    'Pty Ltd',
+    'Pty.',
+    'Pty',
+    'S.L.',
+    'SA',
+    'SAPI DE CV SOFOM ENR',
+    'SARL',
+    'SE',
+    'S.A.',
+    'S.A',
+    'S.A.B. de C.V.',
+    'S.A.U.',
+    'S.R.L.',
+    'S.p.A.',
+    'Sarl',
+    'SpA',
+    'asa',
+    'b.v.',
+    'gmbh',
+    'inc.',
+    'inc',
+    'plc.',
+    'plc',
+]
+
+# regex equivalent of msd.key.match_company_type() (slower, but handy
+# for testing)
 COMPANY_TYPE_RE = re.compile(
-    r'^(?P<company>.*?)(?P<intl1> International)?,? (?P<type>'
-    r'A\.?& S\. Klein GmbH \& Co\. KG'
-    r'|A/S'
-    r'|AB'
-    r'|AG'
-    r'|AS'
-    r'|ASA'
-    r'|Ab'
-    r'|BV'
-    r'|B\.V\.'
-    r'|B.V. Nederland'
-    r'|C\.V\.'
-    r'|Corp.'
-    r'|GmbH \& C[oO]\. [oO]HG'
-    r'|GmbH \& Co\. ?KG\.?'  # handle typo: Lukas Meindl GmbH & Co.KG
-    r'|GmbH \& Co\. KGaA'
-    r'|GmbH'
-    r'|Inc\.?'
-    r'|Incorporated'
-    r'|International'
-    r'|KG\.?'
-    r'|Llc'
-    r'|LLC'
-    r'|LLP'
-    r'|LP'
-    r'|Limited'
-    r'|Llp'
-    r'|Ltd\.?'
-    r'|Ltda\.?'
-    r'|nv'
-    r'|NV'
-    r'|N\.V\.'
-    r'|PBC'  # "Public Benefit Corporation"? Only on B Corp site
-    r'|PLC'
-    r'|P\.C\.'
-    r'|Pty\.? Ltd\.?'
-    r'|Pty\.?'
-    r'|S.\L\.'
-    r'|SA'
-    r'|SAPI DE CV SOFOM ENR'
-    r'|SARL'
-    r'|SE'
-    r'|S\.A\.?'
-    r'|S.A.B. de C.V.'
-    r'|S\.A\.U\.'
-    r'|S\.R\.L\.'
-    r'|S\.p\.A\.'
-    r'|Sarl'
-    r'|SpA'
-    r'|asa'
-    r'|b\.v\.'
-    r'|gmbh'
-    r'|inc\.?'
-    r'|plc\.?'
+    r'^(?P<company>.*?)(?P<intl1> International)?,? (?P<type>' +
+    '|'.join(re.escape(t) for t in COMPANY_TYPES) +
     r')(?P<intl2> International)?$'
 )
 
@@ -13,14 +13,28 @@
 # limitations under the License.
 import sqlite3
 from itertools import groupby
+from os.path import abspath
+from urllib.request import pathname2url
 
+from .norm import norm
+from .norm import smunch
 
-def create_table(db, table_name, columns, primary_key=None):
+# PRAGMA settings for read-only DBs
+READONLY_MMAP_SIZE = 2 ** 30  # 1 GB (SQLite caps this at compile time)
+READONLY_CACHE_SIZE = -64 * 1024  # negative means KiB, so 64 MB
+
+
+def create_table(db, table_name, columns, primary_key=None, *,
+                 without_rowid=False):
     """Create a table with the given columns and, optionally, primary key.
 
     *columns* is a map from column name to type
     *primary_key* is a list of column names
+    *without_rowid* makes a WITHOUT ROWID table, clustered on the primary
+    key (which is required, and can't contain NULLs)
     """
+    if without_rowid and not primary_key:
+        raise ValueError('WITHOUT ROWID tables need a primary key')
 
     col_def_sql = ', '.join('`{}` {}'.format(col_name, col_type)
                             for col_name, col_type in sorted(columns.items()))
@@ -33,6 +47,9 @@ def create_table(db, table_name, columns, primary_key=None):
     create_sql = 'CREATE TABLE `{}` ({}{})'.format(
         table_name, col_def_sql, primary_key_sql)
 
+    if without_rowid:
+        create_sql += ' WITHOUT ROWID'
+
     db.execute(create_sql)
 
 
@@ -53,6 +70,13 @@ def col_sql(col_names):
     return ', '.join('`{}`'.format(col_name) for col_name in col_names)
 
 
+def get_db_size(db):
+    """Get the size of the given (open) database, in bytes."""
+    page_count = db.execute('PRAGMA page_count').fetchone()[0]
+    page_size = db.execute('PRAGMA page_size').fetchone()[0]
+    return page_count * page_size
+
+
 def insert_row(db, table_name, row):
     col_names, values = list(zip(*sorted(row.items())))
 
@@ -64,15 +88,84 @@ def insert_row(db, table_name, row):
     db.execute(insert_sql, values)
 
 
-def open_db(path):
+def open_db(path, *, readonly=False):
     """Open the sqlite database at the given path
     Use sqlite3.Row as our row_factory to wrap rows like dicts.
+
+    If *readonly* is true, open the database read-only and immutable
+    (it had better not change while we're reading it), and memory-map
+    it, so that lots of small indexed lookups are cheap.
     """
-    db = sqlite3.connect(path)
+    if readonly:
+        uri = 'file:{}?mode=ro&immutable=1'.format(pathname2url(abspath(path)))
+        db = sqlite3.connect(uri, uri=True)
+        db.execute('PRAGMA mmap_size = {:d}'.format(READONLY_MMAP_SIZE))
+        db.execute('PRAGMA cache_size = {:d}'.format(READONLY_CACHE_SIZE))
+    else:
+        db = sqlite3.connect(path)
+
     db.row_factory = sqlite3.Row
+    create_functions(db)
     return db
 
 
+def create_functions(db):
+    """Make our string normalization functions (norm() and smunch())
+    available in SQL, as well as the merge_values() aggregate (see
+    MergeValues)."""
+    for func in (norm, smunch):
+        db.create_function(func.__name__, 1, _null_safe(func),
+                           deterministic=True)
+
+    db.create_aggregate('merge_values', 2, MergeValues)
+
+
+class MergeValues:
+    """SQL aggregate, merge_values(value, order), that merges values the
+    way msd.merge.merge_dicts() does: the first non-null value wins,
+    except that '' is replaced by whatever comes next that isn't ''.
+
+    SQLite feeds aggregates rows in whatever order the query plan visits
+    them, so "first" is by *order* (and then by *value*), which we sort
+    on in finalize().
+    """
+    def __init__(self):
+        self.values = []
+
+    def step(self, value, order):
+        self.values.append((order, value))
+
+    def finalize(self):
+        merged = None
+
+        for _, value in sorted(self.values, key=sqlite_sort_key):
+            if merged is None or (merged == '' and value != ''):
+                merged = value
+
+        return merged
+
+
+def _null_safe(func):
+    return lambda s: None if s is None else func(s)
+
+
+def save_db(db, path):
+    """Copy the given (open) database to *path* in one sequential pass,
+    using the backup API.
+
+    *db* must not be in the middle of a transaction (the backup API
+    would wait forever for it to finish).
+    """
+    if db.in_transaction:
+        raise ValueError("can't save a DB with uncommitted changes")
+
+    dest_db = sqlite3.connect(path)
+    try:
+        db.backup(dest_db)
+    finally:
+        dest_db.close()
+
+
 def select_groups(db, table_name, key_cols, cols=None):
     """Select all rows in the given table. Yield tuples of
     (key, [rows]), where key is the values of the various key
@@ -94,7 +187,33 @@ def select_groups(db, table_name, key_cols, cols=None):
         yield key, [dict(row) for row in rows]
 
 
+def sqlite_sort_key(values):
+    """Sort key for a tuple of values that matches how SQLite orders
+    them in ORDER BY (NULL, then numbers, then text, then blobs; text is
+    compared by code point, like SQLite's default BINARY collation)."""
+    return tuple(_sqlite_sort_key(v) for v in values)
+
+
+def _sqlite_sort_key(value):
+    if value is None:
+        return (0,)
+    elif isinstance(value, (int, float)):
+        return (1, value)
+    elif isinstance(value, str):
+        return (2, value)
+    else:
+        return (3, bytes(value))
+
+
+def show_columns(db, table_name):
+    """List the columns of the given table, in table order."""
+    sql = 'PRAGMA table_info(`{}`)'.format(table_name)
+    return [row[1] for row in db.execute(sql)]
+
+
 def show_tables(db):
-    """List the tables in the given db."""
-    sql = "SELECT name FROM sqlite_master WHERE type = 'table'"
+    """List the tables in the given db (not including SQLite's internal
+    tables, like sqlite_stat1)."""
+    sql = ("SELECT name FROM sqlite_master WHERE type = 'table'"
+           " AND name NOT LIKE 'sqlite\\_%' ESCAPE '\\'")
     return sorted(row[0] for row in db.execute(sql))
@@ -0,0 +1,361 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Deltas between consecutive output DBs, so that mirrors can update
+their copy of msd.sqlite without downloading the whole thing.
+
+A delta is gzipped JSON, like:
+
+    {
+        "version": 2,
+        "old_digest": "...",
+        "new_digest": "...",
+        "drop": ["table_name", ...],
+        "tables": {
+            "table_name": {
+                "columns": ["col", ...],
+                "types": {"col": "type", ...},
+                "primary_key": ["col", ...],
+                "indexes": [["col", ...], ...],
+                "create": false,
+                "without_rowid": false,
+                "insert": [[value, ...], ...],
+                "update": [[value, ...], ...],
+                "delete": [[primary key value, ...], ...]
+            },
+            ...
+        }
+    }
+
+Rows in *insert* and *update* have a value for each of *columns*.
+If *create* is true, the table is (re-)created from scratch (e.g. because
+its columns changed) and all its rows are in *insert*. Only tables
+with changes are included.
+
+*types*, *primary_key*, *indexes*, and *without_rowid* describe the
+table in the new DB, so that apply_delta() can create tables without
+relying on its own (possibly different) version of TABLES.
+
+*old_digest* and *new_digest* are db_digest() of the DB before and after
+applying the delta; apply_delta() checks both. This only covers tables
+in TABLES; if the DB has a search table, apply_delta() rebuilds it.
+
+To apply a delta from the command line, use bin/msd-apply-delta (or
+python -m msd.delta).
+"""
+import gzip
+import json
+import logging
+from argparse import ArgumentParser
+from os import remove
+from os import rename
+from os.path import abspath
+from os.path import exists
+from os.path import getsize
+from urllib.request import pathname2url
+
+from .db import col_sql
+from .db import create_index
+from .db import create_table
+from .db import open_db
+from .db import show_tables
+from .db import sqlite_sort_key
+from .digest import db_digest
+from .digest import digestible_table_names
+from .digest import table_columns
+from .search import SEARCH_TABLE
+from .search import build_search_table
+
+log = logging.getLogger(__name__)
+
+DELTA_VERSION = 2
+
+
+def write_delta(old_db_path, new_db_path, delta_path):
+    """Write a delta that turns the output DB at *old_db_path* into the
+    one at *new_db_path* to *delta_path*.
+
+    Returns a dictionary with the number of rows *inserted*, *updated*,
+    and *deleted*, and the *size* of the delta in bytes.
+    """
+    log.info('writing delta from {} to {}'.format(old_db_path, delta_path))
+
+    delta = get_delta(old_db_path, new_db_path)
+
+    tmp_path = delta_path + '.tmp'
+    if exists(tmp_path):
+        remove(tmp_path)
+
+    with gzip.open(tmp_path, 'wt', encoding='utf8') as f:
+        json.dump(delta, f, separators=(',', ':'), sort_keys=True)
+
+    rename(tmp_path, delta_path)
+
+    stats = dict(inserted=0, updated=0, deleted=0)
+    for table_delta in delta['tables'].values():
+        stats['inserted'] += len(table_delta['insert'])
+        stats['updated'] += len(table_delta['update'])
+        stats['deleted'] += len(table_delta['delete'])
+    stats['size'] = getsize(delta_path)
+
+    log.info('  {:d} inserted, {:d} updated, {:d} deleted ({:d} bytes)'.format(
+        stats['inserted'], stats['updated'], stats['deleted'],
+        stats['size']))
+
+    return stats
+
+
+def get_delta(old_db_path, new_db_path):
+    """Compute a delta (see above) from the output DB at *old_db_path* to
+    the one at *new_db_path*, as a dict."""
+    old_db = open_db(old_db_path, readonly=True)
+    try:
+        old_digest = db_digest(old_db)
+        old_table_names = set(digestible_table_names(old_db))
+    finally:
+        old_db.close()
+
+    db = open_db(new_db_path, readonly=True)
+    try:
+        new_digest = db_digest(db)
+
+        db.execute('ATTACH DATABASE ? AS `old`', [
+            'file:{}?mode=ro&immutable=1'.format(
+                pathname2url(abspath(old_db_path)))])
+
+        tables = {}
+        for table_name in digestible_table_names(db):
+            table_delta = _get_table_delta(
+                db, table_name, old_table_names)
+            if table_delta is not None:
+                tables[table_name] = table_delta
+
+        drop = sorted(old_table_names - set(digestible_table_names(db)))
+    finally:
+        db.close()
+
+    return dict(
+        drop=drop,
+        new_digest=new_digest,
+        old_digest=old_digest,
+        tables=tables,
+        version=DELTA_VERSION,
+    )
+
+
+def _get_table_delta(db, table_name, old_table_names):
+    """Diff main.*table_name* against old.*table_name* in *db*, on
+    primary key. Returns None if they're the same."""
+    cols = table_columns(db, table_name)
+    types, primary_key = _table_types_and_primary_key(db, table_name)
+    pk_idxs = [cols.index(col) for col in primary_key]
+
+    def pk_of(row):
+        return tuple(row[i] for i in pk_idxs)
+
+    table_delta = dict(
+        columns=cols,
+        create=False,
+        delete=[],
+        indexes=_table_indexes(db, table_name),
+        insert=[],
+        primary_key=primary_key,
+        types=types,
+        update=[],
+        without_rowid=_is_without_rowid(db, table_name),
+    )
+
+    if (table_name not in old_table_names or
+            _old_table_columns(db, table_name) != cols):
+        table_delta['create'] = True
+        table_delta['insert'] = _sorted_rows(
+            db.execute('SELECT {} FROM main.`{}`'.format(
+                col_sql(cols), table_name)), pk_of)
+        return table_delta
+
+    # rows that are new or changed, and rows that are gone or changed.
+    # EXCEPT compares whole rows (and treats NULLs as equal)
+    except_sql = 'SELECT {0} FROM {1}.`{3}` EXCEPT SELECT {0} FROM {2}.`{3}`'
+
+    new_rows = list(db.execute(except_sql.format(
+        col_sql(cols), 'main', 'old', table_name)))
+    old_pks = set(pk_of(row) for row in db.execute(except_sql.format(
+        col_sql(cols), 'old', 'main', table_name)))
+
+    if not (new_rows or old_pks):
+        return None
+
+    new_pks = set()
+    for row in new_rows:
+        pk = pk_of(row)
+        new_pks.add(pk)
+        if pk in old_pks:
+            table_delta['update'].append(row)
+        else:
+            table_delta['insert'].append(row)
+
+    table_delta['insert'] = _sorted_rows(table_delta['insert'], pk_of)
+    table_delta['update'] = _sorted_rows(table_delta['update'], pk_of)
+    table_delta['delete'] = [
+        list(pk) for pk in sorted(old_pks - new_pks, key=sqlite_sort_key)]
+
+    return table_delta
+
+
+def _old_table_columns(db, table_name):
+    return sorted(row[1] for row in db.execute(
+        'PRAGMA old.table_info(`{}`)'.format(table_name)))
+
+
+def _table_types_and_primary_key(db, table_name):
+    """Get a map from column to declared type, and the list of primary
+    key columns, for main.*table_name*."""
+    types = {}
+    pk_cols = []
+    for _, col, col_type, _, _, pk in db.execute(
+            'PRAGMA main.table_info(`{}`)'.format(table_name)):
+        types[col] = col_type
+        if pk:
+            pk_cols.append((pk, col))
+
+    return types, [col for _, col in sorted(pk_cols)]
+
+
+def _table_indexes(db, table_name):
+    """Get the columns of each index we created on main.*table_name*
+    (not including the primary key), in order of index name."""
+    index_names = sorted(
+        row[1] for row in db.execute(
+            'PRAGMA main.index_list(`{}`)'.format(table_name))
+        if row[3] == 'c')
+
+    return [[row[2] for row in db.execute(
+                'PRAGMA main.index_info(`{}`)'.format(index_name))]
+            for index_name in index_names]
+
+
+def _is_without_rowid(db, table_name):
+    sql = db.execute(
+        "SELECT sql FROM main.sqlite_master WHERE type = 'table'"
+        " AND name = ?", [table_name]).fetchone()[0]
+    return sql.rstrip().upper().endswith('WITHOUT ROWID')
+
+
+def _sorted_rows(rows, pk_of):
+    return [list(row) for row in
+            sorted(rows, key=lambda row: sqlite_sort_key(pk_of(row)))]
+
+
+def read_delta(delta_path):
+    """Read a delta written by write_delta()."""
+    with gzip.open(delta_path, 'rt', encoding='utf8') as f:
+        delta = json.load(f)
+
+    if delta.get('version') != DELTA_VERSION:
+        raise ValueError('{} is delta version {}, not {:d}'.format(
+            delta_path, delta.get('version'), DELTA_VERSION))
+
+    return delta
+
+
+def apply_delta(db_path, delta_path):
+    """Apply the delta at *delta_path* to the output DB at *db_path*,
+    in place.
+
+    Raises ValueError (and leaves the DB alone) if the DB isn't the one
+    the delta was made from, or if the result doesn't match the
+    delta's *new_digest*.
+    """
+    delta = read_delta(delta_path)
+
+    db = open_db(db_path)
+    try:
+        if db_digest(db) != delta['old_digest']:
+            raise ValueError(
+                "{} isn't the DB that {} was made from".format(
+                    db_path, delta_path))
+
+        # DDL doesn't start a transaction implicitly
+        db.execute('BEGIN')
+        try:
+            _apply_delta_to_db(db, delta)
+
+            if db_digest(db) != delta['new_digest']:
+                raise ValueError(
+                    "applying {} to {} didn't produce the expected"
+                    " result".format(delta_path, db_path))
+        except Exception:
+            db.rollback()
+            raise
+
+        db.commit()
+    finally:
+        db.close()
+
+
+def _apply_delta_to_db(db, delta):
+    for table_name in delta['drop']:
+        log.info('  dropping {}'.format(table_name))
+        db.execute('DROP TABLE `{}`'.format(table_name))
+
+    for table_name, table_delta in sorted(delta['tables'].items()):
+        log.info('  updating {}'.format(table_name))
+
+        cols = table_delta['columns']
+        primary_key = table_delta['primary_key']
+
+        if table_delta['create']:
+            db.execute('DROP TABLE IF EXISTS `{}`'.format(table_name))
+            create_table(db, table_name, table_delta['types'], primary_key,
+                         without_rowid=table_delta['without_rowid'])
+            for index_cols in table_delta['indexes']:
+                create_index(db, table_name, index_cols)
+
+        # replace updated rows, rather than INSERT OR REPLACE, in case
+        # the primary key contains NULLs
+        db.executemany(
+            'DELETE FROM `{}` WHERE {}'.format(
+                table_name,
+                ' AND '.join('`{}` IS ?'.format(col) for col in primary_key)),
+            table_delta['delete'] +
+            [[row[cols.index(col)] for col in primary_key]
+             for row in table_delta['update']])
+
+        db.executemany(
+            'INSERT INTO `{}` ({}) VALUES ({})'.format(
+                table_name, col_sql(cols), ', '.join('?' for _ in cols)),
+            table_delta['update'] + table_delta['insert'])
+
+    # the search table is derived from other tables, so just rebuild it
+    if delta['tables'] and SEARCH_TABLE in show_tables(db):
+        db.execute('DROP TABLE `{}`'.format(SEARCH_TABLE))
+        build_search_table(db)
+
+
+def main(args=None):
+    parser = ArgumentParser(
+        description='Apply a delta written by msd --delta to a copy of'
+        ' the output DB it was made from')
+    parser.add_argument(
+        dest='db', help='Output DB to update in place')
+    parser.add_argument(
+        dest='delta', help='Delta to apply')
+    opts = parser.parse_args(args)
+
+    logging.basicConfig(format='%(name)s: %(message)s', level=logging.INFO)
+
+    apply_delta(opts.db, opts.delta)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Content hashes ("digests") of output tables and DBs.
+
+A table's digest depends only on its columns and rows, not on the order
+the rows are stored in or how the file is laid out, so two output DBs
+with the same data have the same digests even if one is WITHOUT ROWID
+or has been VACUUMed.
+
+Only tables in TABLES are covered; derived tables like the search table
+are ignored.
+"""
+import json
+from hashlib import sha256
+
+from .db import col_sql
+from .db import show_tables
+from .table import TABLES
+
+# row digests are summed modulo this, so their order doesn't matter
+_MODULUS = 2 ** 256
+
+
+def db_digest(db, *, table_digests=None):
+    """Get a hex digest of the contents of every table in *db* that's
+    in TABLES.
+
+    If you've already called table_digest() on each table, you can pass
+    the results in as *table_digests* (a map from table name to digest).
+    """
+    if table_digests is None:
+        table_digests = get_table_digests(db)
+
+    h = sha256()
+    for table_name, digest in sorted(table_digests.items()):
+        h.update('{} {}\n'.format(table_name, digest).encode('utf8'))
+
+    return h.hexdigest()
+
+
+def get_table_digests(db):
+    """Get a map from table name to table_digest() for every table in
+    *db* that's in TABLES."""
+    return {table_name: table_digest(db, table_name)
+            for table_name in digestible_table_names(db)}
+
+
+def digestible_table_names(db):
+    """Names of tables in *db* that are in TABLES."""
+    return [table_name for table_name in show_tables(db)
+            if table_name in TABLES]
+
+
+def table_digest(db, table_name):
+    """Get a hex digest of the contents of the given table, independent
+    of row order."""
+    cols = table_columns(db, table_name)
+
+    total = int.from_bytes(sha256(
+        json.dumps(cols).encode('utf8')).digest(), 'big')
+
+    for row in db.execute('SELECT {} FROM `{}`'.format(
+            col_sql(cols), table_name)):
+        total += row_digest(row)
+
+    return '{:064x}'.format(total % _MODULUS)
+
+
+def table_columns(db, table_name):
+    """Sorted list of the names of the columns in the given table."""
+    return sorted(row[1] for row in db.execute(
+        'PRAGMA table_info(`{}`)'.format(table_name)))
+
+
+def row_digest(values):
+    """Hash a row (a sequence of values, in column order) to an int."""
+    data = json.dumps([_canonical_value(v) for v in values],
+                      ensure_ascii=False, separators=(',', ':'))
+    return int.from_bytes(sha256(data.encode('utf8')).digest(), 'big')
+
+
+def _canonical_value(value):
+    # SQLite considers 1 and 1.0 equal, so we should too
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    elif isinstance(value, bytes):
+        return value.hex()
+    else:
+        return value
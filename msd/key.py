@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+# Copyright 2014-2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Name variants and normalized keys used to match up companies
+and brands from different scrapers."""
+import re
+from collections import defaultdict
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from hashlib import sha1
+from logging import getLogger
+from os import cpu_count
+
+from . import company_data
+from . import norm as norm_module
+from .company_data import BAD_COMPANY_ALIASES
+from .company_data import COMPANY_ALIAS_REGEXES
+from .company_data import COMPANY_CORRECTIONS
+from .company_data import COMPANY_NAME_REGEXES
+from .company_data import COMPANY_TYPE_CORRECTIONS
+from .company_data import COMPANY_TYPES
+from .company_data import COMPANY_TYPE_RE
+from .company_data import UNSTRIPPABLE_COMPANIES
+from .company_data import UNSTRIPPABLE_COMPANY_TYPES
+from .norm import norm
+from .norm import simplify_whitespace
+from .norm import smunch
+
+# use this to turn e.g. "babyGap" into "baby Gap"
+# this can also turn "G.I. Joe" into "G. I. Joe"
+CAMEL_CASE_RE = re.compile(r'(?<=[a-z\.])(?=[A-Z])')
+
+TM_RE = re.compile('(®|\u2120|™)', re.U)
+
+INTERNATIONAL = ' International'
+
+# parts of a company name with a company type (see match_company_type())
+CompanyTypeMatch = namedtuple(
+    'CompanyTypeMatch', ['company', 'intl1', 'type', 'intl2'])
+
+# aliases, names, and keys for a company string (see expand_company())
+CompanyExpansion = namedtuple(
+    'CompanyExpansion', ['aliases', 'names', 'keys'])
+
+# don't bother with worker processes for fewer company strings than this
+MIN_PARALLEL_COMPANIES = 2000
+
+# number of company strings to send to a worker process at a time
+PARALLEL_CHUNK_SIZE = 256
+
+# expansions computed during this run, by company (see
+# clear_company_expansions())
+_expansions = {}
+
+log = getLogger(__name__)
+
+
+def get_company_keys(s):
+    variants = set()
+
+    variants.add(norm(CAMEL_CASE_RE.sub(' ', s)))
+
+    norm_s = norm(s)
+    variants.add(norm_s)
+    variants.add(norm_s.replace('-', ''))
+    variants.add(norm_s.replace('-', ' '))
+    variants.add(norm_s.replace(' and ', ' & '))
+    variants.add(norm_s.replace(' and ', '&'))
+    variants.add(norm_s.replace('&', ' & '))
+    variants.add(norm_s.replace('&', ' and '))
+    variants.add(norm_s.replace('.', ''))
+    variants.add(norm_s.replace('.', '. '))
+    variants.add(norm_s.replace("'", ''))
+
+    return set(simplify_whitespace(v) for v in variants)
+
+
+def match_company_type(s):
+    """Split a company name like "Foo International, Inc." into
+    company ("Foo"), intl1 (" International"), type ("Inc."), and
+    intl2 (None). Returns a CompanyTypeMatch, or None if *s* doesn't
+    end with a company type.
+
+    This is equivalent to matching COMPANY_TYPE_RE, but rather than
+    trying every alternative at every position, we look up the last
+    word of *s* (a company type always comes right after a space), and
+    only check the handful of company types that end with that word.
+    """
+    if '\n' in s:
+        # in the regex, . doesn't match newlines and $ matches before
+        # a trailing newline. Names from scrapers have their whitespace
+        # simplified, so this doesn't come up in practice; just let the
+        # regex handle it, so we can't disagree with it
+        m = COMPANY_TYPE_RE.match(s)
+        return m and CompanyTypeMatch(*m.group(
+            'company', 'intl1', 'type', 'intl2'))
+
+    best = None  # (sort key, company_end, intl1, type_idx, intl2)
+
+    for intl2 in (INTERNATIONAL, None):
+        end = len(s)
+        if intl2:
+            if not s.endswith(intl2):
+                continue
+            end -= len(intl2)
+
+        last_word = s[s.rfind(' ', 0, end) + 1:end]
+
+        for type_idx, space_type in _COMPANY_TYPES_BY_LAST_WORD.get(
+                last_word, ()):
+            if not s.endswith(space_type, 0, end):
+                continue
+
+            # the regex wants the shortest company, so take the comma
+            # and " International" before the company type if they're
+            # there (we can't have " International" without the comma
+            # if there's a comma)
+            c_end = end - len(space_type)
+            comma = c_end and s[c_end - 1] == ','
+            if comma:
+                c_end -= 1
+
+            intl1 = None
+            if s.endswith(INTERNATIONAL, 0, c_end):
+                intl1 = INTERNATIONAL
+                c_end -= len(INTERNATIONAL)
+
+            # then the same things the regex would prefer
+            sort_key = (c_end, not intl1, not comma, type_idx, not intl2)
+
+            if best is None or sort_key < best[0]:
+                best = (sort_key, c_end, intl1, type_idx, intl2)
+
+    if best is None:
+        return None
+
+    _, company_end, intl1, type_idx, intl2 = best
+    return CompanyTypeMatch(
+        s[:company_end], intl1, COMPANY_TYPES[type_idx], intl2)
+
+
+def _index_by_last_word(company_types):
+    """Map the last word of each company type to a list of
+    (index, company type with a space in front), in order."""
+    index = defaultdict(list)
+
+    for i, company_type in enumerate(company_types):
+        index[company_type.split(' ')[-1]].append((i, ' ' + company_type))
+
+    return dict(index)
+
+
+_COMPANY_TYPES_BY_LAST_WORD = _index_by_last_word(COMPANY_TYPES)
+
+
+@lru_cache()
+def get_company_names(company):
+    """Get a set of possible ways to display company name."""
+    return set(v for v in _yield_company_names(company)
+               if len(v) > 1)
+
+
+def _yield_company_names(company):
+    company = COMPANY_CORRECTIONS.get(company) or company
+
+    # if it's a name like Foo, Inc., allow "Foo" as a display variant
+    m = match_company_type(company)
+    if m and m.company not in BAD_COMPANY_ALIASES:
+        # process and re-build
+        company = m.company
+        intl1 = m.intl1 or ''
+        c_type = m.type
+        intl2 = m.intl2 or ''
+        c_type = COMPANY_TYPE_CORRECTIONS.get(c_type) or c_type
+        c_full = company + intl1 + ' ' + c_type + intl2
+
+        yield c_full
+
+        # if the "Inc." etc. is part of the name, stop here
+        if (c_type in UNSTRIPPABLE_COMPANY_TYPES or
+            c_full in UNSTRIPPABLE_COMPANIES):
+            return
+
+    yield company
+
+    # handle # "The X Co.", "X [&] Co."
+    for regex in COMPANY_NAME_REGEXES:
+        m = regex.match(company)
+        if m:
+            name = m.group('company')
+            if name not in BAD_COMPANY_ALIASES:
+                yield name
+                break
+
+
+@lru_cache()
+def get_company_aliases(company):
+    """Get a set of all ways to match against this company. Some of
+    these may be too abbreviated to use as the company's display name."""
+    aliases = get_company_names(company)
+
+    # Match "The X Company", "X Company", "Groupe X"
+    for regex in COMPANY_ALIAS_REGEXES:
+        m = regex.match(company)
+        if m:
+            alias = m.group('company')
+            if alias not in BAD_COMPANY_ALIASES:
+                aliases.add(alias)
+                break
+
+    # split on slashes
+    for a in list(aliases):
+        if '/' in a and not match_company_type(a):  # don't split A/S
+            aliases.update((part.strip() for part in a.split('/')))
+
+    # remove short/empty matches
+    return set(a for a in aliases if len(a) > 1)
+
+
+@lru_cache()
+def get_company_alias_keys(company):
+    """Get the keys of all aliases and names of the given company;
+    companies that share a key get merged."""
+    # get_company_aliases() before get_company_names(), to match what
+    # build_company_name_and_scraper_company_map_tables() does
+    aliases = get_company_aliases(company)
+    names = get_company_names(company)
+
+    keys = set()
+    for alias in aliases | names:
+        keys.update(get_company_keys(alias))
+    return keys
+
+
+def expand_company(company):
+    """Get a CompanyExpansion with the aliases, names, and keys of
+    the given company string.
+
+    This is the same as calling get_company_aliases(),
+    get_company_names(), and get_company_alias_keys(), in that order,
+    except that the result is remembered until the end of the run
+    (see clear_company_expansions()).
+    """
+    expansion = _expansions.get(company)
+
+    if expansion is None:
+        expansion = _compute_company_expansion(company)
+        _expansions[company] = expansion
+
+    return expansion
+
+
+def expand_companies(companies, *, max_workers=None):
+    """Call expand_company() on each of the given company strings, so that
+    later calls are just lookups.
+
+    Expansions we don't already have are computed in parallel, in up to
+    *max_workers* worker processes (default is one per CPU), unless
+    there are fewer than MIN_PARALLEL_COMPANIES of them.
+    """
+    companies = sorted(set(companies))
+
+    todo = [c for c in companies if c not in _expansions]
+
+    if max_workers is None:
+        max_workers = cpu_count() or 1
+
+    if len(todo) >= MIN_PARALLEL_COMPANIES and max_workers > 1:
+        log.info('expanding {:d} companies in {:d} processes'.format(
+            len(todo), max_workers))
+
+        with ProcessPoolExecutor(max_workers) as executor:
+            for company, expansion in zip(todo, executor.map(
+                    _compute_company_expansion, todo,
+                    chunksize=PARALLEL_CHUNK_SIZE)):
+                _expansions[company] = expansion
+
+    for company in companies:
+        expand_company(company)
+
+
+def _compute_company_expansion(company):
+    # get_company_aliases() before get_company_names(), because the
+    # former adds to the set returned by the latter
+    return CompanyExpansion(
+        aliases=get_company_aliases(company),
+        names=get_company_names(company),
+        keys=get_company_alias_keys(company))
+
+
+def clear_company_expansions():
+    """Forget the company expansions computed by expand_company() (we do
+    this at the start and end of each run)."""
+    _expansions.clear()
+
+
+@lru_cache()
+def company_expansion_version():
+    """Hash of the code and data that company expansions depend on."""
+    h = sha1()
+    for path in (company_data.__file__, norm_module.__file__, __file__):
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def get_brand_key(scraper_brand):
+    """Get the key for the given scraper brand (None if there's no brand
+    once we strip off the TM symbol); brands that share a key get merged.
+    """
+    brand, _ = split_brand_and_tm(scraper_brand)
+    if brand:
+        return smunch(brand)
+    else:
+        return None
+
+
+def split_brand_and_tm(scraper_brand):
+    """Split apart brand and TM/SM/(R) symbol, discarding anything
+    after the symbol."""
+    scraper_brand = scraper_brand or ''
+
+    m = TM_RE.search(scraper_brand)
+    if m:
+        return scraper_brand[:m.start()].strip(), m.group()
+    else:
+        return scraper_brand.strip(), ''
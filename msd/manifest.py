@@ -0,0 +1,126 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Manifests describing the contents of a published output DB, so that
+consumers can tell which tables changed between builds (and we can
+tell when there's nothing new to publish).
+
+A manifest is a JSON file next to the output DB (see
+get_manifest_path()), like:
+
+    {
+        "version": 1,
+        "digest": "...",
+        "tables": {"table_name": "...", ...},
+        "other_tables": ["search", ...],
+        "previous_digest": "...",
+        "changed_tables": ["table_name", ...]
+    }
+
+*digest* and the values of *tables* are content hashes (see
+msd.digest). *other_tables* lists tables not covered by the hashes
+(like the search table), so that adding or removing them counts as a
+change. Changes that don't affect content, like switching to WITHOUT
+ROWID tables, don't count.
+
+*previous_digest* is the *digest* of the previous manifest (or null if
+there wasn't one), and *changed_tables* lists the tables that were
+added, removed, or changed since then (every table, if there was no
+previous manifest).
+"""
+import json
+from logging import getLogger
+from os import remove
+from os import rename
+from os.path import exists
+
+from .db import show_tables
+from .digest import db_digest
+from .digest import get_table_digests
+
+log = getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+MANIFEST_SUFFIX = '.manifest.json'
+
+
+def get_manifest_path(output_db_path):
+    """Where to put the manifest for the output DB at *output_db_path*."""
+    return output_db_path + MANIFEST_SUFFIX
+
+
+def get_manifest(db, *, previous=None):
+    """Build a manifest (as a dict) for the (open) output DB *db*,
+    comparing it to the *previous* manifest, if any."""
+    table_digests = get_table_digests(db)
+
+    if previous is None:
+        previous_digest = None
+        changed_tables = sorted(table_digests)
+    else:
+        previous_digest = previous['digest']
+        previous_tables = previous['tables']
+        changed_tables = sorted(
+            table_name
+            for table_name in set(table_digests) | set(previous_tables)
+            if table_digests.get(table_name) !=
+            previous_tables.get(table_name))
+
+    return dict(
+        changed_tables=changed_tables,
+        digest=db_digest(db, table_digests=table_digests),
+        other_tables=[table_name for table_name in show_tables(db)
+                      if table_name not in table_digests],
+        previous_digest=previous_digest,
+        tables=table_digests,
+        version=MANIFEST_VERSION,
+    )
+
+
+def is_unchanged(manifest, previous):
+    """Does *manifest* describe the same contents as the *previous*
+    manifest (which may be None)?"""
+    return (previous is not None and
+            manifest['digest'] == previous['digest'] and
+            manifest['other_tables'] == previous['other_tables'])
+
+
+def read_manifest(path):
+    """Read the manifest at *path*. Return None if there isn't one, or it's
+    from a different version of msd."""
+    if not exists(path):
+        return None
+
+    with open(path, encoding='utf8') as f:
+        manifest = json.load(f)
+
+    if manifest.get('version') != MANIFEST_VERSION:
+        log.warning('ignoring {} (version {}, not {:d})'.format(
+            path, manifest.get('version'), MANIFEST_VERSION))
+        return None
+
+    return manifest
+
+
+def write_manifest(manifest, path):
+    """Write *manifest* (a dict) to *path*, atomically."""
+    tmp_path = path + '.tmp'
+    if exists(tmp_path):
+        remove(tmp_path)
+
+    with open(tmp_path, 'w', encoding='utf8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+    rename(tmp_path, path)
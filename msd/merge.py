@@ -13,24 +13,70 @@
 # limitations under the License.
 """Supporting code to merge data from the scratch table and write it
 to the output table."""
+from .db import col_sql
 from .db import create_index
 from .db import create_table
 from .db import insert_row
+from .schema import get_table_schema
 from .table import TABLES
 
+# number of rows to copy between DBs at a time
+COPY_CHUNK_SIZE = 1024
 
-def create_output_table(output_db, table_name):
+
+def create_output_table(output_db, table_name, *, without_rowid=False):
     table_def = TABLES[table_name]
     columns = table_def['columns']
     primary_key = table_def['primary_key']
-    indexes = table_def.get('indexes', ())
+    indexes = get_output_indexes(table_def)
 
-    create_table(output_db, table_name, columns, primary_key)
+    create_table(output_db, table_name, columns, primary_key,
+                 without_rowid=without_rowid)
 
     for index_cols in indexes:
         create_index(output_db, table_name, index_cols)
 
 
+def copy_output_table(output_db, dest_db, table_name, *, without_rowid=False):
+    """Copy an output table to another DB, in primary key order.
+    Indexes are created after the rows are copied."""
+    table_def = TABLES[table_name]
+    columns = table_def['columns']
+    primary_key = table_def['primary_key']
+    indexes = get_output_indexes(table_def)
+
+    create_table(dest_db, table_name, columns, primary_key,
+                 without_rowid=without_rowid)
+
+    cols = sorted(columns)
+
+    select_sql = 'SELECT {} FROM `{}` ORDER BY {}'.format(
+        col_sql(cols), table_name, col_sql(primary_key))
+
+    insert_sql = 'INSERT INTO `{}` ({}) VALUES ({})'.format(
+        table_name, col_sql(cols), ', '.join('?' for _ in cols))
+
+    cursor = output_db.cursor()
+    cursor.row_factory = None
+    cursor.execute(select_sql)
+
+    while True:
+        rows = cursor.fetchmany(COPY_CHUNK_SIZE)
+        if not rows:
+            break
+        dest_db.executemany(insert_sql, rows)
+
+    for index_cols in indexes:
+        create_index(dest_db, table_name, index_cols)
+
+
+def get_output_indexes(table_def):
+    """Get the indexes a table should have in the output DB, including
+    ones only the output DB needs (see msd.table)."""
+    return (list(table_def.get('indexes', ())) +
+            list(table_def.get('output_indexes', ())))
+
+
 def clean_output_row(row, table_name):
     """Clean row for output to the output DB.
 
@@ -38,36 +84,51 @@ def clean_output_row(row, table_name):
     * removing extra 'scraper_id' field
     * coercing is_* fields to 0 or 1
     """
-    table_def = TABLES[table_name]
-    columns = table_def['columns']
-    primary_key = table_def.get('primary_key', ())
+    return get_table_schema(table_name).clean(row)
 
-    row = row.copy()
 
-    # delete extra scraper_id column
-    if 'scraper_id' in row and 'scraper_id' not in columns:
-        del row['scraper_id']
+def output_row(output_db, table_name, row):
+    """Clean row and output it to output_db."""
+    schema = get_table_schema(table_name)
 
-    # make sure primary key cols exists and are non-null
-    for k in primary_key:
-        if row.get(k) is None:
-            if columns[k] == 'text':
-                row[k] = ''
-            else:
-                row[k] = 0
+    row = schema.clean(row)
 
-    # make sure is_* fields exist and are either 0 or 1
-    for k in sorted(columns):
-        if k.startswith('is_'):
-            row[k] = int(bool(row.get(k)))
+    values = schema.encode(row)
+    if values is None:
+        # unknown columns; let the database complain about them
+        insert_row(output_db, table_name, row)
+    else:
+        output_db.execute(schema.insert_sql, values)
 
-    return row
 
+def merge_rows(rows, table_name):
+    """Merge a sequence of rows from the given table (see
+    merge_dicts()). Unlike merge_dicts(), values must be scalars."""
+    return get_table_schema(table_name).merge(rows)
 
-def output_row(output_db, table_name, row):
-    """Clean row and output it to output_db."""
-    row = clean_output_row(row, table_name)
-    insert_row(output_db, table_name, row)
+
+def select_merged_rows(db, table_name, key_cols):
+    """Merge rows from the given (scratch) table with the same values
+    for *key_cols*, inside SQLite, using the merge_values() aggregate.
+    Yields merged rows as dicts, in order of *key_cols*.
+
+    This is equivalent to calling merge_rows() on each group from
+    select_groups(), with each group's rows sorted by scraper_id (see
+    merge_cols_sql()), without pulling every row into Python."""
+    select_sql = 'SELECT {} FROM `{}` GROUP BY {} ORDER BY {}'.format(
+        merge_cols_sql(get_table_schema(table_name).scratch_cols),
+        table_name, col_sql(key_cols), col_sql(key_cols))
+
+    for row in db.execute(select_sql):
+        yield dict(row)
+
+
+def merge_cols_sql(cols):
+    """SQL to merge the given columns with merge_values(), keeping
+    their names. Values from rows with a lower scraper_id (and then
+    lower values) win, regardless of the order SQLite visits rows in."""
+    return ', '.join('merge_values(`{0}`, `scraper_id`) AS `{0}`'.format(col)
+                     for col in cols)
 
 
 def merge_dicts(ds):
@@ -0,0 +1,359 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A compact, read-only file mapping normalized company and brand names
+to targets and counts of their judgments, for clients (like browser
+extensions) that don't need all of msd.sqlite.
+
+The file is meant to be memory-mapped and searched in place, without
+parsing. All integers are little-endian. It consists of:
+
+- a header (see HEADER)
+- names: normalized names (see get_brand_key()), as UTF-8, sorted by
+  their bytes, and front-coded in blocks of *block_size* names. Each
+  name is stored as a varint length of the prefix it shares with the
+  previous name in its block (0 for the first name), a varint length
+  of the rest of the name, and the rest of the name
+- block offsets: uint32 offset of each block, relative to the start of
+  the names, so we can bisect on the first name in each block
+- posting offsets: uint32 for each name, plus one more; the targets for
+  name *i* are postings[offsets[i]:offsets[i + 1]]
+- postings: uint32 target numbers
+- targets: a packed record for each target (see TARGET)
+- string offsets: uint32 for each string, plus one more
+- strings: company and brand names, as UTF-8
+
+Sections are padded so that each starts on a 4-byte boundary.
+"""
+import mmap
+from collections import defaultdict
+from collections import namedtuple
+from logging import getLogger
+from os import remove
+from os import rename
+from os.path import exists
+from struct import Struct
+
+from .key import get_brand_key
+
+log = getLogger(__name__)
+
+MAGIC = b'MSDNAMES'
+
+VERSION = 1
+
+# number of names in each front-coded block
+DEFAULT_BLOCK_SIZE = 16
+
+# magic, version, block_size, num_names, num_blocks, names_offset,
+# block_offsets_offset, posting_offsets_offset, postings_offset,
+# num_targets, targets_offset, num_strings, string_offsets_offset,
+# strings_offset
+HEADER = Struct('<8s13I')
+
+# company (string number), brand (string number), then counts of
+# positive, neutral, and negative ratings, and the same for claims
+TARGET = Struct('<II6H')
+
+UINT32 = Struct('<I')
+
+# counts are stored as uint16s
+MAX_COUNT = 0xffff
+
+# counts of positive, neutral, and negative judgments
+JudgmentCounts = namedtuple(
+    'JudgmentCounts', ['positive', 'neutral', 'negative'])
+
+# a target in the name index. *ratings* and *claims* are JudgmentCounts
+IndexedTarget = namedtuple(
+    'IndexedTarget', ['company', 'brand', 'ratings', 'claims'])
+
+# count judgments for each target, in SQL
+_JUDGMENT_COUNTS_SQL = (
+    'SELECT `company`, `brand`, SUM(`judgment` > 0), SUM(`judgment` = 0),'
+    ' SUM(`judgment` < 0) FROM `{}` GROUP BY `company`, `brand`')
+
+
+def write_name_index(output_db, path, *, block_size=DEFAULT_BLOCK_SIZE):
+    """Write a name index (see above) for the (filled) output DB
+    to *path*."""
+    log.info('writing name index to {}'.format(path))
+
+    targets_by_name = defaultdict(set)
+
+    for company, company_name in output_db.execute(
+            'SELECT `company`, `company_name` FROM `company_name`'):
+        key = get_brand_key(company_name)
+        if key:
+            targets_by_name[key].add((company, ''))
+
+    for company, brand in output_db.execute(
+            'SELECT `company`, `brand` FROM `brand`'):
+        key = get_brand_key(brand)
+        if key:
+            targets_by_name[key].add((company, brand))
+
+    targets = sorted(set().union(*targets_by_name.values()))
+    target_nums = {target: i for i, target in enumerate(targets)}
+
+    counts = {}
+    for table_name in ('rating', 'claim'):
+        for company, brand, *c in output_db.execute(
+                _JUDGMENT_COUNTS_SQL.format(table_name)):
+            counts[(table_name, company, brand)] = [
+                min(n, MAX_COUNT) for n in c]
+
+    strings = sorted(set(s for target in targets for s in target))
+    string_nums = {s: i for i, s in enumerate(strings)}
+
+    names = sorted(targets_by_name, key=lambda name: name.encode('utf8'))
+
+    # sections
+    names_data, block_offsets = _encode_names(
+        [name.encode('utf8') for name in names], block_size)
+
+    posting_offsets = [0]
+    postings = []
+    for name in names:
+        postings.extend(sorted(
+            target_nums[target] for target in targets_by_name[name]))
+        posting_offsets.append(len(postings))
+
+    targets_data = b''.join(
+        TARGET.pack(
+            string_nums[company], string_nums[brand],
+            *(counts.get(('rating', company, brand)) or (0, 0, 0)),
+            *(counts.get(('claim', company, brand)) or (0, 0, 0)))
+        for company, brand in targets)
+
+    string_offsets = [0]
+    strings_data = bytearray()
+    for s in strings:
+        strings_data.extend(s.encode('utf8'))
+        string_offsets.append(len(strings_data))
+
+    sections = [
+        names_data,
+        _pack_uint32s(block_offsets),
+        _pack_uint32s(posting_offsets),
+        _pack_uint32s(postings),
+        targets_data,
+        _pack_uint32s(string_offsets),
+        bytes(strings_data),
+    ]
+
+    # lay out sections after the header, 4-byte aligned
+    offsets = []
+    offset = HEADER.size
+    for section in sections:
+        offset = _align(offset)
+        offsets.append(offset)
+        offset += len(section)
+
+    (names_offset, block_offsets_offset, posting_offsets_offset,
+     postings_offset, targets_offset, string_offsets_offset,
+     strings_offset) = offsets
+
+    header = HEADER.pack(
+        MAGIC, VERSION, block_size, len(names), len(block_offsets),
+        names_offset, block_offsets_offset, posting_offsets_offset,
+        postings_offset, len(targets), targets_offset, len(strings),
+        string_offsets_offset, strings_offset)
+
+    tmp_path = path + '.tmp'
+    if exists(tmp_path):
+        remove(tmp_path)
+
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        for section_offset, section in zip(offsets, sections):
+            f.write(b'\0' * (section_offset - f.tell()))
+            f.write(section)
+
+    rename(tmp_path, path)
+
+    log.info('  {:d} names, {:d} targets'.format(len(names), len(targets)))
+
+
+def _encode_names(names, block_size):
+    """Front-code *names* (sorted bytes) in blocks. Returns the encoded
+    names and a list of the offset of each block."""
+    data = bytearray()
+    block_offsets = []
+    prev = b''
+
+    for i, name in enumerate(names):
+        if i % block_size == 0:
+            block_offsets.append(len(data))
+            prefix_len = 0
+        else:
+            prefix_len = _common_prefix_len(prev, name)
+
+        data.extend(_encode_varint(prefix_len))
+        data.extend(_encode_varint(len(name) - prefix_len))
+        data.extend(name[prefix_len:])
+        prev = name
+
+    return bytes(data), block_offsets
+
+
+def _common_prefix_len(a, b):
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+
+def _encode_varint(n):
+    """Encode a non-negative int as an unsigned LEB128 varint."""
+    out = bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+def _decode_varint(buf, pos):
+    """Decode a varint at *pos* in *buf*. Returns (n, next pos)."""
+    n = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _pack_uint32s(values):
+    return Struct('<{:d}I'.format(len(values))).pack(*values)
+
+
+def _align(offset):
+    return (offset + 3) & ~3
+
+
+class NameIndex:
+    """Read a name index written by write_name_index(), memory-mapping it
+    rather than reading it into memory.
+
+    Use lookup() to find the targets for a company or brand name.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, self.block_size, self.num_names, self.num_blocks,
+         self._names_offset, self._block_offsets_offset,
+         self._posting_offsets_offset, self._postings_offset,
+         self.num_targets, self._targets_offset, self.num_strings,
+         self._string_offsets_offset, self._strings_offset) = (
+             HEADER.unpack_from(self._mmap, 0))
+
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('{} is not a name index'.format(path))
+        if version != VERSION:
+            self.close()
+            raise ValueError('{} is name index version {:d}, not {:d}'.format(
+                path, version, VERSION))
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def lookup(self, name):
+        """Get a list of IndexedTarget for the company or brand called
+        *name* (matched by get_brand_key()), or [] if there are none."""
+        key = get_brand_key(name)
+        if not key:
+            return []
+
+        name_num = self._find_name(key.encode('utf8'))
+        if name_num is None:
+            return []
+
+        start = self._uint32(self._posting_offsets_offset, name_num)
+        end = self._uint32(self._posting_offsets_offset, name_num + 1)
+
+        return [self._target(self._uint32(self._postings_offset, i))
+                for i in range(start, end)]
+
+    def _find_name(self, key):
+        """Get the number of the name *key* (bytes), or None."""
+        buf = self._mmap
+
+        # find the last block whose first name is <= key
+        lo, hi = 0, self.num_blocks
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._block_head(mid) <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        block = lo - 1
+        if block < 0:
+            return None
+
+        # scan the block
+        pos = self._names_offset + self._uint32(
+            self._block_offsets_offset, block)
+        first = block * self.block_size
+        last = min(first + self.block_size, self.num_names)
+        name = b''
+
+        for name_num in range(first, last):
+            prefix_len, pos = _decode_varint(buf, pos)
+            suffix_len, pos = _decode_varint(buf, pos)
+            name = name[:prefix_len] + buf[pos:pos + suffix_len]
+            pos += suffix_len
+
+            if name == key:
+                return name_num
+            elif name > key:
+                return None
+
+        return None
+
+    def _block_head(self, block):
+        pos = self._names_offset + self._uint32(
+            self._block_offsets_offset, block)
+        _, pos = _decode_varint(self._mmap, pos)  # prefix len; always 0
+        n, pos = _decode_varint(self._mmap, pos)
+        return self._mmap[pos:pos + n]
+
+    def _target(self, target_num):
+        company, brand, *counts = TARGET.unpack_from(
+            self._mmap, self._targets_offset + target_num * TARGET.size)
+
+        return IndexedTarget(
+            self._string(company), self._string(brand),
+            JudgmentCounts(*counts[:3]), JudgmentCounts(*counts[3:]))
+
+    def _string(self, string_num):
+        start = self._uint32(self._string_offsets_offset, string_num)
+        end = self._uint32(self._string_offsets_offset, string_num + 1)
+        pos = self._strings_offset
+        return self._mmap[pos + start:pos + end].decode('utf8')
+
+    def _uint32(self, offset, i):
+        return UINT32.unpack_from(self._mmap, offset + 4 * i)[0]
@@ -0,0 +1,210 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Report company and brand names that are suspiciously similar (e.g.
+"Groupo Modelo" and "Grupo Modelo"), so that someone can add an alias
+for them.
+
+Comparing every pair of names is quadratic, so we use MinHash and
+locality-sensitive hashing (LSH) to put names into buckets, and
+only compare names that share a bucket."""
+import re
+from collections import defaultdict
+from itertools import combinations
+from logging import getLogger
+from random import Random
+from zlib import crc32
+
+from .merge import create_output_table
+from .merge import output_row
+from .norm import smunch
+
+log = getLogger(__name__)
+
+# compare names by their character n-grams (bigrams are forgiving
+# enough to catch one-letter typos in short names like "Oscar Meyer")
+NGRAM_SIZE = 2
+
+# names this short (after _simplify()) have too few n-grams to compare
+MIN_NAME_LEN = 4
+
+# punctuation, which shouldn't count when comparing names
+NON_WORD_RE = re.compile(r'\W+', re.U)
+
+# MinHash signatures are split into NUM_BANDS bands of BAND_ROWS values
+# each. Names become candidates if any band matches exactly; with 16
+# bands of 2 rows, a pair with similarity 0.6 has a >99% chance of
+# becoming a candidate, and a pair with similarity 0.2 about 48%
+NUM_BANDS = 16
+BAND_ROWS = 2
+
+# report pairs whose (Jaccard) similarity is at least this
+MIN_SIMILARITY = 0.6
+
+# buckets bigger than this are probably just common n-grams; split
+# them on more rows of the signature rather than go quadratic (see
+# _split_bucket())
+MAX_BUCKET_SIZE = 100
+
+# large prime for universal hashing
+_PRIME = (1 << 61) - 1
+
+# (a, b) for each of the hash functions in our MinHash signatures. These
+# are seeded so that output is the same from run to run
+_random = Random(0)
+_HASH_PARAMS = [
+    (_random.randrange(1, _PRIME), _random.randrange(0, _PRIME))
+    for _ in range(NUM_BANDS * BAND_ROWS)]
+del _random
+
+
+def build_near_duplicate_table(output_db, scratch_db):
+    """Build the near_duplicate table from the company and brand
+    tables.
+
+    Returns a dictionary of stats: the number of *near_duplicates*
+    found, and the number of *skipped_names* that were in a bucket too
+    big to compare, even after splitting it (see find_near_duplicates()).
+    """
+    log.info('  building near_duplicate table')
+    create_output_table(output_db, 'near_duplicate')
+
+    names_by_scope = defaultdict(set)
+
+    for (company,) in output_db.execute(
+            'SELECT `company` FROM `company`'):
+        names_by_scope[('company', '')].add(company)
+
+    for company, brand in output_db.execute(
+            'SELECT `company`, `brand` FROM `brand`'):
+        names_by_scope[('brand', company)].add(brand)
+
+    stats = dict(near_duplicates=0, skipped_names=0)
+
+    for (kind, company), names in sorted(names_by_scope.items()):
+        skipped = set()
+
+        for name, similar_name, similarity in find_near_duplicates(
+                names, skipped=skipped):
+            output_row(output_db, 'near_duplicate', dict(
+                company=company,
+                kind=kind,
+                name=name,
+                similar_name=similar_name,
+                similarity=similarity))
+            stats['near_duplicates'] += 1
+
+        stats['skipped_names'] += len(skipped)
+
+    if stats['skipped_names']:
+        log.warning('  skipped {:d} names in oversized buckets'.format(
+            stats['skipped_names']))
+
+    return stats
+
+
+def find_near_duplicates(names, *, min_similarity=MIN_SIMILARITY,
+                         skipped=None):
+    """Yield (name, similar_name, similarity) for each pair of names whose
+    n-grams have a Jaccard similarity of at least *min_similarity*.
+
+    *name* is always less than *similar_name*, and pairs are yielded in
+    sorted order.
+
+    If *skipped* is a set, add any names that were in a bucket we couldn't
+    split small enough to compare (their pairs may be missing).
+    """
+    ngrams = {}
+    for name in names:
+        s = _simplify(name)
+        if len(s) >= MIN_NAME_LEN:
+            ngrams[name] = get_ngrams(s)
+
+    signatures = {name: minhash(name_ngrams)
+                  for name, name_ngrams in ngrams.items()}
+
+    buckets = defaultdict(list)
+    for name in sorted(signatures):
+        signature = signatures[name]
+        for i in range(NUM_BANDS):
+            band = tuple(signature[i * BAND_ROWS:(i + 1) * BAND_ROWS])
+            buckets[(i, band)].append(name)
+
+    candidates = set()
+    for (i, _), bucket in buckets.items():
+        # split on the rest of the signature, starting after this band
+        rows = (list(range((i + 1) * BAND_ROWS, NUM_BANDS * BAND_ROWS)) +
+                list(range(i * BAND_ROWS)))
+
+        for sub_bucket in _split_bucket(bucket, signatures, rows, skipped):
+            candidates.update(combinations(sub_bucket, 2))
+
+    for name, similar_name in sorted(candidates):
+        similarity = jaccard(ngrams[name], ngrams[similar_name])
+        if similarity >= min_similarity:
+            yield name, similar_name, similarity
+
+
+def _split_bucket(bucket, signatures, rows, skipped=None):
+    """Yield sub-buckets of *bucket* with at most MAX_BUCKET_SIZE names,
+    splitting on the values of *signatures* at *rows*, one row at a time.
+
+    If we run out of rows, drop the bucket, and add its names to
+    *skipped* (if set).
+    """
+    if len(bucket) <= MAX_BUCKET_SIZE:
+        yield bucket
+        return
+
+    if not rows:
+        if skipped is not None:
+            skipped.update(bucket)
+        return
+
+    sub_buckets = defaultdict(list)
+    for name in bucket:
+        sub_buckets[signatures[name][rows[0]]].append(name)
+
+    for sub_bucket in sub_buckets.values():
+        if len(sub_bucket) > 1:
+            yield from _split_bucket(sub_bucket, signatures, rows[1:], skipped)
+
+
+def _simplify(name):
+    return NON_WORD_RE.sub('', smunch(name or ''))
+
+
+def get_ngrams(s):
+    """Get the set of character n-grams in *s* (which is just *s* if
+    it's too short)."""
+    if len(s) <= NGRAM_SIZE:
+        return {s}
+
+    return {s[i:i + NGRAM_SIZE] for i in range(len(s) - NGRAM_SIZE + 1)}
+
+
+def minhash(ngrams):
+    """Get the MinHash signature of a (non-empty) set of n-grams, as a
+    list of ints."""
+    hashes = [crc32(ngram.encode('utf8')) for ngram in ngrams]
+
+    return [min((a * h + b) % _PRIME for h in hashes)
+            for a, b in _HASH_PARAMS]
+
+
+def jaccard(a, b):
+    """Jaccard similarity of two sets."""
+    if not (a or b):
+        return 0.0
+
+    return len(a & b) / len(a | b)
@@ -20,6 +20,7 @@ from logging import getLogger
 from os import remove
 from os import rename
 from os.path import exists
+from os.path import getsize
 
 from .brand import build_brand_table
 from .brand import build_scraper_brand_map_table
@@ -27,34 +28,366 @@ from .campaign import build_campaign_table
 from .category import build_category_table
 from .category import build_scraper_category_map_table
 from .category import build_subcategory_table
-from .claim import build_claim_table
+from .claim import CLAIM_KEY_COLS
+from .claim import merge_claim_group
 from .company import build_company_table
 from .company import build_company_name_and_scraper_company_map_tables
-from .rating import build_rating_table
+from .company import load_company_clusters
+from .company import save_company_clusters
+from .delta import write_delta
+from .manifest import get_manifest
+from .manifest import get_manifest_path
+from .manifest import is_unchanged
+from .manifest import read_manifest
+from .manifest import write_manifest
+from .name_index import write_name_index
+from .near_duplicate import build_near_duplicate_table
+from .rating import RATING_KEY_COLS
+from .rating import merge_rating_group
+from .rating import normalize_rating_scores
 from .scraper import build_scraper_table
+from .search import build_search_table
+from .subset import fill_subset_dbs
+from .table import TABLES
+from .target import build_target_tables
+from .target_summary import build_target_summary_table
 
+from .db import get_db_size
 from .db import open_db
+from .db import save_db
+from .db import show_tables
+from .merge import copy_output_table
+
+# build the output DB in memory if the scratch DB is no bigger than this
+DEFAULT_MAX_IN_MEMORY_SIZE = 512 * 1024 * 1024
 
 log = getLogger(__name__)
 
 
-def build_output_db(scratch_db_path, output_db_path):
+def build_output_db(
+        scratch_db, output_db_path, *,
+        company_cache_path=None,
+        delta_path=None,
+        max_in_memory_size=DEFAULT_MAX_IN_MEMORY_SIZE,
+        name_index_path=None,
+        near_duplicates=False,
+        page_size=None,
+        search=False,
+        subsets=(),
+        target_summary=False,
+        vacuum=False,
+        without_rowid=False):
+    """Build the output DB from the scratch DB. *scratch_db* may either
+    be a path or an open DB (see build_scratch_db_in_memory()); if it's
+    an open DB, closing it is up to the caller.
+
+    If the scratch DB is no bigger than *max_in_memory_size* bytes,
+    build the output DB in memory, and then copy it to disk in one
+    pass with the backup API. Otherwise, build it directly on disk.
+    (The output DB is generally smaller than the scratch DB.)
+
+    If *without_rowid* is true, the published tables are WITHOUT ROWID
+    tables, clustered on their primary key (see save_output_db()).
+
+    If *search* is true, add a full-text search table (see
+    msd.search), if this build of SQLite supports it.
+
+    If *name_index_path* is set, also write a compact index of company
+    and brand names there (see msd.name_index), if we publish the output
+    DB (or there's no name index yet).
+
+    If *target_summary* is true, add a table summarizing each target's
+    ratings and claims (see msd.target_summary).
+
+    If *near_duplicates* is true, add a report of company and brand
+    names that are suspiciously similar (see msd.near_duplicate).
+
+    If *company_cache_path* is set, reuse company clusters from the
+    previous run that haven't changed, and save this run's clusters
+    there for the next one (see load_company_clusters()).
+
+    If *delta_path* is set and there's already an output DB at
+    *output_db_path*, also write a delta from it to the new output DB
+    there (see msd.delta).
+
+    *subsets* is a list of OutputSpec (see msd.subset) describing
+    filtered copies of the output DB to publish as well. These are
+    filled from the same merge, and published the same way as the
+    output DB (except for *delta_path* and *name_index_path*).
+
+    We write a manifest with a content hash for each table next to the
+    output DB (see msd.manifest). If the contents of every table are
+    the same as in the previous manifest, we don't publish (we leave
+    the existing output DB, manifest, and delta alone).
+
+    Before publishing, we run finalize_output_db() (passing through
+    *vacuum* and *page_size*).
+
+    Returns a dictionary of stats about the build, including
+    *changed_tables* (from the manifest) and whether we *published*.
+    If there are *subsets*, *subsets* is a list of stats for each one.
+    If *near_duplicates* is true, *near_duplicate* is stats about the
+    report (see build_near_duplicate_table()).
+    """
+    log.info('building {}...'.format(output_db_path))
+
+    # if we're given a path, we open (and close) the scratch DB
+    close_scratch_db = isinstance(scratch_db, str)
+    if close_scratch_db:
+        scratch_db = open_db(scratch_db, readonly=True)
+
+    try:
+        in_memory = bool(max_in_memory_size and
+                         get_db_size(scratch_db) <= max_in_memory_size)
+
+        if in_memory:
+            log.info('  (building in memory)')
+
+        output_db = _open_output_db_for_build(
+            output_db_path, in_memory=in_memory, without_rowid=without_rowid)
+
+        with output_db:
+            fill_stats = fill_output_db(
+                output_db, scratch_db,
+                company_cache_path=company_cache_path,
+                near_duplicates=near_duplicates,
+                target_summary=target_summary)
+    finally:
+        if close_scratch_db:
+            scratch_db.close()
+
+    subset_dbs = [
+        _open_output_db_for_build(
+            spec.path, in_memory=in_memory, without_rowid=without_rowid)
+        for spec in subsets]
+
+    if subsets:
+        log.info('filling {:d} subset(s)'.format(len(subsets)))
+        fill_subset_dbs(output_db, list(zip(subsets, subset_dbs)))
+        for subset_db in subset_dbs:
+            subset_db.commit()
+
+    publish_kwargs = dict(
+        in_memory=in_memory,
+        page_size=page_size,
+        search=search,
+        vacuum=vacuum,
+        without_rowid=without_rowid)
+
+    stats = publish_output_db(
+        output_db, output_db_path, delta_path=delta_path, **publish_kwargs)
+    stats.update(fill_stats)
+
+    # keep the name index in sync with the published output DB
+    if name_index_path and (stats['published'] or
+                            not exists(name_index_path)):
+        published_db = open_db(output_db_path, readonly=True)
+        try:
+            write_name_index(published_db, name_index_path)
+        finally:
+            published_db.close()
+
+    if subsets:
+        stats['subsets'] = [
+            publish_output_db(subset_db, spec.path, **publish_kwargs)
+            for spec, subset_db in zip(subsets, subset_dbs)]
+
+    return stats
+
+
+def _get_output_db_tmp_paths(output_db_path, *, without_rowid=False):
+    """Get the path to copy the output DB to before publishing it, and
+    the path to build it at, if not in memory (these are the same
+    unless *without_rowid* is true)."""
     output_db_tmp_path = output_db_path + '.tmp'
 
-    log.info('building {}...'.format(output_db_tmp_path))
+    if without_rowid:
+        return output_db_tmp_path, output_db_path + '.build.tmp'
+    else:
+        return output_db_tmp_path, output_db_tmp_path
+
+
+def _open_output_db_for_build(output_db_path, *, in_memory, without_rowid):
+    """Clear out temp files from previous builds of the output DB at
+    *output_db_path*, and open a new DB to build it in."""
+    tmp_paths = _get_output_db_tmp_paths(
+        output_db_path, without_rowid=without_rowid)
+
+    for path in set(tmp_paths):
+        if exists(path):
+            remove(path)
+
+    if in_memory:
+        return open_db(':memory:')
+    else:
+        return open_db(tmp_paths[1])
+
+
+def publish_output_db(
+        output_db, output_db_path, *,
+        delta_path=None,
+        in_memory=False,
+        page_size=None,
+        search=False,
+        vacuum=False,
+        without_rowid=False):
+    """Copy the (filled) output DB to a temp file if need be, close it,
+    finalize it, and move it to *output_db_path*, unless it's unchanged.
+
+    See build_output_db() for what the keyword arguments do, and what
+    this returns.
+    """
+    output_db_tmp_path, output_db_build_path = _get_output_db_tmp_paths(
+        output_db_path, without_rowid=without_rowid)
+
+    # copy to output_db_tmp_path, unless we built it there
+    if in_memory or without_rowid:
+        log.info('copying to {}'.format(output_db_tmp_path))
+        save_output_db(output_db, output_db_tmp_path,
+                       without_rowid=without_rowid)
+
+    output_db.close()
 
-    if exists(output_db_tmp_path):
+    if not in_memory and output_db_build_path != output_db_tmp_path:
+        remove(output_db_build_path)
+
+    if search:
+        add_search_table(output_db_tmp_path)
+
+    stats = finalize_output_db(
+        output_db_tmp_path, page_size=page_size, vacuum=vacuum)
+
+    manifest_path = get_manifest_path(output_db_path)
+    previous_manifest = None
+    if exists(output_db_path):
+        previous_manifest = read_manifest(manifest_path)
+
+    db = open_db(output_db_tmp_path, readonly=True)
+    try:
+        manifest = get_manifest(db, previous=previous_manifest)
+    finally:
+        db.close()
+
+    stats['changed_tables'] = manifest['changed_tables']
+
+    if is_unchanged(manifest, previous_manifest):
+        log.info('{} is unchanged, not publishing'.format(output_db_path))
         remove(output_db_tmp_path)
+        stats['published'] = False
+        return stats
+
+    log.info('  changed tables: {}'.format(
+        ', '.join(manifest['changed_tables']) or '(none)'))
 
-    with open_db(output_db_tmp_path) as output_db:
-        with open_db(scratch_db_path) as scratch_db:
-            fill_output_db(output_db, scratch_db)
+    if delta_path:
+        if exists(output_db_path):
+            stats['delta'] = write_delta(
+                output_db_path, output_db_tmp_path, delta_path)
+        else:
+            log.info('no previous {}, not writing delta'.format(
+                output_db_path))
+            # don't leave around a delta to some older DB
+            if exists(delta_path):
+                remove(delta_path)
 
     log.info('moving {} -> {}'.format(output_db_tmp_path, output_db_path))
     rename(output_db_tmp_path, output_db_path)
 
+    write_manifest(manifest, manifest_path)
+    stats['published'] = True
+
+    return stats
+
+
+def add_search_table(path):
+    """Add a full-text search table to the output DB at *path* (see
+    msd.search). We do this after copying the output DB, since
+    save_output_db() only knows how to copy tables in TABLES."""
+    db = open_db(path)
+    try:
+        with db:
+            build_search_table(db)
+    finally:
+        db.close()
+
+
+def finalize_output_db(path, *, page_size=None, vacuum=False):
+    """Get the (closed) output DB at *path* ready for publishing.
+
+    This runs ANALYZE, so that consumers' queries get good query plans,
+    optionally VACUUM (with the given *page_size*, if any) to get rid
+    of free pages left over from the build, and then PRAGMA optimize.
+
+    Returns a dictionary with the size of the file in bytes before
+    (*unfinalized_size*) and after (*size*) finalizing.
+    """
+    log.info('finalizing {}'.format(path))
+
+    stats = dict(unfinalized_size=getsize(path))
+
+    db = open_db(path)
+    try:
+        db.execute('ANALYZE')
+
+        if vacuum:
+            if page_size:
+                db.execute('PRAGMA page_size = {:d}'.format(page_size))
+            db.execute('VACUUM')
+
+        db.execute('PRAGMA optimize')
+        db.commit()
+    finally:
+        db.close()
+
+    stats['size'] = getsize(path)
+
+    log.info('  size: {:d} -> {:d} bytes'.format(
+        stats['unfinalized_size'], stats['size']))
+
+    return stats
+
+
+def save_output_db(output_db, path, *, without_rowid=False):
+    """Copy the (filled) output DB to *path*.
+
+    If *without_rowid* is true, re-create each table as a WITHOUT ROWID
+    table, and copy rows into it in primary key order, so that each
+    table is stored once, clustered on its primary key, rather than
+    as a rowid table plus an index on the primary key. Otherwise, just
+    copy the DB with the backup API.
+    """
+    if not without_rowid:
+        save_db(output_db, path)
+        return
+
+    dest_db = open_db(path)
+    try:
+        with dest_db:
+            for table_name in show_tables(output_db):
+                copy_output_table(output_db, dest_db, table_name,
+                                  without_rowid=True)
+    finally:
+        dest_db.close()
+
+
+def output_table_names(*, optional=()):
+    """Names of tables in TABLES that fill_output_db() builds (some,
+    like url, are only used as input).
+
+    Optional tables (like target_summary) are only included if they're
+    in *optional*."""
+    return [table_name for table_name, table_def in sorted(TABLES.items())
+            if table_def.get('output', True) and
+            (not table_def.get('optional') or table_name in optional)]
+
+
+def fill_output_db(output_db, scratch_db, *,
+                   company_cache_path=None, near_duplicates=False,
+                   target_summary=False):
+    """Fill the output DB from the scratch DB. Returns a dictionary
+    of stats about optional reports (see build_output_db())."""
+    stats = {}
 
-def fill_output_db(output_db, scratch_db):
     # tables with no dependencies
     build_campaign_table(output_db, scratch_db)
     build_scraper_table(output_db, scratch_db)
@@ -64,7 +397,16 @@ def fill_output_db(output_db, scratch_db):
     build_subcategory_table(output_db, scratch_db)
 
     # companies
-    build_company_name_and_scraper_company_map_tables(output_db, scratch_db)
+    company_clusters = None
+    if company_cache_path:
+        company_clusters = load_company_clusters(company_cache_path)
+
+    company_clusters = build_company_name_and_scraper_company_map_tables(
+        output_db, scratch_db, company_clusters=company_clusters)
+
+    if company_cache_path:
+        save_company_clusters(company_cache_path, company_clusters)
+
     build_company_table(output_db, scratch_db)
 
     # TODO: subsidiaries would be handled here
@@ -75,5 +417,19 @@ def fill_output_db(output_db, scratch_db):
 
     # things that key on company, brand
     build_category_table(output_db, scratch_db)
-    build_claim_table(output_db, scratch_db)
-    build_rating_table(output_db, scratch_db)
+    # claim and rating share a single pass over targets
+    build_target_tables(output_db, scratch_db, dict(
+        claim=(CLAIM_KEY_COLS, merge_claim_group),
+        rating=(RATING_KEY_COLS, merge_rating_group),
+    ))
+    normalize_rating_scores(output_db)
+
+    if target_summary:
+        build_target_summary_table(output_db, scratch_db)
+
+    # reports
+    if near_duplicates:
+        stats['near_duplicate'] = build_near_duplicate_table(
+            output_db, scratch_db)
+
+    return stats
@@ -0,0 +1,167 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Look up ratings and claims in a finished output DB (msd.sqlite),
+given a company or brand name seen in the wild.
+
+Names are matched the same way the merge matches them: companies by
+their keys (see get_company_alias_keys()), and brands by get_brand_key().
+"""
+from collections import defaultdict
+from collections import namedtuple
+from functools import lru_cache
+from logging import getLogger
+
+from .db import open_db
+from .key import get_brand_key
+from .key import get_company_alias_keys
+
+log = getLogger(__name__)
+
+# number of lookups to cache, by default
+DEFAULT_CACHE_SIZE = 4096
+
+# everything we know about a target. *categories* is a tuple of
+# strings; *ratings* and *claims* are tuples of dicts, and include
+# company-wide rows (with brand '') when *brand* is set
+TargetInfo = namedtuple(
+    'TargetInfo', ['company', 'brand', 'categories', 'ratings', 'claims'])
+
+# these only use constant SQL, so sqlite3 prepares each once and
+# re-uses it (see the (company, brand) output_indexes in msd.table)
+CATEGORY_SQL = (
+    'SELECT `category` FROM `category` WHERE `company` = ? AND `brand` = ?'
+    ' ORDER BY `category`')
+
+RATING_SQL = (
+    'SELECT * FROM `rating` WHERE `company` = ? AND `brand` IN (?, \'\')'
+    ' ORDER BY `brand` DESC, `campaign_id`, `scope`')
+
+CLAIM_SQL = (
+    'SELECT * FROM `claim` WHERE `company` = ? AND `brand` IN (?, \'\')'
+    ' ORDER BY `brand` DESC, `campaign_id`, `scope`, `claim`')
+
+
+class Query:
+    """Look up targets in an output DB.
+
+    *db* can be a path (which we open read-only) or an open DB.
+    *cache_size* is the number of lookups to cache (0 to disable).
+
+    We read the names of every company and brand up front, so create
+    one of these per process and keep it around.
+    """
+    def __init__(self, db, *, cache_size=DEFAULT_CACHE_SIZE):
+        if isinstance(db, str):
+            db = open_db(db, readonly=True)
+        self.db = db
+
+        self._company_by_key = {}
+        for company, company_name in db.execute(
+                'SELECT `company`, `company_name` FROM `company_name`'
+                ' ORDER BY `company`, `company_name`'):
+            for key in get_company_alias_keys(company_name):
+                self._company_by_key.setdefault(key, company)
+
+        self._targets_by_brand_key = defaultdict(list)
+        for company, brand in db.execute(
+                'SELECT `company`, `brand` FROM `brand`'
+                ' ORDER BY `company`, `brand`'):
+            brand_key = get_brand_key(brand)
+            if brand_key:
+                self._targets_by_brand_key[brand_key].append(
+                    (company, brand))
+
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+        self.lookup_target = lru_cache(maxsize=cache_size)(
+            self._lookup_target)
+
+    def resolve_company(self, name):
+        """Get the canonical name of the company called *name*, or None
+        if we don't know it."""
+        if not name:
+            return None
+
+        companies = {self._company_by_key[key]
+                     for key in get_company_alias_keys(name)
+                     if key in self._company_by_key}
+
+        if companies:
+            return min(companies)
+        else:
+            return None
+
+    def resolve_targets(self, name, *, company=None):
+        """Get a list of (company, brand) for the brand or company
+        called *name*.
+
+        If *company* is set, only look for brands belonging to that
+        company (and fall back to the company itself).
+        """
+        if company is not None:
+            company = self.resolve_company(company)
+            if company is None:
+                return []
+
+            targets = [t for t in self._resolve_brand(name)
+                       if t[0] == company]
+            return targets or [(company, '')]
+
+        targets = self._resolve_brand(name)
+
+        company = self.resolve_company(name)
+        if company is not None and (company, '') not in targets:
+            targets.append((company, ''))
+
+        return targets
+
+    def _resolve_brand(self, name):
+        brand_key = get_brand_key(name)
+        if not brand_key:
+            return []
+
+        return list(self._targets_by_brand_key.get(brand_key, ()))
+
+    def _lookup(self, name, company=None):
+        """Get a tuple of TargetInfo for the brand or company called
+        *name* (see resolve_targets()).
+
+        This is wrapped in an LRU cache as lookup(); don't modify
+        its results."""
+        return tuple(self.lookup_target(*target)
+                     for target in self.resolve_targets(
+                         name, company=company))
+
+    def _lookup_target(self, company, brand=''):
+        """Get a TargetInfo for the given (canonical) company and brand.
+
+        This is wrapped in an LRU cache as lookup_target(); don't modify
+        its results."""
+        categories = tuple(
+            row[0] for row in self.db.execute(
+                CATEGORY_SQL, [company, brand]))
+        ratings = tuple(
+            dict(row) for row in self.db.execute(
+                RATING_SQL, [company, brand]))
+        claims = tuple(
+            dict(row) for row in self.db.execute(
+                CLAIM_SQL, [company, brand]))
+
+        return TargetInfo(company, brand, categories, ratings, claims)
+
+    def clear_cache(self):
+        self.lookup.cache_clear()
+        self.lookup_target.cache_clear()
+
+    def close(self):
+        self.db.close()
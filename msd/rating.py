@@ -15,50 +15,112 @@ from logging import getLogger
 
 
 from .merge import create_output_table
-from .merge import merge_dicts
+from .merge import merge_rows
 from .merge import output_row
 from .target import select_groups_by_target
 
 log = getLogger(__name__)
 
 
+# columns to group ratings by, within each target
+RATING_KEY_COLS = ['campaign_id']
+
+# Put each rating on a 0..1 scale (1 is best), from its min_score
+# (merge_rating_group() makes this 0 if a rating has a score but no
+# min_score) to its max_score, or the highest score in its campaign
+# if it has none. Ratings without a score fall back to rank (1 is
+# best) out of num_ranked (or the highest rank in the campaign).
+#
+# percentile is the fraction of the campaign's other normalized
+# ratings that scored lower (see PERCENT_RANK()). Ratings we can't
+# normalize are left NULL.
+NORMALIZED_RATING_SQL = """
+WITH `normalized` AS (
+    SELECT `rowid` AS `id`, `campaign_id`,
+        MAX(0.0, MIN(1.0, CASE
+        WHEN `score` IS NOT NULL THEN
+            (`score` - `min_score`) * 1.0 /
+            NULLIF(IFNULL(`max_score`, MAX(`score`) OVER `c`) -
+                   `min_score`, 0)
+        WHEN `rank` IS NOT NULL THEN
+            (IFNULL(`num_ranked`, MAX(`rank`) OVER `c`) - `rank`) * 1.0 /
+            NULLIF(IFNULL(`num_ranked`, MAX(`rank`) OVER `c`) - 1, 0)
+        END)) AS `normalized_score`
+    FROM `rating`
+    WINDOW `c` AS (PARTITION BY `campaign_id`)
+)
+SELECT `normalized_score`,
+    PERCENT_RANK() OVER (
+        PARTITION BY `campaign_id` ORDER BY `normalized_score`),
+    `id`
+FROM `normalized`
+WHERE `normalized_score` IS NOT NULL
+"""
+
+
 def build_rating_table(output_db, scratch_db):
     log.info('  building rating table')
     create_output_table(output_db, 'rating')
 
-    def keyfunc(row):
-        return row['campaign_id']
-
     # slice by target
-    for (company, brand), campaign_id, rating_rows in \
-        select_groups_by_target(
-            output_db, scratch_db, 'rating', ['campaign_id']):
+    for target, key, rating_rows in select_groups_by_target(
+            output_db, scratch_db, 'rating', RATING_KEY_COLS):
+
+        rating_row = merge_rating_group(target, key, rating_rows)
+        if rating_row is not None:
+            output_row(output_db, 'rating', rating_row)
+
+    normalize_rating_scores(output_db)
+
 
-        if not (campaign_id):
-            continue
+def normalize_rating_scores(output_db):
+    """Fill normalized_score and percentile for every rating in the
+    (built) rating table, so that ratings can be compared across
+    campaigns.
 
-        rating_row = merge_dicts(rating_rows)
+    This computes every campaign at once with window functions (see
+    NORMALIZED_RATING_SQL), rather than row by row.
+    """
+    log.info('  normalizing rating scores')
 
-        rating_row['company'] = company
-        rating_row['brand'] = brand
-        if rating_row['grade']:
-            rating_row['grade'] = str(rating_row['grade']).upper()
+    rows = output_db.execute(NORMALIZED_RATING_SQL).fetchall()
 
-        rating_row['judgment'] = fix_judgment(rating_row['judgment'])
+    output_db.executemany(
+        'UPDATE `rating` SET `normalized_score` = ?, `percentile` = ?'
+        ' WHERE `rowid` = ?', rows)
 
-        if rating_row['judgment'] is None and rating_row['grade']:
-            rating_row['judgment'] = grade_to_judgment(rating_row['grade'])
 
-        if rating_row['judgment'] is None:
-            continue
+def merge_rating_group(target, key, rating_rows):
+    """Merge a group of rating rows from select_groups_by_target() into
+    a row for the rating table, or return None if we can't use it."""
+    company, brand = target
+    (campaign_id,) = key
+
+    if not campaign_id:
+        return None
+
+    rating_row = merge_rows(rating_rows, 'rating')
+
+    rating_row['company'] = company
+    rating_row['brand'] = brand
+    if rating_row['grade']:
+        rating_row['grade'] = str(rating_row['grade']).upper()
+
+    rating_row['judgment'] = fix_judgment(rating_row['judgment'])
+
+    if rating_row['judgment'] is None and rating_row['grade']:
+        rating_row['judgment'] = grade_to_judgment(rating_row['grade'])
+
+    if rating_row['judgment'] is None:
+        return None
 
-        # fill min_score
-        if (rating_row.get('score') is not None and
-            rating_row.get('min_score') is None):
+    # fill min_score
+    if (rating_row.get('score') is not None and
+        rating_row.get('min_score') is None):
 
-            rating_row['min_score'] = 0
+        rating_row['min_score'] = 0
 
-        output_row(output_db, 'rating', rating_row)
+    return rating_row
 
 
 def fix_judgment(judgment):
@@ -0,0 +1,135 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Turn table definitions in TABLES into specialized functions
+for cleaning, encoding and merging rows, so that hot loops don't have
+to re-interpret the table definition for every row."""
+from collections import namedtuple
+
+from .db import col_sql
+from .table import TABLES
+
+# a compiled table definition:
+#
+# table_def: the entry in TABLES we compiled from
+# cols: the table's columns, in sorted order
+# scratch_cols: the table's columns in the scratch DB (which always
+#   include scraper_id, and never *output_only_columns*), in sorted order
+# insert_sql: prepared INSERT statement taking values for *cols*
+# clean: function that cleans a row for output (see clean_output_row())
+# encode: function that turns a row into a tuple of values for
+#   *insert_sql*, or None if the row has columns not in *cols*
+# merge: function that merges a sequence of rows with scalar values
+#   (see merge_dicts())
+TableSchema = namedtuple(
+    'TableSchema',
+    ['table_def', 'cols', 'scratch_cols', 'insert_sql', 'clean', 'encode',
+     'merge'])
+
+_table_schemas = {}
+
+
+def get_table_schema(table_name):
+    """Get the compiled schema for the given table, compiling it if
+    we haven't already (or if its entry in TABLES has been replaced)."""
+    table_def = TABLES[table_name]
+
+    schema = _table_schemas.get(table_name)
+    if schema is None or schema.table_def is not table_def:
+        schema = compile_table_schema(table_name, table_def)
+        _table_schemas[table_name] = schema
+
+    return schema
+
+
+def compile_table_schema(table_name, table_def):
+    """Compile *table_def* (an entry in TABLES) into a TableSchema."""
+    columns = table_def['columns']
+    cols = sorted(columns)
+
+    insert_sql = 'INSERT INTO `{}` ({}) VALUES ({})'.format(
+        table_name, col_sql(cols), ', '.join('?' for _ in cols))
+
+    return TableSchema(
+        table_def=table_def,
+        cols=cols,
+        scratch_cols=sorted(
+            (set(cols) - set(table_def.get('output_only_columns', ()))) |
+            {'scraper_id'}),
+        insert_sql=insert_sql,
+        clean=_compile_clean(table_def),
+        encode=_compile_encode(cols),
+        merge=merge_scalar_rows,
+    )
+
+
+def _compile_clean(table_def):
+    columns = table_def['columns']
+
+    drop_scraper_id = 'scraper_id' not in columns
+    # primary key columns, and what to replace null with
+    pk_defaults = [(k, '' if columns[k] == 'text' else 0)
+                   for k in table_def.get('primary_key', ())]
+    is_cols = [k for k in sorted(columns) if k.startswith('is_')]
+
+    def clean(row):
+        row = row.copy()
+
+        # delete extra scraper_id column
+        if drop_scraper_id:
+            row.pop('scraper_id', None)
+
+        # make sure primary key cols exists and are non-null
+        for k, default in pk_defaults:
+            if row.get(k) is None:
+                row[k] = default
+
+        # make sure is_* fields exist and are either 0 or 1
+        for k in is_cols:
+            row[k] = int(bool(row.get(k)))
+
+        return row
+
+    return clean
+
+
+def _compile_encode(cols):
+    col_set = frozenset(cols)
+
+    def encode(row):
+        if not col_set.issuperset(row):
+            return None
+
+        return tuple(row.get(c) for c in cols)
+
+    return encode
+
+
+def merge_scalar_rows(rows):
+    """Like merge_dicts(), but assumes every value is a scalar (a string,
+    number, or None), as in rows selected from a DB, so there's nothing
+    to copy or update."""
+    result = {}
+
+    for row in rows:
+        for k, v in row.items():
+            if k not in result:
+                result[k] = v
+            else:
+                merged = result[k]
+                if merged is None:
+                    result[k] = v
+                elif merged == '' and v != '':
+                    result[k] = v
+
+    return result
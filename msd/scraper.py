@@ -15,10 +15,9 @@
 ../scraper.py, which is a hook for morph.io."""
 from logging import getLogger
 
-from .db import select_groups
 from .merge import create_output_table
-from .merge import merge_dicts
 from .merge import output_row
+from .merge import select_merged_rows
 
 log = getLogger(__name__)
 
@@ -27,11 +26,11 @@ def build_scraper_table(output_db, scratch_db):
     log.info('  building scraper table')
     create_output_table(output_db, 'scraper')
 
-    for (scraper_id,), rows in select_groups(
+    # merge in SQL; there's nothing else to do to these rows
+    for scraper_row in select_merged_rows(
             scratch_db, 'scraper', ['scraper_id']):
 
-        if not scraper_id:
+        if not scraper_row['scraper_id']:
             continue
 
-        scraper_row = merge_dicts(rows)
         output_row(output_db, 'scraper', scraper_row)
@@ -12,20 +12,52 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Building the scratch (intermediate) database."""
+from collections import defaultdict
 from logging import getLogger
 from os import remove
 from os import rename
 from os.path import exists
 from os.path import getmtime
 
+from .db import col_sql
 from .db import create_index
 from .db import create_table
-from .db import insert_row
 from .db import open_db
+from .db import save_db
+from .db import show_columns
 from .db import show_tables
+from .key import company_expansion_version
+from .key import expand_companies
+from .key import expand_company
+from .key import get_brand_key
 from .norm import clean_string
 from .table import TABLES
 
+# bump this whenever the layout of the scratch DB changes, so that
+# build_scratch_db() knows to rebuild scratch DBs from older versions
+SCRATCH_SCHEMA_VERSION = 4
+
+# number of rows to read from input DBs at a time
+DUMP_CHUNK_SIZE = 1024
+
+# columns whose values are stored as integer IDs in the scratch DB
+INTERNED_COLS = {'brand', 'company', 'company_full', 'scraper_id'}
+
+# columns whose distinct values we catalog at insert time, and what
+# kind of entity they name (see select_catalog())
+CATALOG_COLS = {
+    'category': 'category',
+    'company': 'company',
+    'company_full': 'company',
+    'subcategory': 'category',
+}
+
+# tables of keys for matching, and the (interned) column they map from
+KEY_TABLES = [
+    ('brand_key', 'brand'),
+    ('company_key', 'company'),
+]
+
 log = getLogger(__name__)
 
 
@@ -35,7 +67,9 @@ def build_scratch_db(
     a single, indexed database with correct table definitions.
 
     Does nothing if the scratch DB is newer than all the input
-    DBs, unless *force* is true.
+    DBs, unless *force* is true. If only the code or data we use to
+    compute company and brand keys has changed, we just recompute
+    the keys (see fill_key_tables()).
 
     Unlike the output database, every table in the scratch database
     has a scraper_id field. The names of each input database are used
@@ -50,8 +84,21 @@ def build_scratch_db(
     # TODO: might also want to apply custom corrections here
     if exists(scratch_db_path) and not force:
         mtime = getmtime(scratch_db_path)
-        if all(exists(db_path) and getmtime(db_path) < mtime
-               for db_path in input_db_paths):
+        if (all(exists(db_path) and getmtime(db_path) < mtime
+                for db_path in input_db_paths) and
+                get_scratch_schema_version(scratch_db_path) ==
+                SCRATCH_SCHEMA_VERSION):
+            if (get_scratch_key_version(scratch_db_path) !=
+                    company_expansion_version()):
+                log.info('recomputing out-of-date keys in {}'.format(
+                    scratch_db_path))
+                scratch_db = open_db(scratch_db_path)
+                try:
+                    with scratch_db:
+                        fill_key_tables(scratch_db)
+                finally:
+                    scratch_db.close()
+
             log.info('{} already exists and is up-to-date'.format(
                 scratch_db_path))
             return
@@ -63,45 +110,224 @@ def build_scratch_db(
     log.info('building {}...'.format(scratch_db_tmp_path))
 
     with open_db(scratch_db_tmp_path) as scratch_db:
+        fill_scratch_db(scratch_db, input_db_paths)
 
-        create_scratch_tables(scratch_db)
+    log.info('moving {} -> {}'.format(scratch_db_tmp_path, scratch_db_path))
+    rename(scratch_db_tmp_path, scratch_db_path)
 
-        for input_db_path in input_db_paths:
-            log.info('dumping data from {} -> {}'.format(
-                input_db_path, scratch_db_tmp_path))
 
-            scraper_prefix = db_path_to_scraper_prefix(input_db_path)
-            with open_db(input_db_path) as input_db:
+def build_scratch_db_in_memory(input_db_paths, *, save_path=None):
+    """Like build_scratch_db(), but build the scratch DB in memory,
+    and return it (still open). Useful for small builds, where writing
+    the scratch DB to disk and reading it back is just overhead.
 
-                dump_db_to_scratch(input_db, scratch_db, scraper_prefix)
+    If *save_path* is set, also save a copy of the scratch DB
+    there (handy for debugging).
+    """
+    log.info('building scratch DB in memory...')
 
-    log.info('moving {} -> {}'.format(scratch_db_tmp_path, scratch_db_path))
-    rename(scratch_db_tmp_path, scratch_db_path)
+    scratch_db = open_db(':memory:')
+    with scratch_db:
+        fill_scratch_db(scratch_db, input_db_paths)
+
+    if save_path:
+        save_path_tmp = save_path + '.tmp'
+        if exists(save_path_tmp):
+            remove(save_path_tmp)
+
+        log.info('saving scratch DB to {}'.format(save_path_tmp))
+        save_db(scratch_db, save_path_tmp)
+
+        log.info('moving {} -> {}'.format(save_path_tmp, save_path))
+        rename(save_path_tmp, save_path)
+
+    return scratch_db
+
+
+def fill_scratch_db(scratch_db, input_db_paths):
+    """Create scratch tables in the given (open) DB, and fill them
+    with data from the various input databases."""
+    create_scratch_tables(scratch_db)
+
+    for input_db_path in input_db_paths:
+        log.info('dumping data from {}'.format(input_db_path))
+
+        scraper_prefix = db_path_to_scraper_prefix(input_db_path)
+        with open_db(input_db_path, readonly=True) as input_db:
+
+            dump_db_to_scratch(input_db, scratch_db, scraper_prefix)
+
+    fill_key_tables(scratch_db)
+
+    scratch_db.execute(
+        'PRAGMA user_version = {:d}'.format(SCRATCH_SCHEMA_VERSION))
+
+
+def get_scratch_schema_version(scratch_db_path):
+    """Get the SCRATCH_SCHEMA_VERSION the scratch DB at the given path
+    was built with (0 if it predates schema versions)."""
+    scratch_db = open_db(scratch_db_path, readonly=True)
+    try:
+        return scratch_db.execute('PRAGMA user_version').fetchone()[0]
+    finally:
+        scratch_db.close()
+
+
+def get_scratch_key_version(scratch_db_path):
+    """Get the company_expansion_version() that the keys in the scratch DB
+    at the given path were computed with (None if unknown)."""
+    scratch_db = open_db(scratch_db_path, readonly=True)
+    try:
+        row = scratch_db.execute(
+            "SELECT value FROM meta WHERE key = 'key_version'").fetchone()
+        return row[0] if row else None
+    finally:
+        scratch_db.close()
 
 
 def create_scratch_tables(scratch_db):
     """Add tables to the given (open) SQLite DB."""
-    for table_name in sorted(TABLES):
+    for table_name in scratch_table_names():
         create_scratch_table(scratch_db, table_name)
 
 
+def scratch_table_names():
+    """Names of tables in TABLES that go in the scratch DB (some,
+    like reports, are only in the output DB)."""
+    return [table_name for table_name, table_def in sorted(TABLES.items())
+            if table_def.get('scratch', True)]
+
+
 def create_scratch_table(scratch_db, table_name):
+    """Create a scratch table.
+
+    To keep the scratch DB small and indexed lookups fast, values of
+    *INTERNED_COLS* are stored as integer IDs in the ``_<table_name>``
+    "fact" table (which is what gets indexed). *table_name* itself is a
+    view that joins IDs back to strings, and that you can insert into.
+    """
     table_def = TABLES[table_name]
 
-    columns = table_def['columns'].copy()
-    columns['scraper_id'] = 'text'
+    columns = get_scratch_columns(table_name)
+
+    create_lookup_tables(scratch_db)
+
+    interned_cols = sorted(c for c in columns if c in INTERNED_COLS)
+    fact_table_name = '_' + table_name
 
-    create_table(scratch_db, table_name, columns)
+    fact_columns = columns.copy()
+    for col in interned_cols:
+        fact_columns[col] = 'integer'
+
+    create_table(scratch_db, fact_table_name, fact_columns)
 
     # add "primary key" (non-unique) index
     index_cols = list(table_def.get('primary_key', ()))
     if 'scraper_id' not in index_cols:
         index_cols = ['scraper_id'] + index_cols
-    create_index(scratch_db, table_name, index_cols)
+    create_index(scratch_db, fact_table_name, index_cols)
+
+    # add other indexes, including ones only the scratch DB needs
+    # (e.g. for select_groups_by_target())
+    for index_cols in (table_def.get('indexes', []) +
+                       table_def.get('scratch_indexes', [])):
+        create_index(scratch_db, fact_table_name, index_cols)
+
+    # view that looks like the original table
+    cols = sorted(columns)
+
+    view_sql = 'CREATE VIEW `{}` AS SELECT {} FROM `{}` AS f{}'.format(
+        table_name,
+        ', '.join('`_{0}`.value AS `{0}`'.format(c) if c in interned_cols
+                  else 'f.`{0}` AS `{0}`'.format(c) for c in cols),
+        fact_table_name,
+        ''.join(' JOIN interned_string AS `_{0}` ON `_{0}`.id = f.`{0}`'
+                .format(c) for c in interned_cols))
+
+    scratch_db.execute(view_sql)
+
+    # intern strings when inserting into the view. NULL is interned as 0
+    #
+    # also add (scraper_id, kind, value) to the catalog, for
+    # columns in CATALOG_COLS
+    catalog_sql = ''.join(
+        ' INSERT OR IGNORE INTO catalog (scraper_id, kind, value)'
+        ' SELECT COALESCE((SELECT id FROM interned_string'
+        ' WHERE value = NEW.scraper_id), 0), \'{0}\', NEW.`{1}`'
+        ' WHERE NEW.`{1}` IS NOT NULL;'.format(CATALOG_COLS[c], c)
+        for c in cols if c in CATALOG_COLS)
+
+    trigger_sql = (
+        'CREATE TRIGGER `{0}_insert` INSTEAD OF INSERT ON `{0}` BEGIN'
+        ' INSERT OR IGNORE INTO interned_string (value) {1};'
+        ' INSERT INTO `{2}` ({3}) VALUES ({4});{5}'
+        ' END').format(
+            table_name,
+            ' UNION ALL '.join(
+                'SELECT NEW.`{0}` WHERE NEW.`{0}` IS NOT NULL'.format(c)
+                for c in interned_cols),
+            fact_table_name,
+            col_sql(cols),
+            ', '.join(
+                'COALESCE((SELECT id FROM interned_string'
+                ' WHERE value = NEW.`{0}`), 0)'.format(c)
+                if c in interned_cols else 'NEW.`{}`'.format(c)
+                for c in cols),
+            catalog_sql)
+
+    scratch_db.execute(trigger_sql)
+
+
+def get_scratch_columns(table_name):
+    """Map column name to type for the given table in the scratch DB.
+    This is the table's columns, minus *output_only_columns*, plus
+    scraper_id."""
+    table_def = TABLES[table_name]
+
+    columns = {col: col_type for col, col_type in table_def['columns'].items()
+               if col not in table_def.get('output_only_columns', ())}
+    columns['scraper_id'] = 'text'
 
-    # add other indexes
-    for index_cols in table_def.get('indexes', ()):
-        create_index(scratch_db, table_name, index_cols)
+    return columns
+
+
+def create_lookup_tables(scratch_db):
+    """Create tables that don't correspond to anything in TABLES,
+    if they don't already exist:
+
+    interned_string: maps interned strings to integer IDs. ID 0 is
+    reserved for NULL.
+    company_key: maps company (and company_full) IDs to keys for
+    matching companies (see fill_key_tables()).
+    brand_key: maps brand IDs to keys for matching brands.
+    catalog: distinct (scraper_id, kind, value) for columns in
+    CATALOG_COLS; scraper_id is an interned string ID.
+    meta: key/value pairs about the scratch DB itself (e.g. key_version,
+    see fill_key_tables()).
+    """
+    scratch_db.execute(
+        'CREATE TABLE IF NOT EXISTS interned_string'
+        ' (id INTEGER PRIMARY KEY, value TEXT UNIQUE)')
+    scratch_db.execute(
+        'INSERT OR IGNORE INTO interned_string (id, value) VALUES (0, NULL)')
+
+    scratch_db.execute(
+        'CREATE TABLE IF NOT EXISTS catalog'
+        ' (scraper_id INTEGER, kind TEXT, value TEXT,'
+        ' PRIMARY KEY (kind, scraper_id, value)) WITHOUT ROWID')
+
+    scratch_db.execute(
+        'CREATE TABLE IF NOT EXISTS meta'
+        ' (key TEXT PRIMARY KEY, value TEXT)')
+
+    for table_name, col in KEY_TABLES:
+        scratch_db.execute(
+            'CREATE TABLE IF NOT EXISTS `{0}` (`{1}` INTEGER, `key` TEXT,'
+            ' PRIMARY KEY (`{1}`, `key`)) WITHOUT ROWID'.format(
+                table_name, col))
+        scratch_db.execute(
+            'CREATE INDEX IF NOT EXISTS `{0}_key` ON `{0}` (`key`)'.format(
+                table_name))
 
 
 def db_path_to_scraper_prefix(path):
@@ -113,13 +339,14 @@ def db_path_to_scraper_prefix(path):
 
 def dump_db_to_scratch(input_db, scratch_db, scraper_prefix=''):
     input_table_names = set(show_tables(input_db))
+    table_names = scratch_table_names()
 
-    extra_table_names = input_table_names - set(TABLES)
+    extra_table_names = input_table_names - set(table_names)
     if extra_table_names:
         log.info('  ignoring extra tables: {}'.format(
             ', '.join(extra_table_names)))
 
-    for table_name in sorted(TABLES):
+    for table_name in table_names:
         if table_name in input_table_names:
             dump_table_to_scratch(
                 input_db, table_name, scratch_db, scraper_prefix)
@@ -128,70 +355,155 @@ def dump_db_to_scratch(input_db, scratch_db, scraper_prefix=''):
 def dump_table_to_scratch(input_db, table_name, scratch_db, scraper_prefix):
     log.info('  dumping table: {}'.format(table_name))
 
-    table_def = TABLES[table_name]
+    # deal with extra columns (check the schema, not the data)
+    input_cols = show_columns(input_db, table_name)
+    expected_cols = set(get_scratch_columns(table_name))
+    extra_cols = sorted(set(input_cols) - expected_cols)
+    if extra_cols:
+        log.info('  ignoring extra columns in {}: {}'.format(
+            table_name, ', '.join(extra_cols)))
+
+    # only select columns we actually use
+    cols = sorted(set(input_cols) & expected_cols)
+    if not cols:
+        return
+
+    select_sql = 'SELECT {} FROM `{}`'.format(col_sql(cols), table_name)
+
+    # always insert scraper_id, even if the input doesn't have it
+    if 'scraper_id' in cols:
+        scraper_id_idx = cols.index('scraper_id')
+        insert_cols = cols
+    else:
+        scraper_id_idx = len(cols)
+        insert_cols = cols + ['scraper_id']
+
+    insert_sql = 'INSERT INTO `{}` ({}) VALUES ({})'.format(
+        table_name, col_sql(insert_cols),
+        ', '.join('?' for _ in insert_cols))
+
+    # read plain tuples rather than sqlite3.Rows
+    cursor = input_db.cursor()
+    cursor.row_factory = None
+    cursor.execute(select_sql)
+
+    while True:
+        rows = cursor.fetchmany(DUMP_CHUNK_SIZE)
+        if not rows:
+            break
+
+        scratch_db.executemany(
+            insert_sql,
+            (clean_input_values(row, scraper_prefix, scraper_id_idx)
+             for row in rows))
+
+
+def clean_input_values(values, scraper_prefix, scraper_id_idx):
+    """Clean a tuple of input values, and namespace (or add) the
+    scraper_id value at *scraper_id_idx*."""
+    cleaned = [clean_string(v) if isinstance(v, str) else v for v in values]
+
+    # pick scraper_id
+    if scraper_id_idx == len(cleaned):
+        cleaned.append(None)
+
+    if cleaned[scraper_id_idx] is None:
+        cleaned[scraper_id_idx] = scraper_prefix
+    else:
+        cleaned[scraper_id_idx] = '{}.{}'.format(
+            scraper_prefix, cleaned[scraper_id_idx])
+
+    return cleaned
 
-    select_sql = 'SELECT * from `{}`'.format(table_name)
-    for i, row in enumerate(input_db.execute(select_sql)):
-        row = dict(row)
 
-        # deal with extra columns
-        if i == 0:  # only need to check once
-            expected_cols = set(table_def['columns']) | {'scraper_id'}
-            extra_cols = sorted(set(row) - expected_cols)
-            if extra_cols:
-                log.info('  ignoring extra columns in {}: {}'.format(
-                    table_name, ', '.join(extra_cols)))
+def fill_key_tables(scratch_db):
+    """Compute keys for matching companies and brands once, for each
+    distinct company and brand in the scratch DB, and store them in the
+    company_key and brand_key tables, replacing any keys already there.
 
-        # clean ugly data, dump extra columns
-        row = clean_input_row(row, table_name)
+    Also record the company_expansion_version() the keys were computed
+    with, so build_scratch_db() can tell when they're out-of-date.
+    """
+    log.info('computing company and brand keys')
 
-        # pick scraper_id
-        if 'scraper_id' in row:
-            row['scraper_id'] = scraper_prefix + '.' + row['scraper_id']
-        else:
-            row['scraper_id'] = scraper_prefix
+    for table_name, _ in KEY_TABLES:
+        scratch_db.execute('DELETE FROM `{}`'.format(table_name))
 
-        # insert!
-        insert_row(scratch_db, table_name, row)
+    companies = list(select_interned_strings(
+        scratch_db, ['company', 'company_full']))
 
+    # this is the slow part, so do it in parallel
+    expand_companies(company for _, company in companies)
 
-def scratch_tables_with_cols(cols):
-    cols = set(cols)
-    return [table_name for table_name, table_def in sorted(TABLES.items())
-            if not (cols - set(table_def['columns']) - {'scraper_id'})]
+    insert_sql = 'INSERT OR IGNORE INTO company_key VALUES (?, ?)'
+    for string_id, company in companies:
+        scratch_db.executemany(
+            insert_sql, ((string_id, key) for key in
+                         sorted(expand_company(company).keys)))
 
+    insert_sql = 'INSERT OR IGNORE INTO brand_key VALUES (?, ?)'
+    for string_id, brand in select_interned_strings(scratch_db, ['brand']):
+        key = get_brand_key(brand)
+        if key:
+            scratch_db.execute(insert_sql, [string_id, key])
 
-def get_distinct_values(scratch_db, cols):
-    """Get all distinct values of the given list of columns from
-    any table that has all of the given columns."""
-    values = set()
+    scratch_db.execute(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES ('key_version', ?)",
+        [company_expansion_version()])
 
-    for table_name in scratch_tables_with_cols(cols):
-        cols_sql = ', '.join('`{}`'.format(col) for col in cols)
 
-        select_sql = 'SELECT {} FROM `{}` GROUP BY {}'.format(
-            cols_sql, table_name, cols_sql)
-        for row in scratch_db.execute(select_sql):
-            values.add(tuple(row))
+def select_interned_strings(scratch_db, cols):
+    """Yield (id, value) for each distinct non-null value of any of the
+    given (interned) columns."""
+    select_sqls = [
+        'SELECT `{}` FROM `_{}`'.format(col, table_name)
+        for col in cols
+        for table_name in scratch_tables_with_cols([col])]
 
-    return values
+    if not select_sqls:
+        return
 
+    sql = ('SELECT id, value FROM interned_string WHERE id > 0'
+           ' AND id IN ({})'.format(' UNION '.join(select_sqls)))
 
-def clean_input_row(row, table_name):
-    """Clean each value in the given row of input data, and remove
-    extra columns."""
-    table_def = TABLES.get(table_name, {})
-    valid_cols = set(table_def.get('columns', ())) | {'scraper_id'}
+    for string_id, value in scratch_db.execute(sql):
+        yield string_id, value
 
-    cleaned = {}
 
-    for col_name, value in sorted(row.items()):
-        if col_name not in valid_cols:
-            continue
+def select_company_keys(scratch_db):
+    """Map company (or company_full) to the set of keys stored by
+    fill_key_tables()."""
+    sql = ('SELECT value, `key` FROM company_key'
+           ' JOIN interned_string ON id = company')
 
-        if isinstance(value, str):
-            value = clean_string(value)
+    company_to_keys = defaultdict(set)
+    for company, key in scratch_db.execute(sql):
+        company_to_keys[company].add(key)
 
-        cleaned[col_name] = value
+    return dict(company_to_keys)
+
+
+def select_brand_keys(scratch_db):
+    """Map brand to the key stored by fill_key_tables()."""
+    sql = ('SELECT value, `key` FROM brand_key'
+           ' JOIN interned_string ON id = brand')
+
+    return dict(tuple(row) for row in scratch_db.execute(sql))
+
+
+def scratch_tables_with_cols(cols):
+    cols = set(cols)
+    return [table_name for table_name in scratch_table_names()
+            if not (cols - set(get_scratch_columns(table_name)))]
+
+
+def select_catalog(scratch_db, kind):
+    """Get all distinct (scraper_id, value) for the given kind of
+    entity ('category' or 'company'), from any of the columns
+    in CATALOG_COLS. Doesn't include null values."""
+    select_sql = ('SELECT s.value, c.value FROM catalog AS c'
+                  ' JOIN interned_string AS s ON s.id = c.scraper_id'
+                  ' WHERE c.kind = ?')
+
+    return set(tuple(row) for row in scratch_db.execute(select_sql, [kind]))
 
-    return cleaned
@@ -0,0 +1,114 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Optional full-text search over company names, brands, and categories
+in the output DB, using SQLite's FTS5 extension.
+
+The search table isn't in TABLES; it's a virtual table derived from the
+finished output tables, added just before we publish (see
+build_output_db()).
+"""
+import re
+import sqlite3
+from logging import getLogger
+
+log = getLogger(__name__)
+
+SEARCH_TABLE = 'search'
+
+# *name* is what we search; the other columns say what it names. The
+# prefix indexes make prefix queries like "coca*" fast
+CREATE_SEARCH_TABLE_SQL = (
+    'CREATE VIRTUAL TABLE `{}` USING fts5('
+    'name, kind UNINDEXED, company UNINDEXED, brand UNINDEXED,'
+    " tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')".format(
+        SEARCH_TABLE))
+
+# rows to index: (kind, name, company, brand)
+SEARCH_ROWS_SQL = (
+    "SELECT 'company', `company_name`, `company`, '' FROM `company_name`"
+    " UNION SELECT 'brand', `brand`, `company`, `brand` FROM `brand`"
+    " UNION SELECT 'category', `category`, `company`, `brand`"
+    " FROM `category`")
+
+# words in a user's query
+WORD_RE = re.compile(r'\w+', re.U)
+
+
+def build_search_table(output_db):
+    """Add a full-text search table to the (filled) output DB.
+
+    If this build of SQLite doesn't have FTS5, log a warning and return
+    False. Otherwise, return True.
+    """
+    log.info('  building {} table'.format(SEARCH_TABLE))
+
+    try:
+        output_db.execute(CREATE_SEARCH_TABLE_SQL)
+    except sqlite3.OperationalError as e:
+        log.warning('  skipping {} table: {}'.format(SEARCH_TABLE, e))
+        return False
+
+    output_db.execute(
+        'INSERT INTO `{}` (kind, name, company, brand) {}'.format(
+            SEARCH_TABLE, SEARCH_ROWS_SQL))
+
+    # merge the index into a single b-tree, since it won't change
+    output_db.execute(
+        "INSERT INTO `{0}` (`{0}`) VALUES ('optimize')".format(SEARCH_TABLE))
+
+    return True
+
+
+def search(output_db, query, *, kinds=None, limit=20):
+    """Find company names, brands, and categories matching the words
+    in *query* (the last word can be a prefix: "organic cof" finds
+    "Organic Coffee").
+
+    Optionally restrict to the given *kinds* ('company', 'brand',
+    'category').
+
+    Returns a list of dicts with the keys kind, name, company, and brand,
+    best matches first.
+    """
+    match = search_query_to_match(query)
+    if not match:
+        return []
+
+    sql = 'SELECT kind, name, company, brand FROM `{}` WHERE `{}` MATCH ?'
+    params = [match]
+
+    if kinds is not None:
+        kinds = sorted(kinds)
+        sql += ' AND kind IN ({})'.format(', '.join('?' for _ in kinds))
+        params.extend(kinds)
+
+    sql += ' ORDER BY rank LIMIT ?'
+    params.append(limit)
+
+    return [dict(row) for row in output_db.execute(
+        sql.format(SEARCH_TABLE, SEARCH_TABLE), params)]
+
+
+def search_query_to_match(query):
+    """Turn a user's search query into an FTS5 MATCH expression that
+    requires each word, treating the last one as a prefix. Returns ''
+    if *query* has no words."""
+    words = WORD_RE.findall(query or '')
+    if not words:
+        return ''
+
+    terms = ['"{}"'.format(word) for word in words]
+    terms[-1] += '*'
+
+    return ' '.join(terms)
@@ -0,0 +1,188 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Filtered subsets of the output DB (e.g. just one campaign's ratings,
+or just companies based in one country), built from the same merge as
+the full output DB (see build_output_db()).
+
+Each subset is described by an OutputSpec:
+
+- *path*: where to publish the subset
+- *campaign_ids*: if set, only keep rows for these campaigns in tables
+  with a campaign_id column, and only keep companies that have a rating
+  or claim from one of these campaigns
+- *hq_countries*: if set, only keep companies with one of these
+  hq_countries
+- *tables*: if set, only include these tables
+
+Tables with a company column only keep rows for companies that are
+kept. near_duplicate rows that compare two companies (where kind is
+'company') are only kept if both companies are.
+"""
+from collections import namedtuple
+from logging import getLogger
+from urllib.parse import parse_qs
+
+from .db import col_sql
+from .db import show_tables
+from .merge import create_output_table
+from .table import TABLES
+
+log = getLogger(__name__)
+
+OutputSpec = namedtuple(
+    'OutputSpec', ['path', 'campaign_ids', 'hq_countries', 'tables'],
+    defaults=(None, None, None))
+
+# number of rows to read from the full output DB at a time
+SUBSET_CHUNK_SIZE = 1024
+
+
+def parse_output_spec(s):
+    """Parse an OutputSpec from the command line. The format is the
+    path, optionally followed by a query string, like:
+
+    msd-us.sqlite?hq_country=US,CA&table=company,rating
+    """
+    path, _, query = s.partition('?')
+    params = parse_qs(query, strict_parsing=bool(query))
+
+    def get_list(param):
+        if param not in params:
+            return None
+        return [v for value in params.pop(param) for v in value.split(',')]
+
+    spec = OutputSpec(
+        path,
+        campaign_ids=get_list('campaign_id'),
+        hq_countries=get_list('hq_country'),
+        tables=get_list('table'))
+
+    if params:
+        raise ValueError('unknown output spec param(s): {}'.format(
+            ', '.join(sorted(params))))
+
+    return spec
+
+
+def fill_subset_dbs(output_db, specs_and_dbs):
+    """Fill each subset DB from the (filled) full output DB.
+
+    *specs_and_dbs* is a list of (OutputSpec, open subset DB). We make a
+    single pass over each table in *output_db*, routing each row to every
+    subset it belongs in.
+    """
+    subsets = []
+    for spec, subset_db in specs_and_dbs:
+        if spec.tables is not None:
+            for table_name in spec.tables:
+                if table_name not in TABLES:
+                    raise ValueError('unknown table: {}'.format(table_name))
+
+        campaign_ids = None
+        if spec.campaign_ids is not None:
+            campaign_ids = set(spec.campaign_ids)
+
+        subsets.append((spec, subset_db, campaign_ids,
+                        get_subset_companies(output_db, spec)))
+
+    for table_name in show_tables(output_db):
+        table_subsets = [
+            subset for subset in subsets
+            if subset[0].tables is None or table_name in subset[0].tables]
+        if not table_subsets:
+            continue
+
+        log.info('  filling {} in {:d} subset(s)'.format(
+            table_name, len(table_subsets)))
+
+        cols = sorted(TABLES[table_name]['columns'])
+        get_companies = _get_companies_func(table_name, cols)
+        campaign_idx = (
+            cols.index('campaign_id') if 'campaign_id' in cols else None)
+
+        insert_sql = 'INSERT INTO `{}` ({}) VALUES ({})'.format(
+            table_name, col_sql(cols), ', '.join('?' for _ in cols))
+
+        for _, subset_db, _, _ in table_subsets:
+            create_output_table(subset_db, table_name)
+
+        cursor = output_db.execute('SELECT {} FROM `{}`'.format(
+            col_sql(cols), table_name))
+
+        while True:
+            rows = cursor.fetchmany(SUBSET_CHUNK_SIZE)
+            if not rows:
+                break
+
+            for _, subset_db, campaign_ids, companies in table_subsets:
+                subset_db.executemany(insert_sql, [
+                    row for row in rows
+                    if (campaign_ids is None or campaign_idx is None or
+                        row[campaign_idx] in campaign_ids) and
+                    (companies is None or get_companies is None or
+                     companies.issuperset(get_companies(row)))])
+
+
+def _get_companies_func(table_name, cols):
+    """Get a function that takes a row from the given table (a tuple of
+    values for *cols*) and returns the companies it's about, or None if
+    the table isn't about companies."""
+    if 'company' not in cols:
+        return None
+
+    company_idx = cols.index('company')
+
+    if table_name == 'near_duplicate':
+        kind_idx = cols.index('kind')
+        name_idx = cols.index('name')
+        similar_name_idx = cols.index('similar_name')
+
+        def get_companies(row):
+            if row[kind_idx] == 'company':
+                return (row[name_idx], row[similar_name_idx])
+            else:
+                return (row[company_idx],)
+    else:
+        def get_companies(row):
+            return (row[company_idx],)
+
+    return get_companies
+
+
+def get_subset_companies(output_db, spec):
+    """Get the set of companies to keep in the subset described by
+    *spec*, or None to keep all of them."""
+    companies = None
+
+    if spec.campaign_ids is not None:
+        params_sql = ', '.join('?' for _ in spec.campaign_ids)
+        companies = {row[0] for row in output_db.execute(
+            'SELECT `company` FROM `rating` WHERE `campaign_id` IN ({0})'
+            ' UNION SELECT `company` FROM `claim`'
+            ' WHERE `campaign_id` IN ({0})'.format(params_sql),
+            list(spec.campaign_ids) * 2)}
+
+    if spec.hq_countries is not None:
+        params_sql = ', '.join('?' for _ in spec.hq_countries)
+        hq_companies = {row[0] for row in output_db.execute(
+            'SELECT `company` FROM `company`'
+            ' WHERE `hq_country` IN ({})'.format(params_sql),
+            list(spec.hq_countries))}
+
+        if companies is None:
+            companies = hq_companies
+        else:
+            companies &= hq_companies
+
+    return companies
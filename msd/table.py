@@ -54,6 +54,9 @@ TABLES = dict(
             is_implied='tinyint',
         ),
         primary_key=['company', 'brand', 'category'],
+        scratch_indexes=[
+            ['scraper_id', 'company', 'brand'],
+        ],
     ),
     claim=dict(
         columns=dict(
@@ -67,6 +70,13 @@ TABLES = dict(
             url='text',
         ),
         primary_key=['campaign_id', 'company', 'brand', 'scope', 'claim'],
+        # for looking up a target's claims/ratings (see msd.query)
+        output_indexes=[
+            ['company', 'brand'],
+        ],
+        scratch_indexes=[
+            ['scraper_id', 'company', 'brand', 'campaign_id', 'claim'],
+        ],
     ),
     company=dict(
         columns=dict(
@@ -95,6 +105,20 @@ TABLES = dict(
         ],
         primary_key=['company', 'company_name'],
     ),
+    # report of company and brand names that are suspiciously similar
+    # (see msd.near_duplicate)
+    near_duplicate=dict(
+        columns=dict(
+            company='text',
+            kind='text',
+            name='text',
+            similar_name='text',
+            similarity='real',
+        ),
+        optional=True,
+        primary_key=['kind', 'company', 'name', 'similar_name'],
+        scratch=False,
+    ),
     rating=dict(
         columns=dict(
             brand='text',
@@ -106,13 +130,25 @@ TABLES = dict(
             judgment='tinyint',
             max_score='numeric',
             min_score='numeric',
+            normalized_score='real',
             num_ranked='integer',
+            percentile='real',
             rank='integer',
             scope='text',
             score='numeric',
             url='text',
         ),
         primary_key=['campaign_id', 'company', 'brand', 'scope'],
+        # for looking up a target's claims/ratings (see msd.query)
+        output_indexes=[
+            ['company', 'brand'],
+        ],
+        scratch_indexes=[
+            ['scraper_id', 'company', 'brand', 'campaign_id'],
+        ],
+        # computed once the table is built (see msd.rating), never
+        # read from input
+        output_only_columns=['normalized_score', 'percentile'],
     ),
     scraper_brand_map=dict(
         columns=dict(
@@ -164,6 +200,24 @@ TABLES = dict(
         ),
         primary_key=['category', 'subcategory'],
     ),
+    target_summary=dict(
+        columns=dict(
+            brand='text',
+            company='text',
+            company_judgment='tinyint',
+            judgment='tinyint',
+            num_campaigns='integer',
+            num_negative_claims='integer',
+            num_negative_ratings='integer',
+            num_neutral_claims='integer',
+            num_neutral_ratings='integer',
+            num_positive_claims='integer',
+            num_positive_ratings='integer',
+        ),
+        optional=True,
+        primary_key=['company', 'brand'],
+        scratch=False,
+    ),
     url=dict(
         columns=dict(
             url='text',
@@ -12,11 +12,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Utilities for targets, which can be either companies or brands."""
-from collections import defaultdict
+from itertools import groupby
+from logging import getLogger
 
 from .brand import map_brand
 from .company import map_company
+from .db import col_sql
 from .db import select_groups
+from .merge import create_output_table
+from .merge import output_row
+
+log = getLogger(__name__)
 
 
 def map_target(output_db, scraper_id, scraper_company, scraper_brand=''):
@@ -32,27 +38,83 @@ def map_target(output_db, scraper_id, scraper_company, scraper_brand=''):
             return (company, '')
 
 
+def build_target_tables(output_db, scratch_db, table_to_merger):
+    """Build several tables keyed by target in one pass over targets.
+
+    *table_to_merger* maps table name to a tuple of (key_cols,
+    merge_group), where merge_group(target, key, rows) takes a group
+    yielded by select_groups_by_target(), and returns a row for the
+    output table, or None to skip it.
+    """
+    log.info('  building {} tables'.format(' and '.join(
+        sorted(table_to_merger))))
+
+    for table_name in sorted(table_to_merger):
+        create_output_table(output_db, table_name)
+
+    table_to_key_cols = {
+        table_name: key_cols
+        for table_name, (key_cols, _) in table_to_merger.items()}
+
+    for target, table_name, key, rows in select_groups_by_target_for_tables(
+            output_db, scratch_db, table_to_key_cols):
+
+        _, merge_group = table_to_merger[table_name]
+        row = merge_group(target, key, rows)
+        if row is not None:
+            output_row(output_db, table_name, row)
+
+
 def select_groups_by_target(
         output_db, scratch_db, table_name, key_cols=()):
     """Yield all rows from the given table, grouped by target (company/brand)
     and, optionally, key_cols.
 
-    Yields (company, brand), (key_col_value, ...), [row]
+    Yields (company, brand), (key_col_value, ...), rows
+
+    *rows* is an iterator over the group's rows (as dicts), streamed
+    from a single query per target that SQLite sorts by *key_cols*
+    (spilling to disk if it has to), so we never have to hold a whole
+    group in memory, let alone every row for the target. As with
+    itertools.groupby(), each group's *rows* have to be consumed before
+    moving on to the next group. Groups for a target are yielded in
+    order of their key.
+    """
+    for target, _, key, rows in select_groups_by_target_for_tables(
+            output_db, scratch_db, {table_name: key_cols}):
+        yield target, key, rows
+
+
+def select_groups_by_target_for_tables(
+        output_db, scratch_db, table_to_key_cols):
+    """Like select_groups_by_target(), but for several tables at once,
+    so we only walk the company and brand maps once.
+
+    *table_to_key_cols* maps table name to key_cols.
+
+    Yields (company, brand), table_name, (key_col_value, ...), rows
+
+    For each target, we yield groups for one table at a time, in
+    order of table name.
     """
-    if isinstance(key_cols, str):
-        raise TypeError
+    for key_cols in table_to_key_cols.values():
+        if isinstance(key_cols, str):
+            raise TypeError
+
+    table_names = sorted(table_to_key_cols)
 
-    for (company, brand), target_map_rows in _select_target_groups(output_db):
-        key_to_rows = defaultdict(list)
+    for target, target_map_rows in _select_target_groups(output_db):
+        for table_name in table_names:
+            key_cols = table_to_key_cols[table_name]
 
-        for row in _select_by_targets(
-                scratch_db, table_name, target_map_rows):
+            def keyfunc(row):
+                return tuple(row[kc] for kc in key_cols)
 
-            key = tuple(row[kc] for kc in key_cols)
-            key_to_rows[key].append(row)
+            rows = _select_by_targets(
+                scratch_db, table_name, target_map_rows, key_cols)
 
-        for key, row_group in key_to_rows.items():
-            yield (company, brand), key, row_group
+            for key, row_group in groupby(rows, key=keyfunc):
+                yield target, table_name, key, (dict(row) for row in row_group)
 
 
 def _select_target_groups(output_db):
@@ -75,15 +137,34 @@ def _select_target_groups(output_db):
         ) for r in company_map_rows]
 
 
-def _select_by_targets(scratch_db, table_name, target_map_rows):
-    select_sql = (
-        'SELECT * FROM `{}` WHERE scraper_id = ? AND'
-        ' company = ? AND brand = ?'.format(table_name))
+def _select_by_targets(scratch_db, table_name, target_map_rows, key_cols=()):
+    """Yield rows from *table_name* matching any of the given target map
+    rows, in order of *key_cols*. Rows with the same key are yielded
+    in the order of *target_map_rows*.
+
+    This is a single query, joining the table against the target map
+    rows (as a VALUES list), so SQLite does the sorting.
+    """
+    if not target_map_rows:
+        return iter(())
 
+    values_sql = ', '.join(
+        '({:d}, ?, ?, ?)'.format(i) for i in range(len(target_map_rows)))
+
+    select_sql = (
+        'WITH `target_map` (`i`, `scraper_id`, `company`, `brand`)'
+        ' AS (VALUES {})'
+        ' SELECT t.* FROM `target_map` AS m'
+        ' JOIN `{}` AS t ON t.`scraper_id` = m.`scraper_id`'
+        ' AND t.`company` = m.`company` AND t.`brand` = m.`brand`'
+        ' ORDER BY {}').format(
+            values_sql, table_name,
+            ', '.join(['t.`{}`'.format(kc) for kc in key_cols] + ['m.`i`']))
+
+    params = []
     for target_map_row in target_map_rows:
-        for row in scratch_db.execute(
-                select_sql, [target_map_row['scraper_id'],
-                             target_map_row['scraper_company'],
-                             target_map_row['scraper_brand']]):
+        params.extend([target_map_row['scraper_id'],
+                       target_map_row['scraper_company'],
+                       target_map_row['scraper_brand']])
 
-            yield dict(row)
+    return scratch_db.execute(select_sql, params)
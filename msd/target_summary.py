@@ -0,0 +1,94 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Optional table summarizing each target's ratings and claims, so that
+consumers don't have to aggregate them at query time.
+
+*judgment* is the overall judgment of the target's ratings (the sign of
+the sum of their judgments, or NULL if it has no ratings).
+*company_judgment* is the same thing for the company's own ratings
+(brand ''), which brands inherit.
+
+This is all done in a single SQL query (GROUP BY over the rating and
+claim tables), rather than looping over targets in Python.
+"""
+from logging import getLogger
+
+from .merge import create_output_table
+
+log = getLogger(__name__)
+
+# sign of an integer expression, preserving NULL (SQLite's sign() is
+# only available if it was compiled with math functions)
+_SIGN_SQL = ('(CASE WHEN {0} > 0 THEN 1 WHEN {0} < 0 THEN -1'
+             ' WHEN {0} = 0 THEN 0 END)')
+
+TARGET_SUMMARY_SQL = """
+INSERT INTO `target_summary` (
+    `company`, `brand`, `num_campaigns`,
+    `num_positive_ratings`, `num_neutral_ratings`, `num_negative_ratings`,
+    `num_positive_claims`, `num_neutral_claims`, `num_negative_claims`,
+    `judgment`, `company_judgment`)
+WITH `judgments` AS (
+    SELECT `company`, `brand`, `campaign_id`, `judgment`, 1 AS `is_rating`
+    FROM `rating`
+    UNION ALL
+    SELECT `company`, `brand`, `campaign_id`, `judgment`, 0 AS `is_rating`
+    FROM `claim`
+), `targets` AS (
+    SELECT `company`, '' AS `brand` FROM `company`
+    UNION
+    SELECT `company`, `brand` FROM `brand`
+    UNION
+    SELECT `company`, `brand` FROM `judgments`
+), `summary` AS (
+    SELECT
+        `company`, `brand`,
+        COUNT(DISTINCT `campaign_id`) AS `num_campaigns`,
+        SUM(`is_rating` AND `judgment` > 0) AS `num_positive_ratings`,
+        SUM(`is_rating` AND `judgment` = 0) AS `num_neutral_ratings`,
+        SUM(`is_rating` AND `judgment` < 0) AS `num_negative_ratings`,
+        SUM(NOT `is_rating` AND `judgment` > 0) AS `num_positive_claims`,
+        SUM(NOT `is_rating` AND `judgment` = 0) AS `num_neutral_claims`,
+        SUM(NOT `is_rating` AND `judgment` < 0) AS `num_negative_claims`,
+        {judgment} AS `judgment`
+    FROM `judgments`
+    GROUP BY `company`, `brand`
+)
+SELECT
+    t.`company`, t.`brand`,
+    IFNULL(s.`num_campaigns`, 0),
+    IFNULL(s.`num_positive_ratings`, 0),
+    IFNULL(s.`num_neutral_ratings`, 0),
+    IFNULL(s.`num_negative_ratings`, 0),
+    IFNULL(s.`num_positive_claims`, 0),
+    IFNULL(s.`num_neutral_claims`, 0),
+    IFNULL(s.`num_negative_claims`, 0),
+    s.`judgment`,
+    c.`judgment`
+FROM `targets` AS t
+LEFT JOIN `summary` AS s
+    ON s.`company` = t.`company` AND s.`brand` = t.`brand`
+LEFT JOIN `summary` AS c
+    ON c.`company` = t.`company` AND c.`brand` = ''
+""".format(judgment=_SIGN_SQL.format(
+    'SUM(CASE WHEN `is_rating` THEN `judgment` END)'))
+
+
+def build_target_summary_table(output_db, scratch_db):
+    """Summarize the rating and claim tables (which must already be
+    built) by target."""
+    log.info('  building target_summary table')
+    create_output_table(output_db, 'target_summary')
+
+    output_db.execute(TARGET_SUMMARY_SQL)
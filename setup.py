@@ -23,6 +23,7 @@ try:
             'titlecase>=0.7.1',
         ],
         'provides': ['msd'],
+        'python_requires': '>=3.8',
         'test_suite': 'test.unit.suite.load_tests',
     }
 except ImportError:
@@ -39,9 +40,10 @@ setup(
         'Operating System :: OS Independent',
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
     description='Merge SpendRight scraper data',
     license='Apache',
@@ -51,7 +53,7 @@ setup(
         'msd',
     ],
     package_data={},
-    scripts=['bin/msd'],
+    scripts=['bin/msd', 'bin/msd-apply-delta'],
     url='http://github.com/spendright/msd',
     version=msd.__version__,
     **setuptools_kwargs
@@ -13,6 +13,8 @@
 #   limitations under the License.
 """Utilities for testing databases."""
 import sqlite3
+from shutil import rmtree
+from tempfile import mkdtemp
 from unittest import TestCase
 
 from msd.db import create_table
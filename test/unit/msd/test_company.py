@@ -11,9 +11,25 @@
 #   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
+from os import remove
+from os.path import exists
+from os.path import join
 from unittest import TestCase
 
-from msd.company import get_company_names
+from msd.company import _select_reusable_clusters
+from msd.company import build_company_name_and_scraper_company_map_tables
+from msd.company import load_company_clusters
+from msd.company import save_company_clusters
+from msd.db import create_table
+from msd.db import open_db
+from msd.key import get_company_names
+from msd.scratch import build_scratch_db_in_memory
+from msd.scratch import select_catalog
+from msd.scratch import select_company_keys
+
+from ...db import DBTestCase
+from ...db import insert_rows
+from ...db import select_all
 
 
 class TestGetCompanyNames(TestCase):
@@ -26,3 +42,120 @@ class TestGetCompanyNames(TestCase):
 
     def test_basic(self):
         self.assertEqual(get_company_names('Konica'), {'Konica'})
+
+
+class TestCompanyClusters(DBTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.cache_path = join(self.tmp_dir, 'company-cache.sqlite')
+
+    def build_scratch_db(self, brands):
+        """Build a scratch DB from a single input DB containing
+        the given brand rows."""
+        input_db_path = join(self.tmp_dir, 'sr.campaign.sqlite')
+        if exists(input_db_path):
+            remove(input_db_path)
+
+        with open_db(input_db_path) as input_db:
+            create_table(input_db, 'brand', dict(
+                brand='text', company='text'))
+            insert_rows(input_db, 'brand', brands)
+        input_db.close()
+
+        return build_scratch_db_in_memory([input_db_path])
+
+    def build_tables(self, scratch_db, company_clusters=None):
+        """Return the clusters, and the rows of the
+        scraper_company_map and company_name tables."""
+        output_db = open_db(':memory:')
+        clusters = build_company_name_and_scraper_company_map_tables(
+            output_db, scratch_db, company_clusters=company_clusters)
+
+        return clusters, {
+            table_name: select_all(output_db, table_name)
+            for table_name in ('scraper_company_map', 'company_name')}
+
+    def test_reuse_clusters(self):
+        scratch_db = self.build_scratch_db([
+            dict(brand='Sprite', company='The Coca-Cola Company'),
+            dict(brand='Great Value', company='Wal-Mart Stores, Inc.'),
+        ])
+
+        clusters, tables = self.build_tables(scratch_db)
+        save_company_clusters(self.cache_path, clusters)
+        loaded_clusters = load_company_clusters(self.cache_path)
+
+        self.assertEqual(loaded_clusters, clusters)
+        self.assertEqual(
+            _select_reusable_clusters(
+                scratch_db, loaded_clusters,
+                select_company_keys(scratch_db),
+                sorted(select_catalog(scratch_db, 'company')), []),
+            clusters)
+
+        warm_clusters, warm_tables = self.build_tables(
+            scratch_db, loaded_clusters)
+
+        self.assertEqual(warm_tables, tables)
+        self.assertEqual(warm_clusters, clusters)
+
+    def test_new_company_with_same_key(self):
+        scratch_db = self.build_scratch_db([
+            dict(brand='Great Value', company='Wal-Mart Stores, Inc.'),
+        ])
+        clusters, _ = self.build_tables(scratch_db)
+
+        scratch_db = self.build_scratch_db([
+            dict(brand='Great Value', company='Wal-Mart Stores, Inc.'),
+            dict(brand='Equate', company='Wal-Mart Stores'),
+        ])
+
+        self.assertEqual(
+            _select_reusable_clusters(
+                scratch_db, clusters, select_company_keys(scratch_db),
+                sorted(select_catalog(scratch_db, 'company')), []),
+            [])
+
+        _, cold_tables = self.build_tables(scratch_db)
+        _, warm_tables = self.build_tables(scratch_db, clusters)
+
+        self.assertEqual(warm_tables, cold_tables)
+        self.assertEqual(
+            {row['company'] for row in cold_tables['scraper_company_map']},
+            {'Wal-Mart Stores'})
+
+    def test_brands_changed(self):
+        scratch_db = self.build_scratch_db([
+            dict(brand='Sprite', company='The Coca-Cola Company'),
+        ])
+        clusters, _ = self.build_tables(scratch_db)
+
+        # aliases that match a brand can become the company's name
+        scratch_db = self.build_scratch_db([
+            dict(brand='Coca-Cola', company='The Coca-Cola Company'),
+        ])
+
+        self.assertEqual(
+            _select_reusable_clusters(
+                scratch_db, clusters, select_company_keys(scratch_db),
+                sorted(select_catalog(scratch_db, 'company')), []),
+            [])
+
+        _, cold_tables = self.build_tables(scratch_db)
+        _, warm_tables = self.build_tables(scratch_db, clusters)
+
+        self.assertEqual(warm_tables, cold_tables)
+
+    def test_load_missing_file(self):
+        self.assertIsNone(load_company_clusters(self.cache_path))
+
+    def test_load_different_version(self):
+        save_company_clusters(self.cache_path, [])
+
+        with open_db(self.cache_path) as db:
+            db.execute("UPDATE meta SET value = 'foo' WHERE key = 'version'")
+        db.close()
+
+        self.assertIsNone(load_company_clusters(self.cache_path))
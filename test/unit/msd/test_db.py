@@ -11,8 +11,17 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+from os.path import join
+from sqlite3 import OperationalError
+
+from msd.db import create_table
 from msd.db import insert_row
+from msd.db import open_db
+from msd.db import save_db
 from msd.db import select_groups
+from msd.db import show_columns
+from msd.db import show_tables
+from msd.db import sqlite_sort_key
 
 from ...db import DBTestCase
 from ...db import insert_rows
@@ -60,3 +69,149 @@ class TestSelectGroups(DBTestCase):
 
         self.assertEqual(groups,
                          [(('Foo',), TWO_ROWS)])
+
+
+class TestShowColumns(DBTestCase):
+
+    OUTPUT_TABLES = ['scraper_company_map']
+
+    def test_output_table(self):
+        self.assertEqual(
+            sorted(show_columns(self.output_db, 'scraper_company_map')),
+            ['company', 'scraper_company', 'scraper_id'])
+
+    def test_no_such_table(self):
+        self.assertEqual(show_columns(self.output_db, 'foo'), [])
+
+
+class TestOpenDB(DBTestCase):
+
+    def test_readonly(self):
+        path = join(self.tmp_dir, 'sr.campaign.sqlite')
+
+        with open_db(path) as db:
+            create_table(db, 'campaign', dict(campaign_id='text'))
+            insert_row(db, 'campaign', dict(campaign_id='qux'))
+
+        ro_db = open_db(path, readonly=True)
+        self.assertEqual(
+            [dict(row) for row in ro_db.execute('SELECT * FROM campaign')],
+            [dict(campaign_id='qux')])
+
+        self.assertRaises(
+            OperationalError,
+            insert_row, ro_db, 'campaign', dict(campaign_id='bar'))
+
+    def test_readonly_path_with_special_chars(self):
+        path = join(self.tmp_dir, 'sr #1?.sqlite')
+
+        with open_db(path) as db:
+            create_table(db, 'campaign', dict(campaign_id='text'))
+
+        ro_db = open_db(path, readonly=True)
+        self.assertEqual(show_tables(ro_db), ['campaign'])
+
+
+class TestSaveDB(DBTestCase):
+
+    def test_save(self):
+        path = join(self.tmp_dir, 'foo.sqlite')
+        with self.output_db:
+            create_table(self.output_db, 'foo', dict(bar='text'))
+            insert_row(self.output_db, 'foo', dict(bar='baz'))
+
+        save_db(self.output_db, path)
+
+        with open_db(path) as db:
+            self.assertEqual([dict(row) for row in db.execute(
+                'SELECT * FROM foo')], [dict(bar='baz')])
+
+    def test_uncommitted_changes(self):
+        create_table(self.output_db, 'foo', dict(bar='text'))
+        insert_row(self.output_db, 'foo', dict(bar='baz'))
+
+        self.assertRaises(
+            ValueError,
+            save_db, self.output_db, join(self.tmp_dir, 'foo.sqlite'))
+
+
+class TestCreateTable(DBTestCase):
+
+    def test_without_rowid(self):
+        create_table(self.output_db, 'foo', dict(bar='text', baz='text'),
+                     ['bar'], without_rowid=True)
+        insert_row(self.output_db, 'foo', dict(bar='a', baz='b'))
+
+        self.assertRaises(
+            OperationalError,
+            self.output_db.execute, 'SELECT rowid FROM foo')
+
+    def test_without_rowid_requires_primary_key(self):
+        self.assertRaises(
+            ValueError,
+            create_table, self.output_db, 'foo', dict(bar='text'),
+            without_rowid=True)
+
+
+class TestCreateFunctions(DBTestCase):
+
+    def test_smunch(self):
+        self.assertEqual(
+            self.output_db.execute("SELECT smunch('Kit Kat')").fetchone()[0],
+            'kitkat')
+
+    def test_norm(self):
+        self.assertEqual(
+            self.output_db.execute("SELECT norm('Nestlé S.A.')").fetchone()[0],
+            'nestle s.a.')
+
+    def test_null(self):
+        self.assertIsNone(
+            self.output_db.execute('SELECT smunch(NULL)').fetchone()[0])
+
+
+class TestSQLiteSortKey(DBTestCase):
+
+    def test_matches_sqlite_order(self):
+        values = [None, 2, 1.5, -3, 'b', 'B', 'a', '\xe9', '', b'\x00']
+
+        expected = [row[0] for row in self.output_db.execute(
+            'SELECT v FROM ({}) ORDER BY v'.format(' UNION ALL '.join(
+                'SELECT ? AS v' for _ in values)), values)]
+
+        self.assertEqual(
+            sorted(values, key=lambda v: sqlite_sort_key([v])), expected)
+
+
+class TestMergeValues(DBTestCase):
+
+    def merge_values(self, *values):
+        # merge in the order given
+        params = [p for i, v in enumerate(values) for p in (v, i)]
+
+        return self.output_db.execute(
+            'SELECT merge_values(v, i) FROM ({})'.format(' UNION ALL '.join(
+                'SELECT ? AS v, ? AS i' for _ in values)),
+            params).fetchone()[0]
+
+    def test_first_non_null_wins(self):
+        self.assertEqual(self.merge_values(None, 'a', 'b'), 'a')
+
+    def test_empty_string_replaced(self):
+        self.assertEqual(self.merge_values('', 'a'), 'a')
+        # like merge_dicts(), even by null
+        self.assertEqual(self.merge_values('', None, 'a'), 'a')
+        self.assertIsNone(self.merge_values('', None))
+
+    def test_zero_not_replaced(self):
+        self.assertEqual(self.merge_values(0, 1), 0)
+
+    def test_order_not_query_plan(self):
+        for order_sql in ('ASC', 'DESC'):
+            self.assertEqual(
+                self.output_db.execute(
+                    'SELECT merge_values(v, i) FROM (SELECT * FROM'
+                    " (SELECT 'b' AS v, 2 AS i UNION ALL SELECT 'a', 1"
+                    " UNION ALL SELECT 'c', 1) ORDER BY v {})".format(
+                        order_sql)).fetchone()[0],
+                'a')
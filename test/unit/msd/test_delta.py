@@ -0,0 +1,221 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import gzip
+import json
+from os.path import join
+from shutil import copyfile
+
+from msd.db import open_db
+from msd.db import show_tables
+from msd.delta import DELTA_VERSION
+from msd.delta import apply_delta
+from msd.delta import get_delta
+from msd.delta import write_delta
+from msd.digest import db_digest
+from msd.merge import create_output_table
+from msd.search import build_search_table
+from msd.search import search
+
+from ...db import DBTestCase
+from ...db import insert_rows
+from ...db import select_all
+
+
+class TestDelta(DBTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.old_db_path = join(self.tmp_dir, 'old.sqlite')
+        self.new_db_path = join(self.tmp_dir, 'new.sqlite')
+        self.delta_path = join(self.tmp_dir, 'delta.json.gz')
+
+        self.old_db = self.open(self.old_db_path)
+        self.new_db = self.open(self.new_db_path)
+
+        for db in (self.old_db, self.new_db):
+            create_output_table(db, 'brand')
+            create_output_table(db, 'company')
+
+        insert_rows(self.old_db, 'brand', [
+            dict(company='Kraft', brand='Oscar Mayer'),
+            dict(company='Kraft', brand='Velveeta'),
+            dict(company='Kraft', brand='Jell-O'),
+        ])
+        insert_rows(self.new_db, 'brand', [
+            # unchanged
+            dict(company='Kraft', brand='Oscar Mayer'),
+            # updated
+            dict(company='Kraft', brand='Velveeta', tm='®'),
+            # inserted
+            dict(company='Kraft', brand='Kool-Aid'),
+            # Jell-O deleted
+        ])
+
+    def open(self, path):
+        db = open_db(path)
+        self.addCleanup(db.close)
+        return db
+
+    def commit(self):
+        self.old_db.commit()
+        self.new_db.commit()
+
+    def assert_delta_applies(self):
+        self.commit()
+
+        write_delta(self.old_db_path, self.new_db_path, self.delta_path)
+
+        db_path = join(self.tmp_dir, 'mirror.sqlite')
+        copyfile(self.old_db_path, db_path)
+
+        apply_delta(db_path, self.delta_path)
+
+        db = self.open(db_path)
+        self.assertEqual(db_digest(db), db_digest(self.new_db))
+        return db
+
+    def test_insert_update_delete(self):
+        self.commit()
+
+        delta = get_delta(self.old_db_path, self.new_db_path)
+
+        self.assertEqual(sorted(delta['tables']), ['brand'])
+        brand_delta = delta['tables']['brand']
+        cols = brand_delta['columns']
+
+        self.assertEqual(
+            [dict(zip(cols, row))['brand'] for row in brand_delta['insert']],
+            ['Kool-Aid'])
+        self.assertEqual(
+            [dict(zip(cols, row))['brand'] for row in brand_delta['update']],
+            ['Velveeta'])
+        self.assertEqual(brand_delta['delete'], [['Kraft', 'Jell-O']])
+        self.assertFalse(brand_delta['create'])
+
+    def test_apply(self):
+        db = self.assert_delta_applies()
+
+        self.assertEqual(
+            sorted(row['brand'] for row in select_all(db, 'brand')),
+            ['Kool-Aid', 'Oscar Mayer', 'Velveeta'])
+
+    def test_write_stats(self):
+        self.commit()
+
+        stats = write_delta(
+            self.old_db_path, self.new_db_path, self.delta_path)
+
+        self.assertEqual(stats['inserted'], 1)
+        self.assertEqual(stats['updated'], 1)
+        self.assertEqual(stats['deleted'], 1)
+        self.assertGreater(stats['size'], 0)
+
+        with gzip.open(self.delta_path, 'rt') as f:
+            self.assertEqual(json.load(f)['version'], DELTA_VERSION)
+
+    def test_no_changes(self):
+        self.commit()
+
+        delta = get_delta(self.old_db_path, self.old_db_path)
+
+        self.assertEqual(delta['tables'], {})
+        self.assertEqual(delta['drop'], [])
+        self.assertEqual(delta['old_digest'], delta['new_digest'])
+
+    def test_create_and_drop_tables(self):
+        create_output_table(self.old_db, 'category')
+        create_output_table(self.new_db, 'subcategory', without_rowid=True)
+        insert_rows(self.new_db, 'subcategory', [
+            dict(category='Food', subcategory='Candy'),
+        ])
+
+        db = self.assert_delta_applies()
+
+        self.assertNotIn('category', show_tables(db))
+        self.assertEqual(
+            select_all(db, 'subcategory'),
+            [dict(category='Food', subcategory='Candy', is_implied=None)])
+
+    def test_columns_changed(self):
+        self.old_db.execute('ALTER TABLE company ADD COLUMN foo TEXT')
+        insert_rows(self.old_db, 'company', [dict(company='Kraft')])
+        insert_rows(self.new_db, 'company', [dict(company='Kraft')])
+
+        self.assert_delta_applies()
+
+    def test_create_tables_from_delta(self):
+        # tables are created as they are in the new DB, even if that's
+        # not what this version of TABLES would create
+        self.new_db.execute('ALTER TABLE company ADD COLUMN foo INTEGER')
+        insert_rows(self.new_db, 'company', [dict(company='Kraft', foo=1)])
+        create_output_table(self.new_db, 'company_name')
+
+        db = self.assert_delta_applies()
+
+        self.assertEqual(select_all(db, 'company')[0]['foo'], 1)
+        for table_name in ('company', 'company_name'):
+            self.assertEqual(self.select_schema(db, table_name),
+                             self.select_schema(self.new_db, table_name))
+
+    def select_schema(self, db, table_name):
+        """Get the type and primary key position of each column, and
+        the names of indexes."""
+        return (
+            sorted((row[1], row[2], row[5]) for row in db.execute(
+                'PRAGMA table_info(`{}`)'.format(table_name))),
+            sorted(row[1] for row in db.execute(
+                'PRAGMA index_list(`{}`)'.format(table_name))))
+
+    def test_wrong_db(self):
+        self.commit()
+
+        write_delta(self.old_db_path, self.new_db_path, self.delta_path)
+
+        # applying twice shouldn't work
+        db_path = join(self.tmp_dir, 'mirror.sqlite')
+        copyfile(self.new_db_path, db_path)
+
+        self.assertRaises(ValueError, apply_delta, db_path, self.delta_path)
+
+    def test_bad_result_is_rolled_back(self):
+        self.commit()
+
+        write_delta(self.old_db_path, self.new_db_path, self.delta_path)
+
+        with gzip.open(self.delta_path, 'rt') as f:
+            delta = json.load(f)
+        delta['new_digest'] = '0' * 64
+        with gzip.open(self.delta_path, 'wt') as f:
+            json.dump(delta, f)
+
+        db_path = join(self.tmp_dir, 'mirror.sqlite')
+        copyfile(self.old_db_path, db_path)
+
+        self.assertRaises(ValueError, apply_delta, db_path, self.delta_path)
+
+        db = self.open(db_path)
+        self.assertEqual(db_digest(db), db_digest(self.old_db))
+
+    def test_rebuild_search_table(self):
+        for db in (self.old_db, self.new_db):
+            create_output_table(db, 'category')
+            create_output_table(db, 'company_name')
+        build_search_table(self.old_db)
+
+        db = self.assert_delta_applies()
+
+        self.assertEqual(
+            [row['name'] for row in search(db, 'kool')], ['Kool-Aid'])
+        self.assertEqual(search(db, 'jell'), [])
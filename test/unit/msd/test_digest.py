@@ -0,0 +1,70 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from msd.digest import db_digest
+from msd.digest import row_digest
+from msd.digest import table_digest
+from msd.merge import create_output_table
+
+from ...db import DBTestCase
+from ...db import insert_rows
+
+BRANDS = [
+    dict(company='Kraft', brand='Oscar Mayer'),
+    dict(company='Kraft', brand='Velveeta'),
+]
+
+
+class TestDigest(DBTestCase):
+
+    OUTPUT_TABLES = ['brand', 'company']
+
+    def test_order_independent(self):
+        insert_rows(self.output_db, 'brand', BRANDS)
+
+        other_db = self.scratch_db
+        create_output_table(other_db, 'brand', without_rowid=True)
+        create_output_table(other_db, 'company')
+        insert_rows(other_db, 'brand', reversed(BRANDS))
+
+        self.assertEqual(table_digest(self.output_db, 'brand'),
+                         table_digest(other_db, 'brand'))
+        self.assertEqual(db_digest(self.output_db), db_digest(other_db))
+
+    def test_content_changes_digest(self):
+        insert_rows(self.output_db, 'brand', BRANDS)
+        digest = table_digest(self.output_db, 'brand')
+
+        self.output_db.execute(
+            "UPDATE brand SET tm = 'R' WHERE brand = 'Velveeta'")
+
+        self.assertNotEqual(table_digest(self.output_db, 'brand'), digest)
+
+    def test_int_and_float_are_the_same(self):
+        # SQLite considers these equal
+        self.assertEqual(row_digest(['a', 1]), row_digest(['a', 1.0]))
+        self.assertNotEqual(row_digest(['a', 1]), row_digest(['a', 1.5]))
+
+    def test_empty_tables_count(self):
+        digest = db_digest(self.output_db)
+
+        create_output_table(self.output_db, 'category')
+
+        self.assertNotEqual(db_digest(self.output_db), digest)
+
+    def test_ignore_tables_not_in_TABLES(self):
+        digest = db_digest(self.output_db)
+
+        self.output_db.execute('CREATE TABLE foo (bar TEXT)')
+
+        self.assertEqual(db_digest(self.output_db), digest)
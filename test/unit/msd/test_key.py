@@ -0,0 +1,193 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import re
+from itertools import product
+from unittest import TestCase
+from unittest.mock import patch
+
+import msd.key
+from msd.company_data import COMPANY_ALIASES
+from msd.company_data import COMPANY_CORRECTIONS
+from msd.company_data import COMPANY_NAMES
+from msd.company_data import COMPANY_TYPES
+from msd.company_data import COMPANY_TYPE_RE
+from msd.company_data import DEFUNCT_COMPANIES
+from msd.company_data import UNSTRIPPABLE_COMPANIES
+from msd.key import CompanyExpansion
+from msd.key import clear_company_expansions
+from msd.key import expand_companies
+from msd.key import expand_company
+from msd.key import get_company_alias_keys
+from msd.key import get_company_aliases
+from msd.key import get_company_names
+from msd.key import match_company_type
+
+from ...case import PatchTestCase
+
+
+# company names that appear in tests and company_data
+KNOWN_COMPANY_NAMES = (
+    set(COMPANY_CORRECTIONS) | set(COMPANY_CORRECTIONS.values()) |
+    set().union(*COMPANY_ALIASES) | set().union(*COMPANY_NAMES) |
+    DEFUNCT_COMPANIES | UNSTRIPPABLE_COMPANIES | {
+        'Foo & Co.',
+        'Foo Inc.',
+        'Konica',
+        'Nestle S.A.',
+        'The Coca-Cola Company',
+        'Wal-Mart Stores, Inc.',
+    })
+
+# COMPANY_TYPE_RE as it was before we listed COMPANY_TYPES separately,
+# to make sure match_company_type() still does the same thing
+ORIGINAL_COMPANY_TYPE_RE = re.compile(
+    r'^(?P<company>.*?)(?P<intl1> International)?,? (?P<type>'
+    r'A\.?& S\. Klein GmbH \& Co\. KG'
+    r'|A/S'
+    r'|AB'
+    r'|AG'
+    r'|AS'
+    r'|ASA'
+    r'|Ab'
+    r'|BV'
+    r'|B\.V\.'
+    r'|B.V. Nederland'
+    r'|C\.V\.'
+    r'|Corp.'
+    r'|GmbH \& C[oO]\. [oO]HG'
+    r'|GmbH \& Co\. ?KG\.?'  # handle typo: Lukas Meindl GmbH & Co.KG
+    r'|GmbH \& Co\. KGaA'
+    r'|GmbH'
+    r'|Inc\.?'
+    r'|Incorporated'
+    r'|International'
+    r'|KG\.?'
+    r'|Llc'
+    r'|LLC'
+    r'|LLP'
+    r'|LP'
+    r'|Limited'
+    r'|Llp'
+    r'|Ltd\.?'
+    r'|Ltda\.?'
+    r'|nv'
+    r'|NV'
+    r'|N\.V\.'
+    r'|PBC'  # "Public Benefit Corporation"? Only on B Corp site
+    r'|PLC'
+    r'|P\.C\.'
+    r'|Pty\.? Ltd\.?'
+    r'|Pty\.?'
+    r'|S.L\.'  # was S.\L\., which Python 3.7+ rejects
+    r'|SA'
+    r'|SAPI DE CV SOFOM ENR'
+    r'|SARL'
+    r'|SE'
+    r'|S\.A\.?'
+    r'|S.A.B. de C.V.'
+    r'|S\.A\.U\.'
+    r'|S\.R\.L\.'
+    r'|S\.p\.A\.'
+    r'|Sarl'
+    r'|SpA'
+    r'|asa'
+    r'|b\.v\.'
+    r'|gmbh'
+    r'|inc\.?'
+    r'|plc\.?'
+    r')(?P<intl2> International)?$'
+)
+
+
+class TestMatchCompanyType(TestCase):
+
+    def assert_same_as_regex(self, s):
+        actual = match_company_type(s)
+        if actual is not None:
+            actual = tuple(actual)
+
+        for regex in (ORIGINAL_COMPANY_TYPE_RE, COMPANY_TYPE_RE):
+            m = regex.match(s)
+            expected = m and m.group('company', 'intl1', 'type', 'intl2')
+
+            self.assertEqual(actual, expected, repr(s))
+
+    def test_basic(self):
+        self.assertEqual(
+            match_company_type('Foo International, Inc.'),
+            ('Foo', ' International', 'Inc.', None))
+        self.assertEqual(
+            match_company_type('Foo GmbH & Co. KG International'),
+            ('Foo', None, 'GmbH & Co. KG', ' International'))
+        self.assertIsNone(match_company_type('Foo'))
+        self.assertIsNone(match_company_type('Inc.'))
+
+    def test_same_as_regex_for_known_names(self):
+        for s in sorted(KNOWN_COMPANY_NAMES):
+            self.assert_same_as_regex(s)
+
+    def test_same_as_regex_for_all_company_types(self):
+        for c_type, company, intl1, comma, intl2 in product(
+                COMPANY_TYPES,
+                ['', 'Foo', 'Foo Inc.', 'A/S', 'Foo,', 'International'],
+                ['', ' International'],
+                ['', ','],
+                ['', ' International']):
+            self.assert_same_as_regex(
+                company + intl1 + comma + ' ' + c_type + intl2)
+
+    def test_overlapping_company_types(self):
+        for s in ['Foo Pty Ltd', 'Foo Pty. Ltd.', 'Foo S.A', 'Foo S.A.',
+                  'Foo GmbH & Co.KG', 'Foo GmbH & Co. KGaA', 'Foo KG.',
+                  'Foo International International',
+                  'Foo, International Inc.', 'Foo Inc. Inc.',
+                  'Foo\nBar Inc.', 'Foo Inc.\n']:
+            self.assert_same_as_regex(s)
+
+
+class TestCompanyExpansions(PatchTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.start(patch.dict(msd.key._expansions, clear=True))
+
+    def test_expand_company(self):
+        self.assertEqual(
+            expand_company('Wal-Mart Stores, Inc.'),
+            CompanyExpansion(
+                aliases=get_company_aliases('Wal-Mart Stores, Inc.'),
+                names=get_company_names('Wal-Mart Stores, Inc.'),
+                keys=get_company_alias_keys('Wal-Mart Stores, Inc.')))
+
+    def test_expand_companies(self):
+        companies = ['Foo Inc.', 'The Bar Company', 'Baz/Qux GmbH', 'Foo Inc.']
+
+        expand_companies(companies, max_workers=1)
+        serial = dict(msd.key._expansions)
+        msd.key._expansions.clear()
+
+        self.start(patch('msd.key.MIN_PARALLEL_COMPANIES', 1))
+        expand_companies(companies, max_workers=2)
+
+        self.assertEqual(msd.key._expansions, serial)
+        self.assertEqual(set(serial), set(companies))
+
+    def test_clear_company_expansions(self):
+        expand_company('Nestle S.A.')
+        self.assertIn('Nestle S.A.', msd.key._expansions)
+
+        clear_company_expansions()
+
+        self.assertEqual(msd.key._expansions, {})
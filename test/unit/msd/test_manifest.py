@@ -0,0 +1,104 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+from os.path import exists
+from os.path import join
+
+from msd.manifest import get_manifest
+from msd.manifest import is_unchanged
+from msd.manifest import read_manifest
+from msd.manifest import write_manifest
+
+from ...db import DBTestCase
+from ...db import insert_rows
+
+
+class TestGetManifest(DBTestCase):
+
+    OUTPUT_TABLES = ['brand', 'company']
+
+    def test_no_previous_manifest(self):
+        manifest = get_manifest(self.output_db)
+
+        self.assertEqual(manifest['changed_tables'], ['brand', 'company'])
+        self.assertEqual(sorted(manifest['tables']), ['brand', 'company'])
+        self.assertEqual(manifest['other_tables'], [])
+        self.assertIsNone(manifest['previous_digest'])
+
+    def test_changed_tables(self):
+        previous = get_manifest(self.output_db)
+
+        insert_rows(self.output_db, 'brand', [
+            dict(company='Kraft', brand='Velveeta')])
+
+        manifest = get_manifest(self.output_db, previous=previous)
+
+        self.assertEqual(manifest['changed_tables'], ['brand'])
+        self.assertEqual(manifest['previous_digest'], previous['digest'])
+        self.assertNotEqual(manifest['digest'], previous['digest'])
+        self.assertFalse(is_unchanged(manifest, previous))
+
+    def test_unchanged(self):
+        previous = get_manifest(self.output_db)
+
+        manifest = get_manifest(self.output_db, previous=previous)
+
+        self.assertEqual(manifest['changed_tables'], [])
+        self.assertTrue(is_unchanged(manifest, previous))
+        self.assertFalse(is_unchanged(manifest, None))
+
+    def test_dropped_table(self):
+        previous = get_manifest(self.output_db)
+
+        self.output_db.execute('DROP TABLE company')
+
+        manifest = get_manifest(self.output_db, previous=previous)
+
+        self.assertEqual(manifest['changed_tables'], ['company'])
+
+    def test_other_tables(self):
+        previous = get_manifest(self.output_db)
+
+        self.output_db.execute('CREATE TABLE search (name TEXT)')
+
+        manifest = get_manifest(self.output_db, previous=previous)
+
+        self.assertEqual(manifest['other_tables'], ['search'])
+        self.assertEqual(manifest['digest'], previous['digest'])
+        self.assertFalse(is_unchanged(manifest, previous))
+
+
+class TestReadAndWriteManifest(DBTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.path = join(self.tmp_dir, 'msd.sqlite.manifest.json')
+
+    def test_round_trip(self):
+        manifest = get_manifest(self.output_db)
+
+        write_manifest(manifest, self.path)
+
+        self.assertFalse(exists(self.path + '.tmp'))
+        self.assertEqual(read_manifest(self.path), manifest)
+
+    def test_missing(self):
+        self.assertIsNone(read_manifest(self.path))
+
+    def test_other_version(self):
+        with open(self.path, 'w') as f:
+            json.dump(dict(version=0), f)
+
+        self.assertIsNone(read_manifest(self.path))
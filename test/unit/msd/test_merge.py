@@ -15,8 +15,11 @@ from unittest.mock import patch
 
 from msd.table import TABLES
 from msd.merge import clean_output_row
+from msd.merge import select_merged_rows
 
 from ...case import PatchTestCase
+from ...db import DBTestCase
+from ...db import insert_rows
 
 
 class TestCleanOutputRow(PatchTestCase):
@@ -69,3 +72,23 @@ class TestCleanOutputRow(PatchTestCase):
         self.assertEqual(
             clean_output_row(dict(namespace='metasyntactic'), 'foo'),
             dict(namespace='metasyntactic'))
+
+
+class TestSelectMergedRows(DBTestCase):
+
+    SCRATCH_TABLES = ['scraper']
+
+    def test_merge(self):
+        insert_rows(self.scratch_db, 'scraper', [
+            dict(scraper_id='sr.company', last_scraped=''),
+            dict(scraper_id='sr.campaign', last_scraped=None),
+            dict(scraper_id='sr.company', last_scraped='2015-09-18'),
+            dict(scraper_id='sr.campaign', last_scraped='2015-09-19'),
+            dict(scraper_id='sr.company', last_scraped='2015-09-20'),
+        ])
+
+        self.assertEqual(
+            list(select_merged_rows(self.scratch_db, 'scraper',
+                                    ['scraper_id'])),
+            [dict(scraper_id='sr.campaign', last_scraped='2015-09-19'),
+             dict(scraper_id='sr.company', last_scraped='2015-09-18')])
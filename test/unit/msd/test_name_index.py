@@ -0,0 +1,111 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from os.path import exists
+from os.path import join
+
+from msd.name_index import IndexedTarget
+from msd.name_index import JudgmentCounts
+from msd.name_index import NameIndex
+from msd.name_index import write_name_index
+
+from ...db import DBTestCase
+from ...db import insert_rows
+
+NO_JUDGMENTS = JudgmentCounts(0, 0, 0)
+
+
+class TestNameIndex(DBTestCase):
+
+    OUTPUT_TABLES = ['brand', 'claim', 'company_name', 'rating']
+
+    def setUp(self):
+        super().setUp()
+
+        self.path = join(self.tmp_dir, 'msd-names.bin')
+
+    def write_and_open(self, **kwargs):
+        write_name_index(self.output_db, self.path, **kwargs)
+        name_index = NameIndex(self.path)
+        self.addCleanup(name_index.close)
+        return name_index
+
+    def test_empty(self):
+        name_index = self.write_and_open()
+
+        self.assertEqual(name_index.num_names, 0)
+        self.assertEqual(name_index.lookup('Foo'), [])
+        self.assertFalse(exists(self.path + '.tmp'))
+
+    def test_lookup(self):
+        insert_rows(self.output_db, 'company_name', [
+            dict(company='Kraft', company_name='Kraft'),
+            dict(company='Kraft', company_name='Kraft Foods'),
+        ])
+        insert_rows(self.output_db, 'brand', [
+            dict(company='Kraft', brand='Oscar Mayer'),
+            # same name as a company
+            dict(company='Mondelēz', brand='Kraft'),
+        ])
+        insert_rows(self.output_db, 'rating', [
+            dict(campaign_id='a', company='Kraft', brand='', judgment=1),
+            dict(campaign_id='b', company='Kraft', brand='', judgment=-1),
+            dict(campaign_id='a', company='Kraft', brand='Oscar Mayer',
+                 judgment=0),
+        ])
+        insert_rows(self.output_db, 'claim', [
+            dict(campaign_id='a', company='Kraft', brand='Oscar Mayer',
+                 claim='x', judgment=-1),
+        ])
+
+        name_index = self.write_and_open()
+
+        self.assertEqual(
+            name_index.lookup('KRAFT'),
+            [IndexedTarget('Kraft', '', JudgmentCounts(1, 0, 1),
+                           NO_JUDGMENTS),
+             IndexedTarget('Mondelēz', 'Kraft', NO_JUDGMENTS,
+                           NO_JUDGMENTS)])
+        self.assertEqual(
+            name_index.lookup('Oscar Mayer®'),
+            [IndexedTarget('Kraft', 'Oscar Mayer', JudgmentCounts(0, 1, 0),
+                           JudgmentCounts(0, 0, 1))])
+        self.assertEqual(name_index.lookup('kraft foods')[0].company,
+                         'Kraft')
+        self.assertEqual(name_index.lookup('Nestle'), [])
+        self.assertEqual(name_index.lookup(''), [])
+
+    def test_many_blocks(self):
+        insert_rows(self.output_db, 'brand', [
+            dict(company='Acme', brand='Brand {:03d}'.format(i))
+            for i in range(100)])
+
+        name_index = self.write_and_open(block_size=4)
+
+        self.assertEqual(name_index.num_blocks, 25)
+
+        for i in range(100):
+            brand = 'Brand {:03d}'.format(i)
+            self.assertEqual(
+                [t.brand for t in name_index.lookup(brand)], [brand])
+
+        # before, after, and between names
+        self.assertEqual(name_index.lookup('Aardvark'), [])
+        self.assertEqual(name_index.lookup('Zebra'), [])
+        self.assertEqual(name_index.lookup('Brand 0505'), [])
+
+    def test_not_a_name_index(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * 100)
+
+        self.assertRaises(ValueError, NameIndex, self.path)
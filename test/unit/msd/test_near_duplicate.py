@@ -0,0 +1,145 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from unittest import TestCase
+from unittest.mock import patch
+
+from msd.near_duplicate import build_near_duplicate_table
+from msd.near_duplicate import find_near_duplicates
+from msd.near_duplicate import get_ngrams
+from msd.near_duplicate import jaccard
+
+from ...case import PatchTestCase
+from ...db import DBTestCase
+from ...db import insert_rows
+from ...db import select_all
+
+
+class TestGetNgrams(TestCase):
+
+    def test_ngrams(self):
+        self.assertEqual(get_ngrams('modelo'), {'mo', 'od', 'de', 'el', 'lo'})
+
+    def test_short(self):
+        self.assertEqual(get_ngrams('g'), {'g'})
+
+
+class TestJaccard(TestCase):
+
+    def test_jaccard(self):
+        self.assertEqual(jaccard({1, 2, 3}, {2, 3, 4}), 0.5)
+
+    def test_empty(self):
+        self.assertEqual(jaccard(set(), set()), 0.0)
+
+
+class TestFindNearDuplicates(PatchTestCase):
+
+    def test_empty(self):
+        self.assertEqual(list(find_near_duplicates([])), [])
+
+    def test_near_duplicate(self):
+        results = list(find_near_duplicates(
+            ['Groupo Modelo', 'Grupo Modelo', 'Kraft', 'Unilever']))
+
+        self.assertEqual(len(results), 1)
+        name, similar_name, similarity = results[0]
+        self.assertEqual((name, similar_name),
+                         ('Groupo Modelo', 'Grupo Modelo'))
+        self.assertGreaterEqual(similarity, 0.6)
+
+    def test_same_after_smunch(self):
+        self.assertEqual(
+            list(find_near_duplicates(['Coca Cola', 'Coca-Cola'])),
+            [('Coca Cola', 'Coca-Cola', 1.0)])
+
+    def test_ignore_short_names(self):
+        self.assertEqual(list(find_near_duplicates(['GE', 'G.E.'])), [])
+
+    def test_unrelated(self):
+        self.assertEqual(
+            list(find_near_duplicates(
+                ['Nestle', 'Nestlé Waters', 'Procter & Gamble'])), [])
+
+    def test_split_oversized_buckets(self):
+        self.start(patch('msd.near_duplicate.MAX_BUCKET_SIZE', 2))
+
+        skipped = set()
+        results = list(find_near_duplicates(
+            ['Grupo Modelo', 'Groupo Modelo', 'Grupo Modela',
+             'Grupo Modelos'], skipped=skipped))
+
+        self.assertIn('Grupo Modelos', [
+            similar_name for name, similar_name, _ in results
+            if name == 'Grupo Modelo'])
+        self.assertEqual(skipped, set())
+
+    def test_skip_buckets_that_cant_be_split(self):
+        self.start(patch('msd.near_duplicate.MAX_BUCKET_SIZE', 2))
+
+        # same n-grams, so same signature
+        skipped = set()
+        results = list(find_near_duplicates(
+            ['Coca Cola', 'Coca-Cola', 'CocaCola', 'Kraft'],
+            skipped=skipped))
+
+        self.assertEqual(results, [])
+        self.assertEqual(skipped, {'Coca Cola', 'Coca-Cola', 'CocaCola'})
+
+
+class TestBuildNearDuplicateTable(DBTestCase, PatchTestCase):
+
+    OUTPUT_TABLES = ['brand', 'company']
+
+    def test_companies_and_brands(self):
+        insert_rows(self.output_db, 'company', [
+            dict(company='Groupo Modelo'),
+            dict(company='Grupo Modelo'),
+            dict(company='Kraft'),
+        ])
+        insert_rows(self.output_db, 'brand', [
+            dict(company='Kraft', brand='Oscar Mayer'),
+            dict(company='Kraft', brand='Oscar Meyer'),
+            # different companies, so not near-duplicates
+            dict(company='Grupo Modelo', brand='Corona Extra'),
+            dict(company='Kraft', brand='Corona Xtra'),
+        ])
+
+        stats = build_near_duplicate_table(self.output_db, self.scratch_db)
+
+        self.assertEqual(stats, dict(near_duplicates=2, skipped_names=0))
+
+        rows = select_all(self.output_db, 'near_duplicate')
+        for row in rows:
+            self.assertGreaterEqual(row.pop('similarity'), 0.6)
+
+        self.assertEqual(
+            sorted(rows, key=lambda r: (r['kind'], r['company'])),
+            [dict(kind='brand', company='Kraft',
+                  name='Oscar Mayer', similar_name='Oscar Meyer'),
+             dict(kind='company', company='',
+                  name='Groupo Modelo', similar_name='Grupo Modelo')])
+
+    def test_count_skipped_names(self):
+        self.start(patch('msd.near_duplicate.MAX_BUCKET_SIZE', 2))
+
+        insert_rows(self.output_db, 'company', [
+            dict(company='Coca Cola'),
+            dict(company='Coca-Cola'),
+            dict(company='CocaCola'),
+        ])
+
+        stats = build_near_duplicate_table(self.output_db, self.scratch_db)
+
+        self.assertEqual(stats, dict(near_duplicates=0, skipped_names=3))
+        self.assertEqual(select_all(self.output_db, 'near_duplicate'), [])
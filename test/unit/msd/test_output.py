@@ -0,0 +1,333 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from os import remove
+from os.path import exists
+from os.path import getmtime
+from os.path import getsize
+from os.path import join
+from shutil import copyfile
+
+from msd.db import insert_row
+from msd.db import open_db
+from msd.db import show_tables
+from msd.delta import apply_delta
+from msd.digest import db_digest
+from msd.manifest import get_manifest_path
+from msd.manifest import read_manifest
+from msd.name_index import NameIndex
+from msd.output import build_output_db
+from msd.output import output_table_names
+from msd.subset import OutputSpec
+from msd.scratch import create_scratch_tables
+
+from ...db import DBTestCase
+from ...db import select_all
+from ...db import strip_null
+
+
+class TestBuildOutputDB(DBTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.scratch_db_path = join(self.tmp_dir, 'msd-scratch.sqlite')
+        self.output_db_path = join(self.tmp_dir, 'msd.sqlite')
+
+        with open_db(self.scratch_db_path) as scratch_db:
+            create_scratch_tables(scratch_db)
+
+            insert_row(scratch_db, 'campaign', dict(
+                scraper_id='sr.campaign.qux',
+                campaign_id='qux',
+                campaign='Quxing for Quality'))
+
+    def assert_output_db_is_correct(self):
+        self.assertFalse(exists(self.output_db_path + '.tmp'))
+
+        output_db = open_db(self.output_db_path)
+
+        self.assertEqual(
+            show_tables(output_db), output_table_names())
+
+        self.assertEqual(
+            [strip_null(row) for row in select_all(output_db, 'campaign')],
+            [dict(campaign_id='qux', campaign='Quxing for Quality')])
+
+    def test_build_in_memory(self):
+        build_output_db(self.scratch_db_path, self.output_db_path)
+
+        self.assert_output_db_is_correct()
+
+    def test_build_on_disk(self):
+        build_output_db(self.scratch_db_path, self.output_db_path,
+                        max_in_memory_size=0)
+
+        self.assert_output_db_is_correct()
+
+    def test_too_big_for_memory(self):
+        build_output_db(self.scratch_db_path, self.output_db_path,
+                        max_in_memory_size=1)
+
+        self.assert_output_db_is_correct()
+
+    def test_open_scratch_db(self):
+        scratch_db = open_db(self.scratch_db_path, readonly=True)
+        self.addCleanup(scratch_db.close)
+
+        build_output_db(scratch_db, self.output_db_path)
+
+        self.assert_output_db_is_correct()
+
+        # closing it is up to us
+        scratch_db.execute('SELECT 1')
+
+    def test_without_rowid(self):
+        build_output_db(self.scratch_db_path, self.output_db_path,
+                        without_rowid=True)
+
+        self.assert_output_db_is_correct()
+        self.assert_tables_are_without_rowid()
+
+    def test_without_rowid_on_disk(self):
+        build_output_db(self.scratch_db_path, self.output_db_path,
+                        max_in_memory_size=0, without_rowid=True)
+
+        self.assertFalse(exists(self.output_db_path + '.build.tmp'))
+        self.assert_output_db_is_correct()
+        self.assert_tables_are_without_rowid()
+
+    def test_search(self):
+        build_output_db(self.scratch_db_path, self.output_db_path,
+                        search=True, without_rowid=True)
+
+        output_db = open_db(self.output_db_path)
+        self.assertIn('search', show_tables(output_db))
+        self.assertEqual(
+            [strip_null(row) for row in select_all(output_db, 'campaign')],
+            [dict(campaign_id='qux', campaign='Quxing for Quality')])
+
+    def test_name_index(self):
+        name_index_path = join(self.tmp_dir, 'msd-names.bin')
+
+        build_output_db(self.scratch_db_path, self.output_db_path,
+                        name_index_path=name_index_path)
+
+        with NameIndex(name_index_path) as name_index:
+            self.assertEqual(name_index.num_names, 0)
+
+        self.assert_output_db_is_correct()
+
+    def test_target_summary(self):
+        build_output_db(self.scratch_db_path, self.output_db_path,
+                        target_summary=True)
+
+        output_db = open_db(self.output_db_path)
+        self.assertEqual(
+            show_tables(output_db),
+            output_table_names(optional={'target_summary'}))
+
+    def test_near_duplicates(self):
+        stats = build_output_db(self.scratch_db_path, self.output_db_path,
+                                near_duplicates=True)
+
+        self.assertEqual(stats['near_duplicate'],
+                         dict(near_duplicates=0, skipped_names=0))
+
+        output_db = open_db(self.output_db_path)
+        self.assertEqual(
+            show_tables(output_db),
+            output_table_names(optional={'near_duplicate'}))
+
+    def test_delta(self):
+        delta_path = join(self.tmp_dir, 'msd.delta.json.gz')
+
+        # no previous DB to diff against
+        stats = build_output_db(self.scratch_db_path, self.output_db_path,
+                                delta_path=delta_path)
+        self.assertNotIn('delta', stats)
+        self.assertFalse(exists(delta_path))
+
+        mirror_db_path = join(self.tmp_dir, 'mirror.sqlite')
+        copyfile(self.output_db_path, mirror_db_path)
+
+        with open_db(self.scratch_db_path) as scratch_db:
+            insert_row(scratch_db, 'campaign', dict(
+                scraper_id='sr.campaign.foo',
+                campaign_id='foo',
+                campaign='Fooing for Fairness'))
+
+        stats = build_output_db(self.scratch_db_path, self.output_db_path,
+                                delta_path=delta_path, without_rowid=True)
+        self.assertEqual(stats['delta']['inserted'], 1)
+
+        apply_delta(mirror_db_path, delta_path)
+
+        self.assertEqual(db_digest(open_db(mirror_db_path)),
+                         db_digest(open_db(self.output_db_path)))
+
+    def test_manifest(self):
+        stats = build_output_db(self.scratch_db_path, self.output_db_path)
+
+        self.assertTrue(stats['published'])
+        self.assertEqual(stats['changed_tables'], output_table_names())
+
+        manifest = read_manifest(get_manifest_path(self.output_db_path))
+        self.assertEqual(manifest['changed_tables'], output_table_names())
+        self.assertEqual(manifest['digest'],
+                         db_digest(open_db(self.output_db_path)))
+
+    def test_skip_publishing_unchanged_db(self):
+        delta_path = join(self.tmp_dir, 'msd.delta.json.gz')
+
+        build_output_db(self.scratch_db_path, self.output_db_path)
+        mtime = getmtime(self.output_db_path)
+
+        # layout changes don't count
+        stats = build_output_db(self.scratch_db_path, self.output_db_path,
+                                delta_path=delta_path, without_rowid=True)
+
+        self.assertFalse(stats['published'])
+        self.assertEqual(stats['changed_tables'], [])
+        self.assertEqual(getmtime(self.output_db_path), mtime)
+        self.assertFalse(exists(self.output_db_path + '.tmp'))
+        self.assertFalse(exists(delta_path))
+
+    def test_only_write_name_index_when_published(self):
+        name_index_path = join(self.tmp_dir, 'msd-names.bin')
+
+        build_output_db(self.scratch_db_path, self.output_db_path,
+                        name_index_path=name_index_path)
+        mtime = getmtime(name_index_path)
+
+        stats = build_output_db(self.scratch_db_path, self.output_db_path,
+                                name_index_path=name_index_path)
+
+        self.assertFalse(stats['published'])
+        self.assertEqual(getmtime(name_index_path), mtime)
+
+        # but do write it if it's missing
+        remove(name_index_path)
+        build_output_db(self.scratch_db_path, self.output_db_path,
+                        name_index_path=name_index_path)
+
+        self.assertTrue(exists(name_index_path))
+
+    def test_publish_changed_db(self):
+        build_output_db(self.scratch_db_path, self.output_db_path)
+        previous_manifest = read_manifest(
+            get_manifest_path(self.output_db_path))
+
+        with open_db(self.scratch_db_path) as scratch_db:
+            insert_row(scratch_db, 'campaign', dict(
+                scraper_id='sr.campaign.foo',
+                campaign_id='foo',
+                campaign='Fooing for Fairness'))
+
+        stats = build_output_db(self.scratch_db_path, self.output_db_path)
+
+        self.assertTrue(stats['published'])
+        self.assertEqual(stats['changed_tables'], ['campaign'])
+
+        manifest = read_manifest(get_manifest_path(self.output_db_path))
+        self.assertEqual(manifest['changed_tables'], ['campaign'])
+        self.assertEqual(manifest['previous_digest'],
+                         previous_manifest['digest'])
+
+    def test_publish_if_output_db_is_missing(self):
+        build_output_db(self.scratch_db_path, self.output_db_path)
+        remove(self.output_db_path)
+
+        stats = build_output_db(self.scratch_db_path, self.output_db_path)
+
+        self.assertTrue(stats['published'])
+        self.assert_output_db_is_correct()
+
+    def test_subsets(self):
+        with open_db(self.scratch_db_path) as scratch_db:
+            insert_row(scratch_db, 'campaign', dict(
+                scraper_id='sr.campaign.foo',
+                campaign_id='foo',
+                campaign='Fooing for Fairness'))
+
+        foo_db_path = join(self.tmp_dir, 'msd-foo.sqlite')
+        campaign_db_path = join(self.tmp_dir, 'msd-campaign.sqlite')
+
+        stats = build_output_db(
+            self.scratch_db_path, self.output_db_path,
+            subsets=[
+                OutputSpec(foo_db_path, campaign_ids=['foo']),
+                OutputSpec(campaign_db_path, tables=['campaign']),
+            ],
+            without_rowid=True)
+
+        self.assertEqual(len(stats['subsets']), 2)
+        self.assertTrue(all(s['published'] for s in stats['subsets']))
+
+        foo_db = open_db(foo_db_path)
+        self.assertEqual(show_tables(foo_db), output_table_names())
+        self.assertEqual(
+            [row['campaign_id'] for row in select_all(foo_db, 'campaign')],
+            ['foo'])
+        self.assertTrue(exists(get_manifest_path(foo_db_path)))
+
+        campaign_db = open_db(campaign_db_path)
+        self.assertEqual(show_tables(campaign_db), ['campaign'])
+        self.assertEqual(
+            len(select_all(campaign_db, 'campaign')), 2)
+
+        for path in (foo_db_path, campaign_db_path):
+            self.assertFalse(exists(path + '.tmp'))
+            self.assertFalse(exists(path + '.build.tmp'))
+
+    def test_no_search_by_default(self):
+        build_output_db(self.scratch_db_path, self.output_db_path)
+
+        output_db = open_db(self.output_db_path)
+        self.assertNotIn('search', show_tables(output_db))
+
+    def assert_tables_are_without_rowid(self):
+        output_db = open_db(self.output_db_path)
+
+        for table_name in show_tables(output_db):
+            sql = output_db.execute(
+                'SELECT sql FROM sqlite_master WHERE name = ?',
+                [table_name]).fetchone()[0]
+            self.assertTrue(sql.endswith(' WITHOUT ROWID'), table_name)
+
+    def test_analyze(self):
+        build_output_db(self.scratch_db_path, self.output_db_path)
+
+        output_db = open_db(self.output_db_path)
+        self.assertEqual(
+            output_db.execute(
+                "SELECT COUNT(*) FROM sqlite_master"
+                " WHERE name = 'sqlite_stat1'").fetchone()[0],
+            1)
+
+    def test_stats(self):
+        stats = build_output_db(self.scratch_db_path, self.output_db_path)
+
+        self.assertEqual(stats['size'], getsize(self.output_db_path))
+        self.assertIn('unfinalized_size', stats)
+
+    def test_vacuum_with_page_size(self):
+        stats = build_output_db(self.scratch_db_path, self.output_db_path,
+                                page_size=1024, vacuum=True)
+
+        output_db = open_db(self.output_db_path)
+        self.assertEqual(
+            output_db.execute('PRAGMA page_size').fetchone()[0], 1024)
+        self.assertEqual(stats['size'], getsize(self.output_db_path))
+
+        self.assert_output_db_is_correct()
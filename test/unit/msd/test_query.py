@@ -0,0 +1,126 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from os.path import join
+
+from msd.output import save_output_db
+from msd.query import Query
+
+from ...db import DBTestCase
+from ...db import insert_rows
+
+
+class TestQuery(DBTestCase):
+
+    OUTPUT_TABLES = ['brand', 'category', 'claim', 'company_name', 'rating']
+
+    def setUp(self):
+        super().setUp()
+
+        insert_rows(self.output_db, 'company_name', [
+            dict(company='Kraft', company_name='Kraft'),
+            dict(company='Kraft', company_name='Kraft Foods, Inc.',
+                 is_full=1),
+            dict(company='Unilever', company_name='Unilever'),
+        ])
+        insert_rows(self.output_db, 'brand', [
+            dict(company='Kraft', brand='Oscar Mayer'),
+            dict(company='Unilever', brand='Dove'),
+        ])
+        insert_rows(self.output_db, 'category', [
+            dict(company='Kraft', brand='Oscar Mayer', category='Meat'),
+            dict(company='Kraft', brand='', category='Food'),
+        ])
+        insert_rows(self.output_db, 'rating', [
+            dict(campaign_id='c', company='Kraft', brand='', judgment=0),
+            dict(campaign_id='c', company='Kraft', brand='Oscar Mayer',
+                 judgment=-1),
+            dict(campaign_id='c', company='Unilever', brand='',
+                 judgment=1),
+        ])
+        insert_rows(self.output_db, 'claim', [
+            dict(campaign_id='c', company='Kraft', brand='Oscar Mayer',
+                 claim='Sells hot dogs', judgment=0),
+        ])
+
+        self.query = Query(self.output_db)
+
+    def test_resolve_company(self):
+        self.assertEqual(self.query.resolve_company('Kraft'), 'Kraft')
+        self.assertEqual(self.query.resolve_company('KRAFT FOODS INC'),
+                         'Kraft')
+        self.assertEqual(self.query.resolve_company('Kraft, Inc.'), 'Kraft')
+        self.assertEqual(self.query.resolve_company('Nestle'), None)
+        self.assertEqual(self.query.resolve_company(''), None)
+
+    def test_resolve_brand(self):
+        self.assertEqual(self.query.resolve_targets('OSCAR MAYER®'),
+                         [('Kraft', 'Oscar Mayer')])
+
+    def test_resolve_brand_by_company(self):
+        self.assertEqual(
+            self.query.resolve_targets('Oscar Mayer', company='Kraft Inc'),
+            [('Kraft', 'Oscar Mayer')])
+        self.assertEqual(
+            self.query.resolve_targets('Oscar Mayer', company='Unilever'),
+            [('Unilever', '')])
+        self.assertEqual(
+            self.query.resolve_targets('Oscar Mayer', company='Nestle'), [])
+
+    def test_unknown(self):
+        self.assertEqual(self.query.lookup('Acme Widgets'), ())
+
+    def test_lookup_brand(self):
+        (info,) = self.query.lookup('Oscar Mayer')
+
+        self.assertEqual((info.company, info.brand),
+                         ('Kraft', 'Oscar Mayer'))
+        self.assertEqual(info.categories, ('Meat',))
+        # includes company-wide ratings
+        self.assertEqual([(r['brand'], r['judgment']) for r in info.ratings],
+                         [('Oscar Mayer', -1), ('', 0)])
+        self.assertEqual([c['claim'] for c in info.claims],
+                         ['Sells hot dogs'])
+
+    def test_lookup_company(self):
+        (info,) = self.query.lookup('Unilever')
+
+        self.assertEqual((info.company, info.brand), ('Unilever', ''))
+        self.assertEqual([r['judgment'] for r in info.ratings], [1])
+        self.assertEqual(info.claims, ())
+
+    def test_cached(self):
+        self.assertIs(self.query.lookup('Oscar Mayer'),
+                      self.query.lookup('Oscar Mayer'))
+
+        self.query.clear_cache()
+        self.assertEqual(self.query.lookup.cache_info().currsize, 0)
+
+    def test_no_cache(self):
+        query = Query(self.output_db, cache_size=0)
+
+        self.assertIsNot(query.lookup('Oscar Mayer'),
+                         query.lookup('Oscar Mayer'))
+        self.assertEqual(query.lookup('Oscar Mayer'),
+                         self.query.lookup('Oscar Mayer'))
+
+    def test_open_path(self):
+        path = join(self.tmp_dir, 'msd.sqlite')
+        self.output_db.commit()
+        save_output_db(self.output_db, path)
+
+        query = Query(path)
+        self.addCleanup(query.close)
+
+        self.assertEqual(query.lookup('Oscar Mayer'),
+                         self.query.lookup('Oscar Mayer'))
@@ -14,11 +14,17 @@
 # limitations under the License.
 from unittest import TestCase
 
+from msd.db import create_table
 from msd.db import insert_row
+from msd.db import open_db
 from msd.rating import build_rating_table
 from msd.rating import grade_to_judgment
+from msd.rating import merge_rating_group
+from msd.rating import normalize_rating_scores
+from msd.scratch import dump_table_to_scratch
 
 from ...db import DBTestCase
+from ...db import insert_rows
 from ...db import select_all
 from ...db import strip_null
 
@@ -81,6 +87,36 @@ class TestBuildRatingTable(DBTestCase):
                   scope='',
                   judgment=-1)])
 
+    def test_ignore_input_normalized_score(self):
+        # normalized_score and percentile are output-only; a scraper
+        # can't supply them, even for ratings we can't normalize
+        input_db = open_db(':memory:')
+        create_table(input_db, 'rating', dict(
+            scraper_id='text', campaign_id='text', company='text',
+            brand='text', judgment='integer', normalized_score='real',
+            percentile='real'))
+        insert_row(input_db, 'rating', dict(
+            scraper_id='qux',
+            campaign_id='qux',
+            company='Foo & Co.',
+            brand='',
+            judgment=1,
+            normalized_score=0.99,
+            percentile=0.5))
+
+        dump_table_to_scratch(input_db, 'rating', self.scratch_db,
+                              'sr.campaign')
+
+        build_rating_table(self.output_db, self.scratch_db)
+
+        self.assertEqual(
+            [strip_null(row) for row in select_all(self.output_db, 'rating')],
+            [dict(campaign_id='qux',
+                  company='Foo',
+                  brand='',
+                  scope='',
+                  judgment=1)])
+
     def test_discard_null_judgment(self):
         # this tests issue #22
         insert_row(self.scratch_db, 'rating', dict(
@@ -176,6 +212,116 @@ class TestBuildRatingTable(DBTestCase):
                   scope='',
                   judgment=1)])
 
+    def test_skip_missing_campaign_id(self):
+        insert_row(self.scratch_db, 'rating', dict(
+            scraper_id='sr.campaign.qux',
+            company='Foo & Co.',
+            brand='',
+            judgment=1))
+
+        build_rating_table(self.output_db, self.scratch_db)
+
+        self.assertEqual(select_all(self.output_db, 'rating'), [])
+
+
+class TestNormalizeRatingScores(DBTestCase):
+
+    OUTPUT_TABLES = ['rating']
+
+    def normalize(self):
+        normalize_rating_scores(self.output_db)
+
+        return {(row['campaign_id'], row['company']):
+                (row['normalized_score'], row['percentile'])
+                for row in select_all(self.output_db, 'rating')}
+
+    def test_empty(self):
+        self.assertEqual(self.normalize(), {})
+
+    def test_min_and_max_score(self):
+        insert_rows(self.output_db, 'rating', [
+            dict(campaign_id='a', company='Foo', brand='', judgment=1,
+                 score=90, min_score=0, max_score=100),
+            dict(campaign_id='a', company='Bar', brand='', judgment=0,
+                 score=50, min_score=0, max_score=100),
+            dict(campaign_id='a', company='Baz', brand='', judgment=-1,
+                 score=10, min_score=0, max_score=100),
+            # different scale, different campaign
+            dict(campaign_id='b', company='Foo', brand='', judgment=1,
+                 score=4, min_score=1, max_score=5),
+            dict(campaign_id='b', company='Bar', brand='', judgment=-1,
+                 score=2, min_score=1, max_score=5),
+        ])
+
+        self.assertEqual(self.normalize(), {
+            ('a', 'Foo'): (0.9, 1.0),
+            ('a', 'Bar'): (0.5, 0.5),
+            ('a', 'Baz'): (0.1, 0.0),
+            ('b', 'Foo'): (0.75, 1.0),
+            ('b', 'Bar'): (0.25, 0.0),
+        })
+
+    def test_campaign_max(self):
+        insert_rows(self.output_db, 'rating', [
+            dict(campaign_id='a', company='Foo', brand='', judgment=1,
+                 score=40, min_score=0),
+            dict(campaign_id='a', company='Bar', brand='', judgment=0,
+                 score=20, min_score=0),
+            dict(campaign_id='a', company='Baz', brand='', judgment=-1,
+                 score=10, min_score=0),
+        ])
+
+        self.assertEqual(self.normalize(), {
+            ('a', 'Foo'): (1.0, 1.0),
+            ('a', 'Bar'): (0.5, 0.5),
+            ('a', 'Baz'): (0.25, 0.0),
+        })
+
+    def test_clamp(self):
+        insert_rows(self.output_db, 'rating', [
+            dict(campaign_id='a', company='Foo', brand='', judgment=1,
+                 score=110, min_score=0, max_score=100),
+        ])
+
+        self.assertEqual(self.normalize(), {('a', 'Foo'): (1.0, 0.0)})
+
+    def test_rank(self):
+        insert_rows(self.output_db, 'rating', [
+            dict(campaign_id='a', company='Foo', brand='', judgment=1,
+                 rank=1, num_ranked=5),
+            dict(campaign_id='a', company='Bar', brand='', judgment=-1,
+                 rank=5, num_ranked=5),
+        ])
+
+        self.assertEqual(self.normalize(), {
+            ('a', 'Foo'): (1.0, 1.0),
+            ('a', 'Bar'): (0.0, 0.0),
+        })
+
+    def test_no_score_or_rank(self):
+        insert_rows(self.output_db, 'rating', [
+            dict(campaign_id='a', company='Foo', brand='', judgment=1,
+                 score=50, min_score=0, max_score=100),
+            dict(campaign_id='a', company='Bar', brand='', judgment=1),
+            # can't normalize a score without a min_score (in practice,
+            # merge_rating_group() always fills it)
+            dict(campaign_id='b', company='Foo', brand='', judgment=1,
+                 score=50),
+        ])
+
+        self.assertEqual(self.normalize(), {
+            ('a', 'Foo'): (0.5, 0.0),
+            ('a', 'Bar'): (None, None),
+            ('b', 'Foo'): (None, None),
+        })
+
+
+class TestMergeRatingGroup(TestCase):
+
+    def test_missing_campaign_id(self):
+        self.assertIsNone(merge_rating_group(
+            ('Foo', ''), (None,), [dict(judgment=1)]))
+
 
 class TestGradeToJudgment(TestCase):
 
@@ -0,0 +1,108 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import sqlite3
+from unittest import TestCase
+from unittest.mock import patch
+
+from msd.merge import merge_dicts
+from msd.merge import output_row
+from msd.schema import get_table_schema
+from msd.schema import merge_scalar_rows
+from msd.table import TABLES
+
+from ...case import PatchTestCase
+from ...db import DBTestCase
+from ...db import select_all
+
+
+class TestGetTableSchema(PatchTestCase):
+
+    def setUp(self):
+        self.start(patch.dict(TABLES, foo=dict(
+            columns=dict(foo='text', is_bar='tinyint'),
+            primary_key=['foo'])))
+
+    def test_cols_and_insert_sql(self):
+        schema = get_table_schema('foo')
+
+        self.assertEqual(schema.cols, ['foo', 'is_bar'])
+        self.assertEqual(
+            schema.insert_sql,
+            'INSERT INTO `foo` (`foo`, `is_bar`) VALUES (?, ?)')
+
+    def test_cached(self):
+        self.assertIs(get_table_schema('foo'), get_table_schema('foo'))
+
+    def test_recompile_when_table_def_replaced(self):
+        schema = get_table_schema('foo')
+
+        TABLES['foo'] = dict(columns=dict(foo='text', baz='text'))
+
+        self.assertIsNot(get_table_schema('foo'), schema)
+        self.assertEqual(get_table_schema('foo').cols, ['baz', 'foo'])
+
+    def test_encode(self):
+        encode = get_table_schema('foo').encode
+
+        self.assertEqual(encode(dict(is_bar=1)), (None, 1))
+        self.assertEqual(encode(dict(foo='x', is_bar=0)), ('x', 0))
+        # extra columns
+        self.assertIsNone(encode(dict(foo='x', qux='y')))
+
+
+class TestMergeScalarRows(TestCase):
+
+    def assert_same_as_merge_dicts(self, rows):
+        self.assertEqual(merge_scalar_rows(rows), merge_dicts(rows))
+
+    def test_empty(self):
+        self.assert_same_as_merge_dicts([])
+
+    def test_first_non_null_wins(self):
+        self.assert_same_as_merge_dicts([
+            dict(a=None, b='x'), dict(a='y', b='z'), dict(a='w', c=3)])
+
+    def test_empty_string_replaced(self):
+        self.assert_same_as_merge_dicts([dict(a=''), dict(a='x')])
+
+    def test_empty_string_then_null(self):
+        # merge_dicts() lets None replace '', so we do too
+        self.assertEqual(merge_scalar_rows([dict(a=''), dict(a=None)]),
+                         dict(a=None))
+        self.assert_same_as_merge_dicts([dict(a=''), dict(a=None)])
+
+    def test_zero_not_replaced(self):
+        self.assert_same_as_merge_dicts([dict(a=0), dict(a=1)])
+
+
+class TestOutputRow(DBTestCase):
+
+    OUTPUT_TABLES = ['scraper_company_map']
+
+    def test_output_row(self):
+        output_row(self.output_db, 'scraper_company_map', dict(
+            company='Nestle', scraper_id='sr.company',
+            scraper_company='Nestle S.A.'))
+
+        self.assertEqual(
+            select_all(self.output_db, 'scraper_company_map'),
+            [dict(company='Nestle', scraper_id='sr.company',
+                  scraper_company='Nestle S.A.')])
+
+    def test_extra_columns(self):
+        # falls back to insert_row(), so the database complains
+        self.assertRaises(
+            sqlite3.OperationalError,
+            output_row, self.output_db, 'scraper_company_map',
+            dict(company='Nestle', foo='bar'))
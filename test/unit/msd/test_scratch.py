@@ -0,0 +1,368 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from os import utime
+from os.path import exists
+from os.path import getmtime
+from os.path import join
+from unittest.mock import patch
+
+from msd.db import create_table
+from msd.db import insert_row
+from msd.db import open_db
+from msd.db import show_tables
+from msd.scratch import SCRATCH_SCHEMA_VERSION
+from msd.scratch import build_scratch_db
+from msd.scratch import build_scratch_db_in_memory
+from msd.scratch import dump_table_to_scratch
+from msd.scratch import fill_key_tables
+from msd.scratch import get_scratch_key_version
+from msd.scratch import get_scratch_schema_version
+from msd.scratch import scratch_table_names
+from msd.scratch import select_catalog
+from msd.scratch import select_brand_keys
+from msd.scratch import select_company_keys
+
+from ...db import DBTestCase
+from ...db import insert_rows
+from ...db import select_all
+from ...db import strip_null
+
+
+class TestCreateScratchTable(DBTestCase):
+
+    SCRATCH_TABLES = ['brand', 'claim']
+
+    def test_insert_and_select(self):
+        insert_row(self.scratch_db, 'brand', dict(
+            brand='Sprite',
+            company='The Coca-Cola Company',
+            scraper_id='sr.company',
+            url='http://www.sprite.com/'))
+
+        self.assertEqual(
+            [strip_null(row) for row in select_all(self.scratch_db, 'brand')],
+            [dict(brand='Sprite',
+                  company='The Coca-Cola Company',
+                  scraper_id='sr.company',
+                  url='http://www.sprite.com/')])
+
+    def test_null_and_empty_values(self):
+        insert_rows(self.scratch_db, 'brand', [
+            dict(brand='', company='The Coca-Cola Company'),
+            dict(brand=None, company='The Coca-Cola Company'),
+        ])
+
+        self.assertEqual(
+            sorted(row['brand'] for row in
+                   self.scratch_db.execute('SELECT brand FROM brand'
+                                           ' WHERE brand IS NOT NULL')),
+            [''])
+        self.assertEqual(
+            self.scratch_db.execute(
+                'SELECT COUNT(*) FROM brand WHERE brand IS NULL'
+                ' AND scraper_id IS NULL').fetchone()[0],
+            1)
+
+    def test_strings_are_interned(self):
+        insert_rows(self.scratch_db, 'brand', [
+            dict(brand='Sprite', company='The Coca-Cola Company',
+                 scraper_id='sr.company'),
+            dict(brand='Coke', company='The Coca-Cola Company',
+                 scraper_id='sr.company'),
+        ])
+        insert_row(self.scratch_db, 'claim', dict(
+            brand='Sprite', company='The Coca-Cola Company',
+            scraper_id='sr.campaign', claim='Tastes like sugar'))
+
+        # claim is not interned
+        self.assertEqual(
+            sorted(row[0] for row in self.scratch_db.execute(
+                'SELECT value FROM interned_string WHERE id > 0')),
+            ['Coke', 'Sprite', 'The Coca-Cola Company',
+             'sr.campaign', 'sr.company'])
+
+        # fact table just has IDs
+        for company, in self.scratch_db.execute(
+                'SELECT company FROM _brand'):
+            self.assertIsInstance(company, int)
+
+
+class TestDumpTableToScratch(DBTestCase):
+
+    SCRATCH_TABLES = ['brand', 'scraper']
+
+    def setUp(self):
+        super().setUp()
+
+        self.input_db = open_db(':memory:')
+
+    def test_prefix_scraper_id(self):
+        create_table(self.input_db, 'scraper', dict(
+            last_scraped='text', scraper_id='text'))
+        insert_rows(self.input_db, 'scraper', [
+            dict(scraper_id='coca_cola', last_scraped='2015-09-18'),
+            dict(last_scraped='2015-09-19'),
+        ])
+
+        dump_table_to_scratch(
+            self.input_db, 'scraper', self.scratch_db, 'sr.company')
+
+        self.assertEqual(
+            select_all(self.scratch_db, 'scraper'),
+            [dict(scraper_id='sr.company.coca_cola',
+                  last_scraped='2015-09-18'),
+             dict(scraper_id='sr.company', last_scraped='2015-09-19')])
+
+    def test_add_scraper_id(self):
+        create_table(self.input_db, 'brand', dict(
+            brand='text', company='text'))
+        insert_rows(self.input_db, 'brand', [
+            dict(brand='Sprite', company='The Coca-Cola Company')])
+
+        dump_table_to_scratch(
+            self.input_db, 'brand', self.scratch_db, 'sr.company')
+
+        self.assertEqual(
+            [strip_null(row) for row in select_all(self.scratch_db, 'brand')],
+            [dict(brand='Sprite',
+                  company='The Coca-Cola Company',
+                  scraper_id='sr.company')])
+
+    def test_ignore_extra_columns(self):
+        create_table(self.input_db, 'brand', dict(
+            brand='text', company='text', html='text'))
+        insert_rows(self.input_db, 'brand', [
+            dict(brand='Sprite', company='The Coca-Cola Company',
+                 html='<html>' + ' ' * 10000 + '</html>')])
+
+        dump_table_to_scratch(
+            self.input_db, 'brand', self.scratch_db, 'sr.company')
+
+        self.assertEqual(
+            [strip_null(row) for row in select_all(self.scratch_db, 'brand')],
+            [dict(brand='Sprite',
+                  company='The Coca-Cola Company',
+                  scraper_id='sr.company')])
+
+    def test_clean_strings(self):
+        create_table(self.input_db, 'brand', dict(
+            brand='text', company='text'))
+        insert_rows(self.input_db, 'brand', [
+            dict(brand=' Kit Kat ', company='Nestle')])
+
+        dump_table_to_scratch(
+            self.input_db, 'brand', self.scratch_db, 'sr.company')
+
+        self.assertEqual(
+            [strip_null(row) for row in select_all(self.scratch_db, 'brand')],
+            [dict(brand='Kit Kat',
+                  company='Nestle',
+                  scraper_id='sr.company')])
+
+    def test_many_rows(self):
+        create_table(self.input_db, 'brand', dict(
+            brand='text', company='text'))
+        insert_rows(self.input_db, 'brand', [
+            dict(brand='Brand {:04d}'.format(i), company='Acme')
+            for i in range(2500)])
+
+        dump_table_to_scratch(
+            self.input_db, 'brand', self.scratch_db, 'sr.company')
+
+        self.assertEqual(
+            len(select_all(self.scratch_db, 'brand')), 2500)
+
+
+class TestSelectCatalog(DBTestCase):
+
+    SCRATCH_TABLES = ['brand', 'company', 'subcategory']
+
+    def test_empty(self):
+        self.assertEqual(select_catalog(self.scratch_db, 'company'), set())
+
+    def test_company(self):
+        insert_rows(self.scratch_db, 'company', [
+            dict(company='Nestle', company_full='Nestle S.A.',
+                 scraper_id='sr.company'),
+            dict(company='Nestle', scraper_id='sr.company'),
+        ])
+        insert_rows(self.scratch_db, 'brand', [
+            dict(brand='Kit Kat', company='Nestle', scraper_id='sr.campaign'),
+            dict(brand='Kit Kat', company='Nestle', scraper_id='sr.campaign'),
+        ])
+
+        self.assertEqual(
+            select_catalog(self.scratch_db, 'company'),
+            {('sr.campaign', 'Nestle'),
+             ('sr.company', 'Nestle'),
+             ('sr.company', 'Nestle S.A.')})
+
+    def test_category(self):
+        insert_rows(self.scratch_db, 'subcategory', [
+            dict(category='Food', subcategory='Chocolate',
+                 scraper_id='sr.campaign')])
+
+        self.assertEqual(
+            select_catalog(self.scratch_db, 'category'),
+            {('sr.campaign', 'Chocolate'), ('sr.campaign', 'Food')})
+        # no companies here
+        self.assertEqual(select_catalog(self.scratch_db, 'company'), set())
+
+
+class TestFillKeyTables(DBTestCase):
+
+    SCRATCH_TABLES = scratch_table_names()
+
+    def test_company_keys(self):
+        insert_rows(self.scratch_db, 'company', [
+            dict(company='Wal-Mart Stores', scraper_id='sr.company'),
+            dict(company='Nestle', company_full='Nestle S.A.',
+                 scraper_id='sr.company'),
+        ])
+
+        fill_key_tables(self.scratch_db)
+        company_keys = select_company_keys(self.scratch_db)
+
+        self.assertEqual(set(company_keys),
+                         {'Nestle', 'Nestle S.A.', 'Wal-Mart Stores'})
+        self.assertIn('walmart stores', company_keys['Wal-Mart Stores'])
+        self.assertIn('wal mart stores', company_keys['Wal-Mart Stores'])
+        self.assertIn('nestle', company_keys['Nestle S.A.'])
+
+    def test_brand_keys(self):
+        insert_rows(self.scratch_db, 'brand', [
+            dict(brand='Kit Kat®', company='Nestle'),
+            dict(brand='™', company='Nestle'),
+        ])
+
+        fill_key_tables(self.scratch_db)
+
+        self.assertEqual(select_brand_keys(self.scratch_db),
+                         {'Kit Kat®': 'kitkat'})
+
+    def test_idempotent(self):
+        insert_rows(self.scratch_db, 'brand', [
+            dict(brand='Kit Kat', company='Nestle')])
+
+        fill_key_tables(self.scratch_db)
+        fill_key_tables(self.scratch_db)
+
+        self.assertEqual(select_brand_keys(self.scratch_db),
+                         {'Kit Kat': 'kitkat'})
+
+
+class TestBuildScratchDBInMemory(DBTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.input_db_path = join(self.tmp_dir, 'sr.company.sqlite')
+
+        with open_db(self.input_db_path) as input_db:
+            create_table(input_db, 'brand', dict(
+                brand='text', company='text'))
+            insert_rows(input_db, 'brand', [
+                dict(brand='Sprite', company='The Coca-Cola Company')])
+
+        self.expected_brand_rows = [
+            dict(brand='Sprite',
+                 company='The Coca-Cola Company',
+                 scraper_id=self.input_db_path[:-len('.sqlite')])]
+
+    def test_in_memory(self):
+        scratch_db = build_scratch_db_in_memory([self.input_db_path])
+
+        self.assertEqual(
+            [strip_null(row) for row in select_all(scratch_db, 'brand')],
+            self.expected_brand_rows)
+
+    def test_save(self):
+        save_path = join(self.tmp_dir, 'msd-scratch.sqlite')
+
+        build_scratch_db_in_memory([self.input_db_path], save_path=save_path)
+
+        self.assertFalse(exists(save_path + '.tmp'))
+
+        saved_db = open_db(save_path, readonly=True)
+
+        self.assertEqual(
+            [strip_null(row) for row in select_all(saved_db, 'brand')],
+            self.expected_brand_rows)
+
+
+class TestBuildScratchDB(DBTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.input_db_path = join(self.tmp_dir, 'sr.company.sqlite')
+        self.scratch_db_path = join(self.tmp_dir, 'msd-scratch.sqlite')
+
+        with open_db(self.input_db_path) as input_db:
+            create_table(input_db, 'brand', dict(
+                brand='text', company='text'))
+            insert_rows(input_db, 'brand', [
+                dict(brand='Sprite', company='The Coca-Cola Company')])
+
+        # make sure the scratch DB is newer than the input DB
+        utime(self.input_db_path, (0, 0))
+
+    def select_brands(self):
+        scratch_db = open_db(self.scratch_db_path, readonly=True)
+        try:
+            return [row['brand'] for row in
+                    scratch_db.execute('SELECT brand FROM brand')]
+        finally:
+            scratch_db.close()
+
+    def test_build(self):
+        build_scratch_db(self.scratch_db_path, [self.input_db_path])
+
+        self.assertEqual(self.select_brands(), ['Sprite'])
+        self.assertEqual(get_scratch_schema_version(self.scratch_db_path),
+                         SCRATCH_SCHEMA_VERSION)
+
+    def test_up_to_date(self):
+        build_scratch_db(self.scratch_db_path, [self.input_db_path])
+        mtime = getmtime(self.scratch_db_path)
+        # old enough that rewriting the file would change its mtime
+        utime(self.scratch_db_path, (mtime - 100, mtime - 100))
+
+        build_scratch_db(self.scratch_db_path, [self.input_db_path])
+
+        self.assertEqual(getmtime(self.scratch_db_path), mtime - 100)
+
+    def test_recompute_out_of_date_keys(self):
+        build_scratch_db(self.scratch_db_path, [self.input_db_path])
+
+        with patch('msd.scratch.company_expansion_version',
+                   return_value='new'):
+            build_scratch_db(self.scratch_db_path, [self.input_db_path])
+
+            self.assertEqual(
+                get_scratch_key_version(self.scratch_db_path), 'new')
+
+        scratch_db = open_db(self.scratch_db_path, readonly=True)
+        self.addCleanup(scratch_db.close)
+        self.assertEqual(select_brand_keys(scratch_db), {'Sprite': 'sprite'})
+
+    def test_rebuild_old_schema(self):
+        # scratch DBs from before schema versions had user_version 0
+        with open_db(self.scratch_db_path) as scratch_db:
+            scratch_db.execute('CREATE TABLE brand (brand TEXT)')
+
+        build_scratch_db(self.scratch_db_path, [self.input_db_path])
+
+        self.assertEqual(self.select_brands(), ['Sprite'])
+        self.assertIn('catalog', show_tables(open_db(self.scratch_db_path)))
@@ -0,0 +1,117 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import sqlite3
+from unittest import TestCase
+from unittest import skipUnless
+from unittest.mock import patch
+
+from msd.search import CREATE_SEARCH_TABLE_SQL
+from msd.search import build_search_table
+from msd.search import search
+from msd.search import search_query_to_match
+
+from ...db import DBTestCase
+from ...db import insert_rows
+
+
+def has_fts5():
+    try:
+        sqlite3.connect(':memory:').execute(CREATE_SEARCH_TABLE_SQL)
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+class TestSearchQueryToMatch(TestCase):
+
+    def test_empty(self):
+        self.assertEqual(search_query_to_match(''), '')
+        self.assertEqual(search_query_to_match(None), '')
+        self.assertEqual(search_query_to_match('&!'), '')
+
+    def test_last_word_is_prefix(self):
+        self.assertEqual(search_query_to_match('organic cof'),
+                         '"organic" "cof"*')
+
+    def test_strip_punctuation(self):
+        self.assertEqual(search_query_to_match('"Coca-Cola" OR'),
+                         '"Coca" "Cola" "OR"*')
+
+
+@skipUnless(has_fts5(), 'SQLite was built without FTS5')
+class TestSearch(DBTestCase):
+
+    OUTPUT_TABLES = ['brand', 'category', 'company_name']
+
+    def setUp(self):
+        super().setUp()
+
+        insert_rows(self.output_db, 'company_name', [
+            dict(company='The Coca-Cola Company', company_name='Coca-Cola'),
+            dict(company='The Coca-Cola Company',
+                 company_name='The Coca-Cola Company'),
+            dict(company='Nestlé', company_name='Nestlé'),
+        ])
+        insert_rows(self.output_db, 'brand', [
+            dict(company='The Coca-Cola Company', brand='Sprite'),
+            dict(company='Nestlé', brand='Nescafé'),
+        ])
+        insert_rows(self.output_db, 'category', [
+            dict(company='Nestlé', brand='Nescafé',
+                 category='Organic Coffee'),
+        ])
+
+        self.assertTrue(build_search_table(self.output_db))
+
+    def test_prefix(self):
+        self.assertEqual(
+            search(self.output_db, 'coca', kinds=['company']),
+            [dict(kind='company', name='Coca-Cola',
+                  company='The Coca-Cola Company', brand=''),
+             dict(kind='company', name='The Coca-Cola Company',
+                  company='The Coca-Cola Company', brand='')])
+
+    def test_words(self):
+        self.assertEqual(
+            search(self.output_db, 'organic cof'),
+            [dict(kind='category', name='Organic Coffee',
+                  company='Nestlé', brand='Nescafé')])
+
+    def test_diacritics(self):
+        self.assertEqual(
+            [r['name'] for r in search(self.output_db, 'nescafe')],
+            ['Nescafé'])
+
+    def test_kinds(self):
+        self.assertEqual(
+            search(self.output_db, 'sprite', kinds=['brand']),
+            [dict(kind='brand', name='Sprite',
+                  company='The Coca-Cola Company', brand='Sprite')])
+        self.assertEqual(
+            search(self.output_db, 'sprite', kinds=['category']), [])
+
+    def test_limit(self):
+        self.assertEqual(
+            len(search(self.output_db, 'coca', limit=1)), 1)
+
+    def test_no_words(self):
+        self.assertEqual(search(self.output_db, '--'), [])
+
+
+class TestBuildSearchTableWithoutFTS5(DBTestCase):
+
+    def test_skip(self):
+        with patch('msd.search.CREATE_SEARCH_TABLE_SQL',
+                   'CREATE VIRTUAL TABLE search USING no_such_module(name)'):
+            self.assertFalse(build_search_table(self.output_db))
@@ -0,0 +1,183 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from unittest import TestCase
+
+from msd.db import open_db
+from msd.db import show_tables
+from msd.merge import create_output_table
+from msd.subset import OutputSpec
+from msd.subset import fill_subset_dbs
+from msd.subset import parse_output_spec
+
+from ...db import DBTestCase
+from ...db import insert_rows
+from ...db import select_all
+from ...db import strip_null
+
+
+class TestParseOutputSpec(TestCase):
+
+    def test_path_only(self):
+        self.assertEqual(parse_output_spec('msd-all.sqlite'),
+                         OutputSpec('msd-all.sqlite'))
+
+    def test_filters(self):
+        self.assertEqual(
+            parse_output_spec(
+                'msd-us.sqlite?hq_country=US,CA&campaign_id=a'
+                '&table=company&table=rating'),
+            OutputSpec('msd-us.sqlite',
+                       campaign_ids=['a'],
+                       hq_countries=['US', 'CA'],
+                       tables=['company', 'rating']))
+
+    def test_unknown_param(self):
+        self.assertRaises(ValueError, parse_output_spec, 'msd.sqlite?foo=1')
+
+    def test_bad_query(self):
+        self.assertRaises(ValueError, parse_output_spec, 'msd.sqlite?foo')
+
+
+class TestFillSubsetDBs(DBTestCase):
+
+    OUTPUT_TABLES = [
+        'brand', 'campaign', 'claim', 'company', 'rating', 'subcategory']
+
+    def setUp(self):
+        super().setUp()
+
+        insert_rows(self.output_db, 'campaign', [
+            dict(campaign_id='a'),
+            dict(campaign_id='b'),
+        ])
+        insert_rows(self.output_db, 'company', [
+            dict(company='Kraft', hq_country='US'),
+            dict(company='Nestlé', hq_country='CH'),
+            dict(company='Unilever', hq_country='GB'),
+        ])
+        insert_rows(self.output_db, 'brand', [
+            dict(company='Kraft', brand='Velveeta'),
+            dict(company='Nestlé', brand='Nespresso'),
+            dict(company='Unilever', brand='Axe'),
+        ])
+        insert_rows(self.output_db, 'rating', [
+            dict(campaign_id='a', company='Kraft', brand='', judgment=1),
+            dict(campaign_id='b', company='Kraft', brand='', judgment=0),
+            dict(campaign_id='b', company='Nestlé', brand='Nespresso',
+                 judgment=-1),
+        ])
+        insert_rows(self.output_db, 'claim', [
+            dict(campaign_id='a', company='Unilever', brand='Axe',
+                 claim='x', judgment=-1),
+        ])
+        insert_rows(self.output_db, 'subcategory', [
+            dict(category='Food', subcategory='Cheese'),
+        ])
+
+    def fill(self, *specs):
+        subset_dbs = [open_db(':memory:') for _ in specs]
+        for subset_db in subset_dbs:
+            self.addCleanup(subset_db.close)
+
+        fill_subset_dbs(self.output_db, list(zip(specs, subset_dbs)))
+
+        return subset_dbs
+
+    def select(self, db, table_name, col):
+        return sorted(row[col] for row in select_all(db, table_name))
+
+    def test_no_filters(self):
+        (db,) = self.fill(OutputSpec('msd-all.sqlite'))
+
+        for table_name in self.OUTPUT_TABLES:
+            self.assertEqual(
+                [strip_null(row) for row in select_all(db, table_name)],
+                [strip_null(row)
+                 for row in select_all(self.output_db, table_name)])
+
+    def test_campaign_ids(self):
+        (db,) = self.fill(OutputSpec('msd-a.sqlite', campaign_ids=['a']))
+
+        self.assertEqual(self.select(db, 'campaign', 'campaign_id'), ['a'])
+        self.assertEqual(self.select(db, 'rating', 'campaign_id'), ['a'])
+        self.assertEqual(self.select(db, 'claim', 'campaign_id'), ['a'])
+        self.assertEqual(self.select(db, 'company', 'company'),
+                         ['Kraft', 'Unilever'])
+        self.assertEqual(self.select(db, 'brand', 'brand'),
+                         ['Axe', 'Velveeta'])
+        # not about any company or campaign
+        self.assertEqual(self.select(db, 'subcategory', 'subcategory'),
+                         ['Cheese'])
+
+    def test_hq_countries(self):
+        (db,) = self.fill(OutputSpec('msd-eu.sqlite',
+                                     hq_countries=['CH', 'GB']))
+
+        self.assertEqual(self.select(db, 'campaign', 'campaign_id'),
+                         ['a', 'b'])
+        self.assertEqual(self.select(db, 'company', 'company'),
+                         ['Nestlé', 'Unilever'])
+        self.assertEqual(self.select(db, 'brand', 'brand'),
+                         ['Axe', 'Nespresso'])
+        self.assertEqual(self.select(db, 'rating', 'company'), ['Nestlé'])
+
+    def test_near_duplicates(self):
+        create_output_table(self.output_db, 'near_duplicate')
+        insert_rows(self.output_db, 'near_duplicate', [
+            dict(kind='company', company='', name='Kraft',
+                 similar_name='Kraft Heinz', similarity=0.7),
+            dict(kind='company', company='', name='Nestlé',
+                 similar_name='Nestle', similarity=0.8),
+            dict(kind='brand', company='Nestlé', name='Nespresso',
+                 similar_name='Nesspresso', similarity=0.9),
+            dict(kind='brand', company='Unilever', name='Axe',
+                 similar_name='Axe Body', similarity=0.6),
+        ])
+        insert_rows(self.output_db, 'company', [
+            dict(company='Nestle', hq_country='CH')])
+
+        (db,) = self.fill(OutputSpec('msd-ch.sqlite', hq_countries=['CH']))
+
+        # Kraft isn't in the subset, so leave out names similar to it
+        self.assertEqual(
+            sorted((row['kind'], row['name'])
+                   for row in select_all(db, 'near_duplicate')),
+            [('brand', 'Nespresso'), ('company', 'Nestlé')])
+
+    def test_campaign_ids_and_hq_countries(self):
+        (db,) = self.fill(OutputSpec('msd-b-us.sqlite', campaign_ids=['b'],
+                                     hq_countries=['US']))
+
+        self.assertEqual(self.select(db, 'company', 'company'), ['Kraft'])
+        self.assertEqual(self.select(db, 'rating', 'campaign_id'), ['b'])
+
+    def test_tables(self):
+        (db,) = self.fill(OutputSpec('msd-companies.sqlite',
+                                     tables=['company']))
+
+        self.assertEqual(show_tables(db), ['company'])
+
+    def test_unknown_table(self):
+        self.assertRaises(ValueError, self.fill,
+                          OutputSpec('msd-foo.sqlite', tables=['foo']))
+
+    def test_several_subsets(self):
+        db_a, db_ch = self.fill(
+            OutputSpec('msd-a.sqlite', campaign_ids=['a']),
+            OutputSpec('msd-ch.sqlite', hq_countries=['CH']))
+
+        self.assertEqual(self.select(db_a, 'company', 'company'),
+                         ['Kraft', 'Unilever'])
+        self.assertEqual(self.select(db_ch, 'company', 'company'),
+                         ['Nestlé'])
@@ -0,0 +1,146 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from msd.claim import CLAIM_KEY_COLS
+from msd.claim import merge_claim_group
+from msd.db import insert_row
+from msd.rating import RATING_KEY_COLS
+from msd.rating import merge_rating_group
+from msd.target import build_target_tables
+from msd.target import select_groups_by_target
+from msd.target import select_groups_by_target_for_tables
+
+from ...db import DBTestCase
+from ...db import insert_rows
+from ...db import select_all
+from ...db import strip_null
+
+
+class TestSelectGroupsByTarget(DBTestCase):
+
+    SCRATCH_TABLES = ['rating']
+
+    OUTPUT_TABLES = ['scraper_brand_map', 'scraper_company_map']
+
+    def setUp(self):
+        super().setUp()
+
+        # two scrapers that map to the same company
+        insert_rows(self.output_db, 'scraper_company_map', [
+            dict(scraper_id='sr.campaign.a', company='Foo',
+                 scraper_company='Foo Inc.'),
+            dict(scraper_id='sr.campaign.b', company='Foo',
+                 scraper_company='Foo'),
+        ])
+
+    def select_groups(self, key_cols=()):
+        return [(target, key, [row['score'] for row in rows])
+                for target, key, rows in select_groups_by_target(
+                    self.output_db, self.scratch_db, 'rating', key_cols)]
+
+    def test_empty(self):
+        self.assertEqual(self.select_groups(['campaign_id']), [])
+
+    def test_groups_in_key_order(self):
+        insert_rows(self.scratch_db, 'rating', [
+            dict(scraper_id='sr.campaign.b', company='Foo', brand='',
+                 campaign_id='b', score=1),
+            dict(scraper_id='sr.campaign.a', company='Foo Inc.', brand='',
+                 campaign_id='b', score=2),
+            dict(scraper_id='sr.campaign.a', company='Foo Inc.', brand='',
+                 campaign_id='a', score=3),
+            dict(scraper_id='sr.campaign.b', company='Foo', brand='',
+                 campaign_id=None, score=4),
+        ])
+
+        # rows with the same key are in order of scraper_company_map
+        self.assertEqual(
+            self.select_groups(['campaign_id']),
+            [(('Foo', ''), (None,), [4]),
+             (('Foo', ''), ('a',), [3]),
+             (('Foo', ''), ('b',), [2, 1])])
+
+    def test_no_key_cols(self):
+        insert_rows(self.scratch_db, 'rating', [
+            dict(scraper_id='sr.campaign.b', company='Foo', brand='',
+                 campaign_id='b', score=1),
+            dict(scraper_id='sr.campaign.a', company='Foo Inc.', brand='',
+                 campaign_id='a', score=2),
+        ])
+
+        self.assertEqual(
+            self.select_groups(),
+            [(('Foo', ''), (), [2, 1])])
+
+    def test_brand(self):
+        insert_row(self.output_db, 'scraper_brand_map', dict(
+            scraper_id='sr.campaign.a', company='Foo', brand='Bar',
+            scraper_company='Foo Inc.', scraper_brand='BAR'))
+        insert_row(self.scratch_db, 'rating', dict(
+            scraper_id='sr.campaign.a', company='Foo Inc.', brand='BAR',
+            campaign_id='a', score=5))
+
+        self.assertEqual(
+            self.select_groups(['campaign_id']),
+            [(('Foo', 'Bar'), ('a',), [5])])
+
+
+class TestSelectGroupsByTargetForTables(DBTestCase):
+
+    SCRATCH_TABLES = ['claim', 'rating']
+
+    OUTPUT_TABLES = ['scraper_brand_map', 'scraper_company_map']
+
+    def setUp(self):
+        super().setUp()
+
+        insert_row(self.output_db, 'scraper_company_map', dict(
+            scraper_id='sr.campaign.a', company='Foo',
+            scraper_company='Foo Inc.'))
+
+        insert_rows(self.scratch_db, 'claim', [
+            dict(scraper_id='sr.campaign.a', company='Foo Inc.', brand='',
+                 campaign_id='a', claim='uses recycled foo', judgment=1),
+            dict(scraper_id='sr.campaign.a', company='Foo Inc.', brand='',
+                 campaign_id='a', claim='', judgment=1),
+        ])
+        insert_row(self.scratch_db, 'rating', dict(
+            scraper_id='sr.campaign.a', company='Foo Inc.', brand='',
+            campaign_id='a', grade='b+'))
+
+    def test_select(self):
+        self.assertEqual(
+            [(target, table_name, key, len(list(rows)))
+             for target, table_name, key, rows in
+             select_groups_by_target_for_tables(
+                 self.output_db, self.scratch_db,
+                 dict(claim=CLAIM_KEY_COLS, rating=RATING_KEY_COLS))],
+            [(('Foo', ''), 'claim', ('a', ''), 1),
+             (('Foo', ''), 'claim', ('a', 'uses recycled foo'), 1),
+             (('Foo', ''), 'rating', ('a',), 1)])
+
+    def test_build_target_tables(self):
+        build_target_tables(self.output_db, self.scratch_db, dict(
+            claim=(CLAIM_KEY_COLS, merge_claim_group),
+            rating=(RATING_KEY_COLS, merge_rating_group),
+        ))
+
+        self.assertEqual(
+            [strip_null(row) for row in select_all(self.output_db, 'claim')],
+            [dict(campaign_id='a', company='Foo', brand='', scope='',
+                  claim='uses recycled foo', judgment=1)])
+
+        self.assertEqual(
+            [strip_null(row) for row in select_all(self.output_db, 'rating')],
+            [dict(campaign_id='a', company='Foo', brand='', scope='',
+                  grade='B+', judgment=1)])
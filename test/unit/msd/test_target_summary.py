@@ -0,0 +1,116 @@
+# Copyright 2015 SpendRight, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from msd.target_summary import build_target_summary_table
+
+from ...db import DBTestCase
+from ...db import insert_rows
+from ...db import select_all
+
+NO_JUDGMENTS = dict(
+    num_campaigns=0,
+    num_negative_claims=0,
+    num_negative_ratings=0,
+    num_neutral_claims=0,
+    num_neutral_ratings=0,
+    num_positive_claims=0,
+    num_positive_ratings=0,
+)
+
+
+class TestBuildTargetSummaryTable(DBTestCase):
+
+    OUTPUT_TABLES = ['brand', 'claim', 'company', 'rating']
+
+    def get_summary(self):
+        build_target_summary_table(self.output_db, self.scratch_db)
+
+        return {(row['company'], row['brand']): row
+                for row in select_all(self.output_db, 'target_summary')}
+
+    def test_empty(self):
+        self.assertEqual(self.get_summary(), {})
+
+    def test_summary(self):
+        insert_rows(self.output_db, 'company', [
+            dict(company='Kraft'),
+            dict(company='Mondelēz'),
+        ])
+        insert_rows(self.output_db, 'brand', [
+            dict(company='Kraft', brand='Oscar Mayer'),
+            dict(company='Kraft', brand='Velveeta'),
+        ])
+        insert_rows(self.output_db, 'rating', [
+            dict(campaign_id='a', company='Kraft', brand='', judgment=1),
+            dict(campaign_id='b', company='Kraft', brand='', judgment=-1),
+            dict(campaign_id='c', company='Kraft', brand='', judgment=1),
+            dict(campaign_id='a', company='Kraft', brand='Oscar Mayer',
+                 judgment=0),
+            dict(campaign_id='b', company='Kraft', brand='Oscar Mayer',
+                 judgment=-1),
+        ])
+        insert_rows(self.output_db, 'claim', [
+            dict(campaign_id='a', company='Kraft', brand='Oscar Mayer',
+                 claim='x', judgment=-1),
+            dict(campaign_id='d', company='Kraft', brand='Oscar Mayer',
+                 claim='y', judgment=1),
+            dict(campaign_id='d', company='Kraft', brand='Oscar Mayer',
+                 claim='z', judgment=0),
+        ])
+
+        summary = self.get_summary()
+
+        self.assertEqual(
+            summary[('Kraft', '')],
+            dict(NO_JUDGMENTS,
+                 company='Kraft', brand='',
+                 num_campaigns=3,
+                 num_negative_ratings=1,
+                 num_positive_ratings=2,
+                 judgment=1, company_judgment=1))
+
+        self.assertEqual(
+            summary[('Kraft', 'Oscar Mayer')],
+            dict(company='Kraft', brand='Oscar Mayer',
+                 num_campaigns=3,
+                 num_negative_claims=1,
+                 num_negative_ratings=1,
+                 num_neutral_claims=1,
+                 num_neutral_ratings=1,
+                 num_positive_claims=1,
+                 num_positive_ratings=0,
+                 judgment=-1, company_judgment=1))
+
+        # brands with no judgments of their own still inherit
+        self.assertEqual(
+            summary[('Kraft', 'Velveeta')],
+            dict(NO_JUDGMENTS,
+                 company='Kraft', brand='Velveeta',
+                 judgment=None, company_judgment=1))
+
+        self.assertEqual(
+            summary[('Mondelēz', '')],
+            dict(NO_JUDGMENTS,
+                 company='Mondelēz', brand='',
+                 judgment=None, company_judgment=None))
+
+    def test_mixed_judgments_are_neutral(self):
+        insert_rows(self.output_db, 'rating', [
+            dict(campaign_id='a', company='Kraft', brand='', judgment=1),
+            dict(campaign_id='b', company='Kraft', brand='', judgment=-1),
+        ])
+
+        summary = self.get_summary()
+
+        self.assertEqual(summary[('Kraft', '')]['judgment'], 0)
+        self.assertEqual(summary[('Kraft', '')]['company_judgment'], 0)